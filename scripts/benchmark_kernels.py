@@ -0,0 +1,91 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import print_function
+
+import imp
+import logging
+import os
+from datetime import datetime, timedelta
+from time import time
+
+TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sphere_plugins', 'sphere', 'tools')
+
+
+class Source(object):
+    """
+    A stand in for a stream view, which gives the same instances for any interval
+    """
+    def __init__(self, instances):
+        self.instances = instances
+
+    def window(self, time_interval, force_calculation=False):
+        return iter(self.instances)
+
+
+def synthetic_instances(n_samples, width):
+    from hyperstream.stream import StreamInstance
+    from hyperstream.utils import UTC
+    t = datetime(2017, 1, 1, tzinfo=UTC)
+    return [StreamInstance(t + timedelta(milliseconds=50 * i), [float((i * (j + 3)) % 97) for j in range(width)])
+            for i in range(n_samples)]
+
+
+def samples_per_second(tool, instances):
+    from hyperstream import TimeInterval
+    interval = TimeInterval(instances[0].timestamp - timedelta(seconds=1), instances[-1].timestamp)
+    t = time()
+    result = list(tool._execute(sources=[Source(instances)], alignment_stream=None, interval=interval))
+    return result, len(instances) / (time() - t)
+
+
+def run(n_samples=100000, loglevel=logging.INFO):
+    logging.basicConfig(level=loglevel)
+
+    import numpy as np
+
+    print("{:19s} {:>14s} {:>14s} {:>14s}".format("samples/sec", "per instance", "block", "kernel only"))
+    for name, cls, kernel, width in (('calc_acc_magnitude', 'CalcAccMagnitude', 'magnitudes', 3),
+                                     ('calc_bb_area', 'CalcBbArea', 'areas', 4),
+                                     ('calc_bb_volume', 'CalcBbVolume', 'volumes', 6)):
+        module = imp.load_source(name, os.path.join(TOOLS, name, '2017-03-03_v0.0.1.py'))
+        instances = synthetic_instances(n_samples, width)
+
+        per_instance, per_instance_rate = samples_per_second(getattr(module, cls)(), instances)
+        (block,), block_rate = samples_per_second(getattr(module, cls)(block=True), instances)
+        timestamps, values = block.value
+        assert timestamps == [i.timestamp for i in per_instance]
+        assert values.tolist() == [i.value for i in per_instance]
+
+        # the block tools still have to read the samples into an array, which the kernels alone do not
+        samples = np.array([value for _, value in instances])
+        t = time()
+        getattr(module, kernel)(samples)
+        kernel_rate = n_samples / (time() - t)
+        print("{:19s} {:14.0f} {:14.0f} {:14.0f}".format(name + ":", per_instance_rate, block_rate, kernel_rate))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from sphere_plugins.sphere.utils import ArgumentParser
+    args = ArgumentParser.logging_parser(default_loglevel=logging.INFO)
+    run(loglevel=args.loglevel)
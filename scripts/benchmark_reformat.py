@@ -0,0 +1,80 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import print_function
+
+import imp
+import logging
+import os
+from copy import deepcopy
+from datetime import datetime, timedelta
+from time import time
+
+TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sphere_plugins', 'sphere', 'tools')
+
+
+def synthetic_wearable_docs(n_docs):
+    from hyperstream.utils import UTC
+    t = datetime(2017, 1, 1, tzinfo=UTC)
+    return [dict(datetime=t + timedelta(milliseconds=50 * i), hid='1', uid='a0e6f8c3b2d1', x=i % 7 - 3.0,
+                 y=i % 5 - 2.0, z=i % 3 - 1.0, gw=[dict(aid=aid, rssi=-60.0 - (i + aid) % 30) for aid in range(4)])
+            for i in range(n_docs)]
+
+
+def deepcopy_reformat(doc, default_house='1'):
+    """
+    The previous implementation of reformat, for comparison
+    """
+    from hyperstream.stream import StreamInstance, StreamMetaInstance
+    doc = deepcopy(doc)
+    dt = doc.pop('datetime')
+    if 'hid' in doc and doc['hid'] is not None:
+        house_id = doc.pop('hid')
+    else:
+        house_id = default_house
+    return StreamMetaInstance(stream_instance=StreamInstance(dt, doc), meta_data=('house', house_id))
+
+
+def docs_per_second(func, docs):
+    t = time()
+    for doc in docs:
+        func(doc)
+    return len(docs) / (time() - t)
+
+
+def run(n_docs=100000, loglevel=logging.INFO):
+    logging.basicConfig(level=loglevel)
+    docs = synthetic_wearable_docs(n_docs)
+
+    sphere = imp.load_source('sphere_tool', os.path.join(TOOLS, 'sphere', '2017-04-21_v0.2.0.py'))
+    tool = sphere.Sphere(modality='wearable')
+
+    assert tool.reformat(docs[0]) == deepcopy_reformat(docs[0])
+    print("deepcopy reformat:  {:8.0f} docs/sec".format(docs_per_second(deepcopy_reformat, docs)))
+    print("shallow reformat:   {:8.0f} docs/sec".format(docs_per_second(tool.reformat, docs)))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from sphere_plugins.sphere.utils import ArgumentParser
+    args = ArgumentParser.logging_parser(default_loglevel=logging.INFO)
+    run(loglevel=args.loglevel)
@@ -0,0 +1,80 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import print_function
+
+import logging
+from datetime import timedelta
+from time import time
+
+
+def timed(func, *args):
+    t = time()
+    result = func(*args)
+    return result, time() - t
+
+
+def run(n_docs=100000, loglevel=logging.INFO):
+    from hyperstream import HyperStream, TimeInterval, StreamId, StreamInstance
+    from hyperstream.utils import utcnow
+
+    hyperstream = HyperStream(loglevel=loglevel, file_logger=None)
+    X = hyperstream.channel_manager.summary
+
+    stream_id = StreamId("benchmark_summary_channel", meta_data=(("house", "0"),))
+    stream = X.get_or_create_stream(stream_id)
+
+    t2 = utcnow().replace(microsecond=0)
+    t1 = t2 - timedelta(seconds=n_docs)
+    time_interval = TimeInterval(t1 - timedelta(seconds=1), t2)
+    values = dict(p25=0.25, p50=0.5, p75=0.75, count=4)
+
+    try:
+        instances = [StreamInstance(t1 + timedelta(seconds=i), values) for i in range(n_docs)]
+
+        def execute():
+            # As Tool.execute does: one writer call per instance, written out when the interval is calculated
+            for instance in instances:
+                stream.writer(instance)
+            stream.calculated_intervals += time_interval
+
+        _, elapsed = timed(execute)
+        print("batched write:      {:8.0f} docs/sec".format(n_docs / elapsed))
+
+        for label, func in (("document read:", X.get_results_documents), ("raw cursor read:", X.get_results)):
+            result, elapsed = timed(lambda: list(func(stream, time_interval)))
+            assert len(result) == n_docs
+            print("{:19s} {:8.0f} docs/sec".format(label, n_docs / elapsed))
+    finally:
+        X.purge_stream(stream_id, remove_definition=True)
+        from mongoengine.context_managers import switch_db
+        from sphere_plugins.sphere.channels.summary_channel import SummaryInstanceModel
+        with switch_db(SummaryInstanceModel, 'hyperstream'):
+            SummaryInstanceModel.objects(__raw__=stream_id.as_raw()).delete()
+
+
+if __name__ == '__main__':
+    import sys
+    from os import path
+    sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+    from sphere_plugins.sphere.utils import ArgumentParser
+    args = ArgumentParser.logging_parser(default_loglevel=logging.INFO)
+    run(loglevel=args.loglevel)
@@ -20,22 +20,19 @@
 
 import logging
 
-globs = {'sphere_connector': None}
-
 
 def run(delete_existing_workflows=True, loglevel=logging.INFO):
     from hyperstream import HyperStream, TimeInterval
-    from workflows.deploy_summariser import create_workflow_coord_plate_creation, create_workflow_summariser
-    from sphere_connector_package.sphere_connector import SphereConnector
+    from workflows.deploy_summariser import create_workflow_coord_plate_creation, create_workflow_summariser, \
+        SUMMARISER_SOURCES
+    from sphere_plugins.sphere.channels.sphere_channel import get_sphere_connector
+    from sphere_plugins.sphere.channels.projection import log_dropped_fields_report
+    from sphere_plugins.sphere.channels.shared_scan import SharedScan
 
     hyperstream = HyperStream(loglevel=loglevel, file_logger=None)
 
-    if not globs['sphere_connector']:
-        globs['sphere_connector'] = SphereConnector(
-            config_filename='config.json',
-            include_mongo=True,
-            include_redcap=False,
-            sphere_logger=None)
+    # Connect up front, so that a missing config.json fails early
+    get_sphere_connector()
 
     workflow_id = "coord3d_plate_creation"
     if delete_existing_workflows:
@@ -65,11 +62,14 @@ def run(delete_existing_workflows=True, loglevel=logging.INFO):
                                        safe=False)
         hyperstream.workflow_manager.commit_workflow(workflow_id)
 
+    # The sphere tool factors of the summariser all read from one data window per interval
     time_interval = TimeInterval.now_minus(minutes=1)
-    w.execute(time_interval)
+    with SharedScan(SUMMARISER_SOURCES.values()):
+        w.execute(time_interval)
 
     print('number of non_empty_streams: {}'.format(
         len(hyperstream.channel_manager.memory.non_empty_streams)))
+    log_dropped_fields_report()
 
 
 if __name__ == '__main__':
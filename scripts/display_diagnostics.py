@@ -28,24 +28,16 @@ import signal
 import pandas as pd
 import numpy as np
 
-globs = { 'sphere_connector': None }
-
 
 def display_diagnostics(house):
     from hyperstream.utils import utcnow
-    from sphere_connector_package.sphere_connector import SphereConnector, DataWindow
-
-    if not globs['sphere_connector']:
-        globs['sphere_connector'] = SphereConnector(
-            config_filename='config.json',
-            include_mongo=True,
-            include_redcap=False,
-            sphere_logger=None)
+    from sphere_connector_package.sphere_connector import DataWindow
+    from sphere_plugins.sphere.channels.sphere_channel import get_sphere_connector
 
     t2 = utcnow()
     t1 = t2 - timedelta(seconds=60)
 
-    sphere_connector = globs['sphere_connector']
+    sphere_connector = get_sphere_connector()
     window = DataWindow(sphere_connector, t1, t2)
     rss = window.wearable.get_data(elements={'rss'}, rename_keys=False)
     # aids = set(d['aid'] for d in filter(lambda x: x['hid'] == house if 'hid' in x else True, docs))
@@ -20,22 +20,16 @@
 
 import logging
 
-globs = {'sphere_connector': None}
-
 
 def run(delete_existing_workflows=True, loglevel=logging.INFO):
     from hyperstream import HyperStream, TimeInterval
     from workflows.meta_summariser import create_workflow_meta_summariser
-    from sphere_connector_package.sphere_connector import SphereConnector
+    from sphere_plugins.sphere.channels.sphere_channel import get_sphere_connector
 
     hyperstream = HyperStream(loglevel=loglevel, file_logger=None)
 
-    if not globs['sphere_connector']:
-        globs['sphere_connector'] = SphereConnector(
-            config_filename='config.json',
-            include_mongo=True,
-            include_redcap=False,
-            sphere_logger=None)
+    # Connect up front, so that a missing config.json fails early
+    get_sphere_connector()
 
     # workflow_id = "coord3d_plate_creation"
     # if delete_existing_workflows:
@@ -0,0 +1,74 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import print_function
+
+import logging
+
+
+def migrate(collection, time_field, old_indexes):
+    """
+    Add the stream_key to every document of a summary collection, then swap the embedded stream_id indexes for the
+    stream_key one
+    :param collection: The pymongo collection
+    :param time_field: The time field that follows the stream_key in the unique index
+    :param old_indexes: The names of the indexes to drop
+    :return: None
+    """
+    from sphere_plugins.sphere.channels.summary_channel import ensure_stream_key_index
+    from sphere_plugins.sphere.utils.stream_keys import summary_stream_key
+
+    for stream_id in collection.distinct('stream_id', {'stream_key': {'$exists': False}}):
+        result = collection.update_many(
+            {'stream_id': stream_id, 'stream_key': {'$exists': False}},
+            {'$set': {'stream_key': summary_stream_key(stream_id)}})
+        logging.info("{}: set stream_key on {} documents for {}".format(
+            collection.name, result.modified_count, stream_id))
+
+    ensure_stream_key_index(collection, time_field)
+
+    existing = collection.index_information()
+    for name in old_indexes:
+        if name in existing:
+            collection.drop_index(name)
+            logging.info("{}: dropped index {}".format(collection.name, name))
+
+
+def run(loglevel=logging.INFO):
+    from hyperstream import HyperStream
+    from mongoengine.connection import get_db
+    from sphere_plugins.sphere.channels.summary_channel import SummaryInstanceModel, SummaryBucketModel
+
+    HyperStream(loglevel=loglevel, file_logger=None)
+
+    for model, time_field in ((SummaryInstanceModel, 'datetime'), (SummaryBucketModel, 'day')):
+        # Go through pymongo directly, since the channel refuses to use a collection that has not been migrated
+        collection = get_db('hyperstream')[model._meta['collection']]
+        migrate(collection, time_field, old_indexes=['stream_id_1', 'stream_id_1_{}_1'.format(time_field)])
+
+
+if __name__ == '__main__':
+    import sys
+    from os import path
+    sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+    from sphere_plugins.sphere.utils import ArgumentParser
+    args = ArgumentParser.logging_parser(default_loglevel=logging.INFO)
+    run(loglevel=args.loglevel)
@@ -22,20 +22,14 @@ import logging
 from dateutil.parser import parse
 import pandas as pd
 
-globs = {'sphere_connector': None}
-
 
 def run(delete_existing_workflows=True, loglevel=logging.INFO):
     from hyperstream import HyperStream, TimeInterval
     from workflows.summaries_to_csv import create_workflow_summaries_to_csv
-    from sphere_connector_package.sphere_connector import SphereConnector
-
-    if not globs['sphere_connector']:
-        globs['sphere_connector'] = SphereConnector(
-            config_filename='config.json',
-            include_mongo=True,
-            include_redcap=False,
-            sphere_logger=None)
+    from sphere_plugins.sphere.channels.sphere_channel import get_sphere_connector
+
+    # Connect up front, so that a missing config.json fails early
+    get_sphere_connector()
 
     hyperstream = HyperStream(loglevel=loglevel, file_logger=None)
 
@@ -18,6 +18,14 @@
 #  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
 #  OR OTHER DEALINGS IN THE SOFTWARE.
 
+# Parameters of the sphere tools that feed the summariser, which can share one scan of the database per interval
+SUMMARISER_SOURCES = dict(
+    env=dict(modality="environmental"),
+    rss=dict(modality="wearable", elements={"rss"}, fields={"uid", "aid", "wearable-rss"}),
+    acc=dict(modality="wearable", elements={"xl"}, fields={"uid", "wearable-xl1"}),
+    vid=dict(modality="video")
+)
+
 
 def create_workflow_coord_plate_creation(hyperstream, safe=True):
     workflow_id = "coord3d_plate_creation"
@@ -249,7 +257,7 @@ def create_workflow_summariser(hyperstream,
         w.create_multi_output_factor(
             tool=hyperstream.channel_manager.get_tool(
                 name="sphere",
-                parameters=dict(modality="environmental")
+                parameters=SUMMARISER_SOURCES["env"]
             ),
             source=None,
             splitting_node=None,
@@ -372,7 +380,7 @@ def create_workflow_summariser(hyperstream,
         w.create_multi_output_factor(
            tool=hyperstream.channel_manager.get_tool(
                name="sphere",
-               parameters=dict(modality="wearable",elements={"rss"})
+               parameters=SUMMARISER_SOURCES["rss"]
            ),
            source=None,
            splitting_node=None,
@@ -479,7 +487,7 @@ def create_workflow_summariser(hyperstream,
         w.create_multi_output_factor(
            tool=hyperstream.channel_manager.get_tool(
                name="sphere",
-               parameters=dict(modality="wearable", elements={"xl"})
+               parameters=SUMMARISER_SOURCES["acc"]
            ),
            source=None,
            splitting_node=None,
@@ -632,7 +640,7 @@ def create_workflow_summariser(hyperstream,
         w.create_multi_output_factor(
             tool=hyperstream.channel_manager.get_tool(
                 name="sphere",
-                parameters=dict(modality="video")
+                parameters=SUMMARISER_SOURCES["vid"]
             ),
             source=None,
             splitting_node=None,
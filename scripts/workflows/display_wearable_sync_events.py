@@ -47,7 +47,6 @@ def create_workflow_list_wearable_sync_events(hyperstream, house, safe=True):
             ("acc_per_uid_acclist",              S, [wearables]),
             ("acc_per_uid_magnitude",            D, [wearables]),
             ("acc_per_uid_windows",              S, [wearables]),
-            ("acc_per_uid_magnitude_agg",        S, [wearables]),
             ("acc_per_uid_magnitude_agg_5_taps", D, [wearables]),
             ("experiments_list",                 M, [houses]),  # Current annotation data in 2s windows
             ("experiments_dataframe",            M, [houses]),  # Current annotation data in 2s windows
@@ -100,24 +99,17 @@ def create_workflow_list_wearable_sync_events(hyperstream, house, safe=True):
             sources=None,
             sink=N["acc_per_uid_windows"])
 
-        w.create_factor(
-            tool=hyperstream.channel_manager.get_tool(
-                name="sliding_listify",
-                parameters=dict(include_time=True)
-            ),
-            sources=[N["acc_per_uid_windows"], N["acc_per_uid_magnitude"]],
-            sink=N["acc_per_uid_magnitude_agg"])
-
         # now need to find the 5 taps.
         # tap: magnitude above 2.0 and higher than neighbours
         # find all 4 sec intervals with at least 3 taps and no taps in the surrounding 3 sec
         # print them out
+        # the detector keeps only the current window of magnitudes rather than a list per window
         w.create_factor(
             tool=hyperstream.channel_manager.get_tool(
                 name="detect_5_taps",
                 parameters=dict()
             ),
-            sources=[N["acc_per_uid_magnitude_agg"]],
+            sources=[N["acc_per_uid_windows"], N["acc_per_uid_magnitude"]],
             sink=N["acc_per_uid_magnitude_agg_5_taps"])
 
         return w
@@ -20,7 +20,6 @@
 
 import os
 from collections import Iterable
-from datetime import timedelta
 
 try:
     # noinspection PyUnresolvedReferences
@@ -30,28 +29,33 @@ except ImportError:
     from sphere_bson_connector_package.bson_connector import BsonConnector
     from sphere_bson_connector_package.timewindows import Experiment, ExperimentConfig, DataWindow
 
-from hyperstream.channels.memory_channel import MemoryChannel
-from hyperstream import TimeIntervals, TimeInterval, StreamInstance
+from hyperstream import TimeIntervals, TimeInterval
 from hyperstream.utils import MIN_DATE, MAX_DATE
 
+from sphere_plugins.sphere.channels.connector_pool import ConnectorPool
+from sphere_plugins.sphere.channels.memory_storage import SphereMemoryChannel
+
 path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
 
-globs = {'bson_connector': None}
+
+def create_bson_connector():
+    try:
+        # First try current working directory
+        return BsonConnector(
+            config_filename=os.path.join(os.getcwd(), 'config.json'),
+            sphere_logger=None)
+    except IOError:
+        # Next try default hyperstream directory
+        return BsonConnector(
+            config_filename=os.path.join(path, 'config.json'),
+            sphere_logger=None)
+
+
+connector_pool = ConnectorPool(create_bson_connector, size=int(os.environ.get('SPHERE_CONNECTOR_POOL_SIZE', 4)))
 
 
 def get_bson_connector():
-    if not globs['bson_connector']:
-        try:
-            # First try current working directory
-            globs['bson_connector'] = BsonConnector(
-                config_filename=os.path.join(os.getcwd(), 'config.json'),
-                sphere_logger=None)
-        except IOError:
-            # Next try default hyperstream directory
-            globs['bson_connector'] = BsonConnector(
-                config_filename=os.path.join(path, 'config.json'),
-                sphere_logger=None)
-    return globs['bson_connector']
+    return connector_pool.get()
 
 
 class SphereDataWindow(DataWindow):
@@ -86,12 +90,12 @@ class SphereExperiment(Experiment):
         super(SphereExperiment, self).__init__(bson_connector, experiment_config, auto_initialise=False)
 
 
-class BsonChannel(MemoryChannel):
+class BsonChannel(SphereMemoryChannel):
     """
     SPHERE bson files storing the raw sensor data
     """
-    def __init__(self, channel_id, up_to_timestamp=None):
-        super(BsonChannel, self).__init__(channel_id=channel_id)
+    def __init__(self, channel_id, up_to_timestamp=None, storage_mode='shift'):
+        super(BsonChannel, self).__init__(channel_id=channel_id, storage_mode=storage_mode)
         
         if up_to_timestamp is None:
             # TODO: maybe should be utcnow, but then we'd have to keep updating it?
@@ -108,30 +112,3 @@ class BsonChannel(MemoryChannel):
         for stream_id in self.streams:
             self.streams[stream_id].calculated_intervals = TimeIntervals([(MIN_DATE, up_to_timestamp)])
         self.up_to_timestamp = up_to_timestamp
-
-    def get_stream_writer(self, stream):
-        def writer(document_collection):
-            if stream.stream_id not in self.data:
-                raise RuntimeError("Data slot does not exist for {}, perhaps create_stream was not used?"
-                                   .format(stream))
-            if isinstance(document_collection, StreamInstance):
-                try:
-                    self.data[stream.stream_id].append(document_collection)
-                except KeyError as e:
-                    # Deal with the duplicate error by adding microseconds to the time until we succeed
-                    # logging.debug(e.message)
-                    doc = StreamInstance(
-                        timestamp=document_collection.timestamp + timedelta(microseconds=1000),
-                        # timestamp=document_collection.timestamp + timedelta(microseconds=1000),
-                        # MK used 1000 here when storing derived streams later back to mongo
-                        # TODO: come up with a better solution
-                        value=document_collection.value)
-                    return writer(doc)
-            elif isinstance(document_collection, list):
-                for d in document_collection:
-                    writer(d)
-            else:
-                raise TypeError('Expected: [StreamInstance, list<StreamInstance>], got {}. '
-                                .format(type(document_collection)))
-
-        return writer
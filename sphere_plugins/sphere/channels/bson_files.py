@@ -0,0 +1,305 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+import glob
+import heapq
+import logging
+import mmap
+import os
+import struct
+from multiprocessing import Pool
+
+import numpy as np
+from bson import BSON
+from bson.codec_options import CodecOptions
+from bson.errors import InvalidBSON
+
+from hyperstream.utils import UTC
+
+from sphere_plugins.sphere.channels.window_cache import EPOCH
+from sphere_plugins.sphere.utils.raw_documents import aware_utc, to_columns, from_columns
+
+CODEC_OPTIONS = CodecOptions(tz_aware=True, tzinfo=UTC)
+
+INDEX_SUFFIX = '.idx.npz'
+
+# Sizes of the BSON element types that can be skipped without decoding them
+_FIXED_SIZES = {0x01: 8, 0x06: 0, 0x07: 12, 0x08: 1, 0x09: 8, 0x0A: 0, 0x10: 4, 0x11: 8, 0x12: 8, 0x13: 16, 0x7F: 0,
+                0xFF: 0}
+
+globs = {'bson_files': None}
+
+
+def _to_micros(dt):
+    delta = aware_utc(dt) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _element_size(buf, pos, element_type):
+    """
+    Gets the size of the value of a BSON element starting at pos, or None if it cannot be skipped
+    """
+    if element_type in _FIXED_SIZES:
+        return _FIXED_SIZES[element_type]
+    if element_type in (0x02, 0x0D, 0x0E):
+        return 4 + struct.unpack_from('<i', buf, pos)[0]
+    if element_type in (0x03, 0x04, 0x0F):
+        return struct.unpack_from('<i', buf, pos)[0]
+    if element_type == 0x05:
+        return 5 + struct.unpack_from('<i', buf, pos)[0]
+    if element_type == 0x0B:
+        pattern_end = buf.find(b'\x00', pos)
+        return buf.find(b'\x00', pattern_end + 1) + 1 - pos
+    return None
+
+
+def _datetime_millis(buf, offset, length, field=b'datetime'):
+    """
+    Finds the datetime of a BSON document by skipping over the elements before it, rather than decoding the document
+    :return: Milliseconds since the epoch, or None if the datetime cannot be found this way
+    """
+    pos, end = offset + 4, offset + length - 1
+    while pos < end:
+        element_type = struct.unpack_from('<B', buf, pos)[0]
+        name_end = buf.find(b'\x00', pos + 1, end)
+        if name_end < 0:
+            return None
+        name = buf[pos + 1:name_end]
+        pos = name_end + 1
+        if name == field:
+            return struct.unpack_from('<q', buf, pos)[0] if element_type == 0x09 else None
+        size = _element_size(buf, pos, element_type)
+        if size is None:
+            return None
+        pos += size
+    return None
+
+
+def _decode(buf, offset):
+    length = struct.unpack_from('<i', buf, offset)[0]
+    return BSON(buf[offset:offset + length]).decode(CODEC_OPTIONS)
+
+
+def _decode_chunk(chunk):
+    """
+    Decodes a chunk of documents in a worker process
+    :param chunk: The file names, and the (file number, offset) of each document
+    :return: The documents as a columnar batch, which is much smaller to send back than the documents
+    """
+    filenames, entries = chunk
+    files, buffers = {}, {}
+    try:
+        docs = []
+        for i, offset in entries:
+            if i not in buffers:
+                files[i] = open(filenames[i], 'rb')
+                buffers[i] = mmap.mmap(files[i].fileno(), 0, access=mmap.ACCESS_READ)
+            docs.append(_decode(buffers[i], offset))
+        return to_columns(docs)
+    finally:
+        for buf in buffers.values():
+            buf.close()
+        for f in files.values():
+            f.close()
+
+
+class BsonFileReader(object):
+    """
+    Reads a BSON dump file by time range. The file is memory mapped, and a sidecar index of (datetime, byte offset) for
+    every document is stored next to it, so that a time range is served by seeking straight to its documents. Only the
+    documents in the range are decoded. The index is rebuilt when the file changes.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.size = os.path.getsize(filename)
+        self.mtime = os.path.getmtime(filename)
+        self._file = open(filename, 'rb')
+        self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        try:
+            self.times, self.offsets = self._load_index()
+        except InvalidBSON:
+            self.close()
+            raise
+
+    def close(self):
+        if self.size:
+            self.buffer.close()
+        self._file.close()
+
+    def _load_index(self):
+        index_filename = self.filename + INDEX_SUFFIX
+        if os.path.exists(index_filename):
+            with np.load(index_filename) as index:
+                if int(index['size']) == self.size and float(index['mtime']) == self.mtime:
+                    return index['times'], index['offsets']
+
+        times, offsets = self.build_index()
+        try:
+            with open(index_filename, 'wb') as f:
+                np.savez(f, times=times, offsets=offsets, size=self.size, mtime=self.mtime)
+        except (IOError, OSError) as e:
+            logging.warn("Failed to write BSON index {}: {}".format(index_filename, e))
+        return times, offsets
+
+    def build_index(self):
+        """
+        Scans the file for the datetime and offset of each document
+        :return: The times (microseconds since the epoch) and offsets, in time order
+        :raises InvalidBSON: If a document length is invalid or runs past the end of the file
+        """
+        times, offsets = [], []
+        offset = 0
+        while offset < self.size:
+            # The smallest document is the length, and the terminating null byte
+            length = struct.unpack_from('<i', self.buffer, offset)[0] if offset + 4 <= self.size else None
+            if length is None or length < 5 or offset + length > self.size:
+                raise InvalidBSON("Invalid document length {} at offset {} of {} ({} bytes)".format(
+                    length, offset, self.filename, self.size))
+            millis = _datetime_millis(self.buffer, offset, length)
+            if millis is not None:
+                times.append(millis * 1000)
+                offsets.append(offset)
+            else:
+                doc = self.decode(offset)
+                if 'datetime' in doc:
+                    times.append(_to_micros(doc['datetime']))
+                    offsets.append(offset)
+            offset += length
+
+        times = np.array(times, dtype=np.int64)
+        offsets = np.array(offsets, dtype=np.int64)
+        order = np.lexsort((offsets, times))
+        return times[order], offsets[order]
+
+    def decode(self, offset):
+        return _decode(self.buffer, offset)
+
+    def entries(self, start, end):
+        """
+        Gets the index entries of the documents with start < datetime <= end
+        :return: The (time, offset) pairs
+        """
+        lo = np.searchsorted(self.times, _to_micros(start), side='right')
+        hi = np.searchsorted(self.times, _to_micros(end), side='right')
+        return zip(self.times[lo:hi].tolist(), self.offsets[lo:hi].tolist())
+
+    def read(self, start, end):
+        """
+        Reads the documents with start < datetime <= end, in time order
+        """
+        for _, offset in self.entries(start, end):
+            yield self.decode(offset)
+
+
+class BsonFileSource(object):
+    """
+    Serves raw documents from the BSON dump files in a directory, named <modality>*.bson. The documents of all of the
+    files of a modality are merged in time order. With processes set, time ranges of more than chunk_docs documents are
+    split into chunks of consecutive documents, which are decoded on a process pool and put back together in order.
+    """
+    def __init__(self, directory, processes=None, chunk_docs=10000):
+        """
+        :param directory: The directory of the BSON dump files
+        :param processes: The number of processes decoding documents, or None to decode them in this process
+        :param chunk_docs: The number of documents in each chunk
+        """
+        self.directory = directory
+        self.processes = processes
+        self.chunk_docs = chunk_docs
+        self.readers = {}
+        self._pool = None
+
+    def reader(self, filename):
+        reader = self.readers.get(filename)
+        if reader is None or reader.size != os.path.getsize(filename) \
+                or reader.mtime != os.path.getmtime(filename):
+            if reader is not None:
+                reader.close()
+            reader = self.readers[filename] = BsonFileReader(filename)
+        return reader
+
+    def close(self):
+        for reader in self.readers.values():
+            reader.close()
+        self.readers = {}
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def files(self, modality):
+        return sorted(glob.glob(os.path.join(self.directory, modality + '*.bson')))
+
+    def get_data(self, time_interval, modality, filters=None):
+        """
+        Gets the documents of the modality in the given time interval
+        :param time_interval: The time interval
+        :param modality: The modality
+        :param filters: Values that top level fields of the documents must be equal to
+        :return: The documents
+        """
+        readers = [self.reader(filename) for filename in self.files(modality)]
+        entries = [[(t, i, offset) for t, offset in reader.entries(time_interval.start, time_interval.end)]
+                   for i, reader in enumerate(readers)]
+        entries = list(heapq.merge(*entries))
+
+        if self.processes and len(entries) > self.chunk_docs:
+            docs = self._decode_parallel([reader.filename for reader in readers], entries)
+        else:
+            docs = (readers[i].decode(offset) for _, i, offset in entries)
+
+        for doc in docs:
+            if not filters or all(doc.get(k) == v for k, v in filters.items()):
+                yield doc
+
+    def _decode_parallel(self, filenames, entries):
+        if self._pool is None:
+            self._pool = Pool(self.processes)
+        chunks = [(filenames, [(i, offset) for _, i, offset in entries[start:start + self.chunk_docs]])
+                  for start in range(0, len(entries), self.chunk_docs)]
+        # imap hands the batches back in the order of the chunks, so the documents stay in time order
+        for batch in self._pool.imap(_decode_chunk, chunks):
+            for doc in from_columns(batch):
+                yield doc
+
+
+def get_bson_files():
+    """
+    Gets the global BSON file source. This is disabled unless it has been configured with configure_bson_files, or the
+    SPHERE_BSON_DIR environment variable gives the directory of the BSON dump files (and SPHERE_BSON_PROCESSES the
+    number of decoding processes).
+    :return: The file source, or None
+    """
+    if globs['bson_files'] is None and os.environ.get('SPHERE_BSON_DIR'):
+        processes = os.environ.get('SPHERE_BSON_PROCESSES')
+        configure_bson_files(os.environ['SPHERE_BSON_DIR'], processes=int(processes) if processes else None)
+    return globs['bson_files']
+
+
+def configure_bson_files(directory, **kwargs):
+    """
+    Sets up the global BSON file source used by the Bson tool
+    :param directory: The directory of the BSON dump files, or None to disable it
+    :param kwargs: Other arguments to BsonFileSource
+    :return: The file source
+    """
+    if globs['bson_files'] is not None:
+        globs['bson_files'].close()
+    globs['bson_files'] = BsonFileSource(directory, **kwargs) if directory else None
+    return globs['bson_files']
@@ -0,0 +1,120 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+
+from sphere_plugins.sphere.channels.projection import project
+from sphere_plugins.sphere.channels.window_cache import BOUNDARY_MARGIN
+from sphere_plugins.sphere.utils.raw_documents import aware_utc, sphere_fetch
+
+globs = {'chunked_fetcher': None}
+
+
+class ChunkedFetcher(object):
+    """
+    Fetches long windows of raw SPHERE documents as consecutive sub-windows, several at a time on a thread pool, so that
+    the round trips to the MongoDB overlap with decoding. At most prefetch sub-windows are fetched ahead of the one
+    being consumed, which bounds the memory used. The documents are still yielded in strict timestamp order.
+    """
+    def __init__(self, chunk_size=timedelta(hours=6), workers=4, prefetch=None, fetch=sphere_fetch):
+        """
+        :param chunk_size: The length of the sub-windows
+        :param workers: The number of threads fetching sub-windows
+        :param prefetch: The maximum number of sub-windows fetched ahead, by default the number of workers
+        :param fetch: The function that fetches the documents for a query from the database
+        """
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.prefetch = max(prefetch or workers, 1)
+        self.fetch = fetch
+
+    def chunks(self, start, end):
+        """
+        Splits a window into sub-windows
+        :param start: The start of the window
+        :param end: The end of the window
+        :return: The (start, end) pairs of the sub-windows
+        """
+        while start < end:
+            yield start, min(start + self.chunk_size, end)
+            start += self.chunk_size
+
+    def _fetch_chunk(self, chunk, query, fields):
+        start, end = chunk
+        # Fetched with a margin either side, so that documents on the boundaries land in exactly one sub-window
+        docs = self.fetch(start - BOUNDARY_MARGIN, end + BOUNDARY_MARGIN, *query)
+        return [doc for doc in project(docs, query[0], fields) if start < aware_utc(doc['datetime']) <= end]
+
+    def get_data(self, time_interval, modality, elements=None, filters=None, rename_keys=False, fields=None):
+        """
+        Gets the documents of the modality in the given time interval, in the same way as DataWindow.get_data.
+        :param time_interval: The time interval
+        :param modality: The modality
+        :param elements: The elements to fetch
+        :param filters: The filters to apply
+        :param rename_keys: Whether to rename the keys
+        :param fields: The fields to keep, or None for all of them
+        :return: The documents
+        """
+        start, end = aware_utc(time_interval.start), aware_utc(time_interval.end)
+        if end - start <= self.chunk_size:
+            for doc in project(self.fetch(start, end, modality, elements, filters, rename_keys), modality, fields):
+                yield doc
+            return
+
+        query = (modality, elements, filters, rename_keys)
+        chunks = list(self.chunks(start, end))
+        pool = ThreadPool(min(self.workers, len(chunks)))
+        try:
+            pending = [pool.apply_async(self._fetch_chunk, (chunk, query, fields)) for chunk in chunks[:self.prefetch]]
+            for i in range(len(chunks)):
+                docs = pending.pop(0).get()
+                if i + self.prefetch < len(chunks):
+                    pending.append(pool.apply_async(self._fetch_chunk, (chunks[i + self.prefetch], query, fields)))
+                for doc in docs:
+                    yield doc
+        finally:
+            pool.terminate()
+
+
+def get_chunked_fetcher():
+    """
+    Gets the global chunked fetcher. This is disabled unless it has been configured with configure_chunked_fetch, or the
+    SPHERE_FETCH_CHUNK_HOURS environment variable gives the length of the sub-windows.
+    :return: The fetcher, or None
+    """
+    if globs['chunked_fetcher'] is None and os.environ.get('SPHERE_FETCH_CHUNK_HOURS'):
+        workers = os.environ.get('SPHERE_FETCH_WORKERS')
+        configure_chunked_fetch(timedelta(hours=float(os.environ['SPHERE_FETCH_CHUNK_HOURS'])),
+                                **(dict(workers=int(workers)) if workers else {}))
+    return globs['chunked_fetcher']
+
+
+def configure_chunked_fetch(chunk_size, **kwargs):
+    """
+    Sets up the global chunked fetcher used by the Sphere tool
+    :param chunk_size: The length of the sub-windows, or None to disable chunking
+    :param kwargs: Other arguments to ChunkedFetcher
+    :return: The fetcher
+    """
+    globs['chunked_fetcher'] = ChunkedFetcher(chunk_size, **kwargs) if chunk_size else None
+    return globs['chunked_fetcher']
@@ -0,0 +1,107 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+import os
+import threading
+
+
+class ConnectorPool(object):
+    """
+    Pool of database connectors that is safe to use from several threads and processes. Each thread is bound to one
+    connector, and up to size connectors are created, after which threads share the connector with the fewest threads
+    bound to it (the connectors wrap MongoClients, which are thread safe). Connectors are never carried over a fork:
+    the first use in a child process discards the parent's connectors and starts a new pool.
+    """
+    def __init__(self, factory, size=4):
+        """
+        :param factory: The function that creates a connector
+        :param size: The maximum number of connectors per process
+        """
+        self.factory = factory
+        self.size = size
+        self.forks = 0
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._connectors = []
+        self._threads = {}
+        self.created = 0
+        self.peak_in_use = 0
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            logging.debug("Connector pool reset after fork in process {}".format(os.getpid()))
+            self._reset()
+            self.forks += 1
+
+    def _prune(self):
+        # Release the connectors of threads that have finished
+        alive = set(thread.ident for thread in threading.enumerate())
+        for ident in list(self._threads):
+            if ident not in alive:
+                del self._threads[ident]
+
+    def _bound(self):
+        counts = [0] * len(self._connectors)
+        for i in self._threads.values():
+            counts[i] += 1
+        return counts
+
+    def get(self):
+        """
+        Gets the connector of the current thread, creating or assigning one if needed
+        :return: The connector
+        """
+        self._check_fork()
+        ident = threading.current_thread().ident
+        with self._lock:
+            if ident not in self._threads:
+                self._prune()
+                counts = self._bound()
+                if len(self._connectors) < self.size and (not counts or min(counts) > 0):
+                    self._connectors.append(self.factory())
+                    self.created += 1
+                    self._threads[ident] = len(self._connectors) - 1
+                else:
+                    self._threads[ident] = counts.index(min(counts))
+                self.peak_in_use = max(self.peak_in_use, self.in_use)
+            return self._connectors[self._threads[ident]]
+
+    @property
+    def in_use(self):
+        """
+        The number of connectors with at least one thread bound to them
+        """
+        return len(set(self._threads.values()))
+
+    def metrics(self):
+        """
+        Gets the usage metrics of the pool in the current process
+        :return: Dictionary of the metrics
+        """
+        self._check_fork()
+        with self._lock:
+            self._prune()
+            return dict(size=self.size, connectors=len(self._connectors), in_use=self.in_use,
+                        peak_in_use=self.peak_in_use, threads=len(self._threads), created=self.created,
+                        forks=self.forks)
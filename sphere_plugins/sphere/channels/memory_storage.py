@@ -0,0 +1,307 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from hyperstream.channels.memory_channel import MemoryChannel
+from hyperstream.stream import StreamInstance, StreamInstanceCollection
+from hyperstream.utils import UTC
+
+# Legacy collision handling: duplicate timestamps are moved on by this much until they fit
+COLLISION_SHIFT = timedelta(microseconds=1000)
+
+
+class ShiftingStreamInstanceCollection(StreamInstanceCollection):
+    """
+    Stream instance collection that moves an instance whose timestamp clashes with a different value on by
+    COLLISION_SHIFT until it finds a free (or reconcilable) slot. This is the behaviour the SPHERE channels have always
+    had, done in a loop rather than by recursion.
+    """
+    def append(self, instance):
+        if not isinstance(instance, StreamInstance):
+            raise ValueError("Expected StreamInstance, got {}".format(type(instance)))
+        timestamp = instance.timestamp
+        while True:
+            try:
+                self[timestamp] = instance.value
+                return
+            except KeyError:
+                # MK used 1000 microseconds here when storing derived streams later back to mongo
+                timestamp += COLLISION_SHIFT
+
+    def window(self, time_interval):
+        return [StreamInstance(t, self[t]) for t in sorted(self) if t in time_interval]
+
+
+class SequencedStreamInstanceCollection(object):
+    """
+    Stream instance collection that keeps every instance, including ones with duplicate timestamps. Instances are
+    ordered by timestamp, with ties broken by the order in which they were written.
+    """
+    def __init__(self):
+        self.timestamps = []
+        self.values = []
+        self.is_sorted = True
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, instance):
+        if not isinstance(instance, StreamInstance):
+            raise ValueError("Expected StreamInstance, got {}".format(type(instance)))
+        if self.timestamps and instance.timestamp < self.timestamps[-1]:
+            self.is_sorted = False
+        self.timestamps.append(instance.timestamp)
+        self.values.append(instance.value)
+
+    def extend(self, instances):
+        for instance in instances:
+            self.append(instance)
+
+    def sort(self):
+        if not self.is_sorted:
+            # The sort is stable, so the write order acts as the tiebreaker
+            order = sorted(range(len(self.timestamps)), key=self.timestamps.__getitem__)
+            self.timestamps = [self.timestamps[i] for i in order]
+            self.values = [self.values[i] for i in order]
+            self.is_sorted = True
+
+    def window(self, time_interval):
+        self.sort()
+        lo = bisect_right(self.timestamps, time_interval.start)
+        hi = bisect_right(self.timestamps, time_interval.end)
+        return [StreamInstance(t, v) for t, v in zip(self.timestamps[lo:hi], self.values[lo:hi])]
+
+
+EPOCH = datetime(1970, 1, 1)
+
+try:
+    INTEGER_TYPES = (int, long)
+except NameError:
+    # Python 3
+    INTEGER_TYPES = (int,)
+
+
+def _to_micros(dt):
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(UTC).replace(tzinfo=None)
+    delta = dt - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _column(values):
+    """
+    Pack a list of values into the most compact numpy array that gives them back unchanged through tolist()
+    """
+    for dtype, python_types in ((np.bool_, (bool,)), (np.int64, INTEGER_TYPES), (np.float64, (float,))):
+        if all(type(v) in python_types for v in values):
+            try:
+                return np.array(values, dtype=dtype)
+            except OverflowError:
+                break
+    column = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        column[i] = v
+    return column
+
+
+class _ColumnarChunk(object):
+    """
+    A time-sorted block of instances. Dict values are split into one column per key, with a mask for keys that are not
+    present in every row. Any other values are kept in a single column.
+    """
+    def __init__(self, timestamps, columns, masks):
+        self.timestamps = timestamps
+        self.columns = columns
+        self.masks = masks
+
+    @property
+    def is_dict(self):
+        return None not in self.columns
+
+    @property
+    def schema(self):
+        return sorted((k, c.dtype.str) for k, c in self.columns.items())
+
+    @classmethod
+    def pack(cls, timestamps, values):
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+        timestamps = np.array([timestamps[i] for i in order], dtype=np.int64)
+        values = [values[i] for i in order]
+
+        if not values or not all(type(v) is dict for v in values):
+            return cls(timestamps, {None: _column(values)}, {})
+
+        columns, masks = {}, {}
+        for key in set(k for v in values for k in v):
+            present = [key in v for v in values]
+            if all(present):
+                columns[key] = _column([v[key] for v in values])
+                continue
+            packed = _column([v[key] for v in values if key in v])
+            column = np.empty(len(values), dtype=object) if packed.dtype == object \
+                else np.zeros(len(values), dtype=packed.dtype)
+            mask = np.array(present, dtype=bool)
+            column[mask] = packed
+            columns[key] = column
+            masks[key] = mask
+        return cls(timestamps, columns, masks)
+
+    def values(self, lo, hi):
+        if not self.is_dict:
+            return self.columns[None][lo:hi].tolist()
+        columns = [(k, c[lo:hi].tolist(), self.masks[k][lo:hi].tolist() if k in self.masks else None)
+                   for k, c in self.columns.items()]
+        return [dict((k, c[i]) for k, c, m in columns if m is None or m[i]) for i in range(hi - lo)]
+
+    @classmethod
+    def concatenate(cls, chunks):
+        """
+        Join chunks into a single time-sorted chunk. Chunks with the same columns are joined column by column, anything
+        else is unpacked and packed again.
+        """
+        if len(chunks) == 1:
+            return chunks[0]
+        if all(c.is_dict == chunks[0].is_dict and c.schema == chunks[0].schema for c in chunks):
+            timestamps = np.concatenate([c.timestamps for c in chunks])
+            columns = dict((k, np.concatenate([c.columns[k] for c in chunks])) for k in chunks[0].columns)
+            masks = dict((k, np.concatenate([c.masks.get(k, np.ones(len(c.timestamps), dtype=bool)) for c in chunks]))
+                         for k in set(k for c in chunks for k in c.masks))
+            chunk = cls(timestamps, columns, masks)
+            if len(timestamps) > 1 and (np.diff(timestamps) < 0).any():
+                # mergesort is stable, so ties keep their write order
+                order = np.argsort(timestamps, kind='mergesort')
+                chunk = cls(timestamps[order],
+                            dict((k, c[order]) for k, c in columns.items()),
+                            dict((k, m[order]) for k, m in masks.items()))
+            return chunk
+        timestamps = [t for c in chunks for t in c.timestamps.tolist()]
+        values = [v for c in chunks for v in c.values(0, len(c.timestamps))]
+        return cls.pack(timestamps, values)
+
+
+class ColumnarStreamInstanceCollection(object):
+    """
+    Stream instance collection that stores timestamps as int64 microseconds and values as numpy columns, to cut the
+    memory taken by large raw streams. Like SequencedStreamInstanceCollection it keeps duplicate timestamps in write
+    order. Writes are staged in lists and packed every chunk_size instances, and windows are cut with searchsorted.
+    """
+    chunk_size = 4096
+
+    def __init__(self):
+        self.chunks = []
+        self.staged_timestamps = []
+        self.staged_values = []
+        self.tzinfo = None
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, instance):
+        if not isinstance(instance, StreamInstance):
+            raise ValueError("Expected StreamInstance, got {}".format(type(instance)))
+        if not self.length:
+            self.tzinfo = instance.timestamp.tzinfo
+        self.staged_timestamps.append(_to_micros(instance.timestamp))
+        self.staged_values.append(instance.value)
+        self.length += 1
+        if len(self.staged_timestamps) >= self.chunk_size:
+            self._pack_staged()
+
+    def extend(self, instances):
+        for instance in instances:
+            self.append(instance)
+
+    def _pack_staged(self):
+        if self.staged_timestamps:
+            self.chunks.append(_ColumnarChunk.pack(self.staged_timestamps, self.staged_values))
+            self.staged_timestamps = []
+            self.staged_values = []
+
+    def window(self, time_interval):
+        self._pack_staged()
+        if not self.chunks:
+            return []
+        self.chunks = [_ColumnarChunk.concatenate(self.chunks)]
+        chunk = self.chunks[0]
+        lo = int(np.searchsorted(chunk.timestamps, _to_micros(time_interval.start), side='right'))
+        hi = int(np.searchsorted(chunk.timestamps, _to_micros(time_interval.end), side='right'))
+        timestamps = [(EPOCH + timedelta(microseconds=t)).replace(tzinfo=self.tzinfo)
+                      for t in chunk.timestamps[lo:hi].tolist()]
+        return [StreamInstance(t, v) for t, v in zip(timestamps, chunk.values(lo, hi))]
+
+
+class SphereMemoryChannel(MemoryChannel):
+    """
+    Memory channel used as the base of the SPHERE channels. Streams are stored according to the storage mode:
+        "shift": move an instance whose timestamp clashes on by 1ms until it fits (the original behaviour)
+        "sequence": keep all of the instances, ordered by timestamp and then by write order
+        "columnar": as "sequence", but packed into numpy columns
+    """
+    collection_types = {
+        'shift': ShiftingStreamInstanceCollection,
+        'sequence': SequencedStreamInstanceCollection,
+        'columnar': ColumnarStreamInstanceCollection
+    }
+
+    def __init__(self, channel_id, storage_mode='shift'):
+        if storage_mode not in self.collection_types:
+            raise ValueError("Unknown storage mode {}, expected one of {}".format(
+                storage_mode, sorted(self.collection_types)))
+        super(SphereMemoryChannel, self).__init__(channel_id=channel_id)
+        self.storage_mode = storage_mode
+
+    def create_stream(self, stream_id, sandbox=None):
+        stream = super(SphereMemoryChannel, self).create_stream(stream_id, sandbox=sandbox)
+        self.data[stream_id] = self.collection_types[self.storage_mode]()
+        return stream
+
+    def purge_stream(self, stream_id, remove_definition=False, sandbox=None):
+        super(SphereMemoryChannel, self).purge_stream(stream_id, remove_definition=remove_definition, sandbox=sandbox)
+        if not remove_definition:
+            self.data[stream_id] = self.collection_types[self.storage_mode]()
+
+    def get_results(self, stream, time_interval):
+        """
+        Gets the instances of the stream in the time interval
+        :param stream: The stream reference
+        :param time_interval: The time interval
+        :return: The sorted data items
+        """
+        return self.data[stream.stream_id].window(time_interval)
+
+    def get_stream_writer(self, stream):
+        def writer(document_collection):
+            if stream.stream_id not in self.data:
+                raise RuntimeError("Data slot does not exist for {}, perhaps create_stream was not used?"
+                                   .format(stream))
+            if isinstance(document_collection, StreamInstance):
+                self.data[stream.stream_id].append(document_collection)
+            elif isinstance(document_collection, list):
+                self.data[stream.stream_id].extend(document_collection)
+            else:
+                raise TypeError('Expected: [StreamInstance, list<StreamInstance>], got {}. '
+                                .format(type(document_collection)))
+
+        return writer
@@ -0,0 +1,111 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+from collections import defaultdict
+
+from bson import BSON
+from pymongo import ASCENDING
+
+# Fields that are always needed to build the stream instances
+REQUIRED_FIELDS = ('datetime', 'hid')
+
+# One in this many documents is encoded to estimate the bytes dropped, since encoding them all would cost about as much
+# as was dropped
+SAMPLE_EVERY = 100
+
+stats = defaultdict(lambda: dict(docs=0, sampled=0, sampled_bytes=0, sampled_bytes_dropped=0))
+
+
+def project(docs, modality, fields):
+    """
+    Drops the fields of the documents that are not used downstream, straight after fetching. Mongo still sends them, so
+    this only shrinks what is cached, queued and held in memory afterwards, not the transfer from the database. It is
+    the fallback for queries that cannot use find_projected.
+    :param docs: The raw documents
+    :param modality: The modality, for the statistics
+    :param fields: The fields to keep, besides the datetime and house id, or None to keep everything
+    :return: The projected documents
+    """
+    if fields is None:
+        for doc in docs:
+            yield doc
+        return
+
+    keep = set(fields).union(REQUIRED_FIELDS)
+    modality_stats = stats[modality]
+    for doc in docs:
+        projected = dict((k, v) for k, v in doc.items() if k in keep)
+        if modality_stats['docs'] % SAMPLE_EVERY == 0:
+            dropped = dict((k, v) for k, v in doc.items() if k not in keep)
+            modality_stats['sampled'] += 1
+            modality_stats['sampled_bytes'] += len(BSON.encode(doc))
+            modality_stats['sampled_bytes_dropped'] += len(BSON.encode(dropped)) if dropped else 0
+        modality_stats['docs'] += 1
+        yield projected
+
+
+def mongo_projection(fields):
+    """
+    The mongo projection that keeps only the given fields, besides the datetime and house id
+    :param fields: The fields to keep
+    :return: The projection
+    """
+    projection = dict((field, True) for field in set(fields).union(REQUIRED_FIELDS))
+    projection['_id'] = False
+    return projection
+
+
+def find_projected(collection, start, end, filters, fields):
+    """
+    Fetches the raw documents with start < datetime <= end with the projection pushed down into the query, so that mongo
+    does not send the fields that are not used downstream at all
+    :param collection: The pymongo collection of the modality
+    :param start: The start of the window
+    :param end: The end of the window
+    :param filters: Any filters to apply to the documents
+    :param fields: The fields to keep, besides the datetime and house id
+    :return: The cursor over the projected documents, in time order
+    """
+    query = dict(filters or {})
+    query['datetime'] = {'$gt': start, '$lte': end}
+    return collection.find(query, mongo_projection(fields)).sort('datetime', ASCENDING)
+
+
+def dropped_fields_report():
+    """
+    Estimates the bytes of unused fields dropped from the fetched documents of each modality
+    :return: Dictionary of modality to the number of documents, the estimated bytes dropped and the fraction dropped
+    """
+    report = {}
+    for modality, s in stats.items():
+        if not s['sampled']:
+            continue
+        report[modality] = dict(
+            docs=s['docs'],
+            bytes_dropped=int(s['sampled_bytes_dropped'] * float(s['docs']) / s['sampled']),
+            fraction_dropped=s['sampled_bytes_dropped'] / float(s['sampled_bytes']))
+    return report
+
+
+def log_dropped_fields_report(level=logging.INFO):
+    for modality, r in sorted(dropped_fields_report().items()):
+        logging.log(level, "Dropped ~{} bytes ({:.0%}) of unused {} fields from {} fetched documents".format(
+            r['bytes_dropped'], r['fraction_dropped'], modality, r['docs']))
@@ -0,0 +1,125 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+
+# The shared scan of the workflow being executed by each thread
+active = threading.local()
+
+
+def _sphere_window(time_interval):
+    from sphere_plugins.sphere.channels.sphere_channel import SphereDataWindow
+    return SphereDataWindow(time_interval)
+
+
+def query_key(modality, elements=None, filters=None, rename_keys=False, fields=None):
+    """
+    Gets a hashable key for a query of the Sphere tool
+    """
+    return (modality, tuple(sorted(elements)) if elements else None, json.dumps(filters, sort_keys=True, default=str),
+            rename_keys, tuple(sorted(fields)) if fields is not None else None)
+
+
+class SharedScan(object):
+    """
+    Shares one data window per interval between the Sphere tool factors of a workflow. The scan is only used by the
+    Sphere tools executed inside its with block, by the thread that entered it:
+
+        with SharedScan(queries):
+            workflow.execute(time_interval)
+
+    The first factor to execute over an interval opens the window, and the queries of all of the registered factors are
+    fetched from it concurrently. The other factors then take their documents from the scan rather than opening their
+    own windows. A query over an interval that overlaps the one being scanned, but has not been fetched by the scan,
+    is fetched on its own and the documents of the scan are kept for the other factors. This happens when part of the
+    interval has already been calculated for a factor, or when a query that has already been taken is executed again.
+    Documents that are not taken before the scan moves on to a later interval, or before the with block exits, are
+    dropped.
+    """
+    def __init__(self, queries, open_window=_sphere_window):
+        """
+        :param queries: The parameters of the Sphere tools that share the scan (modality, elements, filters,
+        rename_keys and fields)
+        :param open_window: The function that opens a data window over an interval
+        """
+        self.queries = dict((query_key(**q), q) for q in queries)
+        self.open_window = open_window
+        self.time_interval = None
+        self.pending = {}
+
+    def __enter__(self):
+        if getattr(active, 'scan', None) is not None:
+            raise RuntimeError("A shared scan is already active in this thread")
+        active.scan = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        active.scan = None
+        self.evict()
+
+    def _fetch(self, window, query):
+        return list(window.get_data(query['modality'], query.get('elements'), query.get('filters'),
+                                    query.get('rename_keys', False), query.get('fields')))
+
+    def _scan(self, time_interval):
+        self.evict()
+        window = self.open_window(time_interval)
+        pool = ThreadPool(len(self.queries))
+        self.time_interval = time_interval
+        self.pending = dict(((time_interval, key), pool.apply_async(self._fetch, (window, query)))
+                            for key, query in self.queries.items())
+        pool.close()
+
+    def evict(self):
+        """
+        Drops the documents that have not been taken
+        """
+        if self.pending:
+            logging.debug("Shared scan dropped {} unclaimed queries over {}".format(
+                len(self.pending), self.time_interval))
+        self.pending = {}
+
+    def get_data(self, time_interval, modality, elements=None, filters=None, rename_keys=False, fields=None):
+        """
+        Gets the documents of a query from the scan over the given time interval
+        :return: The documents, or None if the query is not part of the scan
+        """
+        key = query_key(modality, elements, filters, rename_keys, fields)
+        if key not in self.queries:
+            return None
+        if (time_interval, key) not in self.pending:
+            if self.time_interval is not None and time_interval.start < self.time_interval.end \
+                    and self.time_interval.start < time_interval.end:
+                return self._fetch(self.open_window(time_interval), self.queries[key])
+            self._scan(time_interval)
+        # Each query is only taken once per interval, so the documents are not held any longer than needed
+        return self.pending.pop((time_interval, key)).get()
+
+
+def get_shared_scan():
+    """
+    Gets the shared scan of the workflow being executed by this thread
+    :return: The shared scan, or None if there is none
+    """
+    return getattr(active, 'scan', None)
@@ -20,7 +20,6 @@
 
 import os
 from collections import Iterable
-from datetime import timedelta
 
 try:
     # noinspection PyUnresolvedReferences
@@ -29,32 +28,59 @@ except ImportError:
     # noinspection PyUnresolvedReferences
     from sphere_connector_package.sphere_connector import SphereConnector, DataWindow, Experiment, ExperimentConfig
 
-from hyperstream.channels.memory_channel import MemoryChannel
-from hyperstream import TimeIntervals, TimeInterval, StreamInstance
+from pymongo import MongoClient
+
+from hyperstream import TimeIntervals, TimeInterval
 from hyperstream.utils import MIN_DATE, MAX_DATE
 
+from sphere_plugins.sphere.channels.connector_pool import ConnectorPool
+from sphere_plugins.sphere.channels.memory_storage import SphereMemoryChannel
+from sphere_plugins.sphere.channels.projection import project, find_projected
+
 path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
 
-globs = {'sphere_connector': None}
+
+def create_sphere_connector():
+    try:
+        # First try current working directory
+        return SphereConnector(
+            config_filename=os.path.join(os.getcwd(), 'config.json'),
+            include_mongo=True,
+            include_redcap=False,
+            sphere_logger=None)
+    except IOError:
+        # Next try default hyperstream directory
+        return SphereConnector(
+            config_filename=os.path.join(path, 'config.json'),
+            include_mongo=True,
+            include_redcap=False,
+            sphere_logger=None)
+
+
+connector_pool = ConnectorPool(create_sphere_connector, size=int(os.environ.get('SPHERE_CONNECTOR_POOL_SIZE', 4)))
 
 
 def get_sphere_connector():
-    if not globs['sphere_connector']:
-        try:
-            # First try current working directory
-            globs['sphere_connector'] = SphereConnector(
-                config_filename=os.path.join(os.getcwd(), 'config.json'),
-                include_mongo=True,
-                include_redcap=False,
-                sphere_logger=None)
-        except IOError:
-            # Next try default hyperstream directory
-            globs['sphere_connector'] = SphereConnector(
-                config_filename=os.path.join(path, 'config.json'),
-                include_mongo=True,
-                include_redcap=False,
-                sphere_logger=None)
-    return globs['sphere_connector']
+    return connector_pool.get()
+
+
+def create_sphere_database():
+    return MongoClient(os.environ['SPHERE_MONGO_URI'], tz_aware=True).get_default_database()
+
+
+# MongoClients are thread safe, so a single one per process is enough
+database_pool = ConnectorPool(create_sphere_database, size=1)
+
+
+def get_sphere_database():
+    """
+    Gets a pymongo handle on the SPHERE MongoDB, for queries that bypass the connector. This is only available if the
+    SPHERE_MONGO_URI environment variable is set, e.g. to mongodb://localhost/sphere
+    :return: The pymongo database, or None
+    """
+    if not os.environ.get('SPHERE_MONGO_URI'):
+        return None
+    return database_pool.get()
 
 
 class SphereDataWindow(DataWindow):
@@ -70,6 +96,26 @@ class SphereDataWindow(DataWindow):
             raise TypeError
         sphere_connector = get_sphere_connector()
         super(SphereDataWindow, self).__init__(sphere_connector, start, end)
+        self.bounds = (start, end)
+
+    def get_data(self, modality, elements=None, filters=None, rename_keys=False, fields=None):
+        """
+        Gets the documents of a modality, keeping only the given fields besides the datetime and house id. Queries that
+        the connector serves as the raw documents (no elements or key renaming) are sent straight to the database if
+        get_sphere_database is configured, with the projection in the find itself. Otherwise the documents come through
+        the connector, and the unused fields are dropped as they arrive.
+        :param modality: The modality
+        :param elements: The elements to fetch
+        :param filters: Any filters to apply to the documents
+        :param rename_keys: Whether to rename the keys of the documents
+        :param fields: The fields to keep, or None for all of them
+        :return: The documents
+        """
+        if fields is not None and elements is None and not rename_keys:
+            database = get_sphere_database()
+            if database is not None:
+                return find_projected(database[modality], self.bounds[0], self.bounds[1], filters, fields)
+        return project(self.modalities[modality].get_data(elements, filters, rename_keys), modality, fields)
 
 
 class SphereExperiment(Experiment):
@@ -89,13 +135,19 @@ class SphereExperiment(Experiment):
         super(SphereExperiment, self).__init__(sphere_connector, experiment_config, auto_initialise=False)
 
 
-class SphereChannel(MemoryChannel):
+class SphereChannel(SphereMemoryChannel):
     """
     SPHERE MongoDB storing the raw sensor data
+
+    By default the channel claims that the MongoDB is populated forever. For live workflows, start_tailing() makes it
+    track a watermark per modality instead (the newest datetime that has arrived), and the channel is then only
+    available up to the oldest of these.
     """
 
-    def __init__(self, channel_id, up_to_timestamp=None):
-        super(SphereChannel, self).__init__(channel_id=channel_id)
+    def __init__(self, channel_id, up_to_timestamp=None, storage_mode='shift'):
+        super(SphereChannel, self).__init__(channel_id=channel_id, storage_mode=storage_mode)
+        self.watermark_source = None
+        self.watermarks = {}
         
         if up_to_timestamp is None:
             # TODO: maybe should be utcnow, but then we'd have to keep updating it?
@@ -113,29 +165,43 @@ class SphereChannel(MemoryChannel):
             self.streams[stream_id].calculated_intervals = TimeIntervals([(MIN_DATE, up_to_timestamp)])
         self.up_to_timestamp = up_to_timestamp
 
-    def get_stream_writer(self, stream):
-        def writer(document_collection):
-            if stream.stream_id not in self.data:
-                raise RuntimeError("Data slot does not exist for {}, perhaps create_stream was not used?"
-                                   .format(stream))
-            if isinstance(document_collection, StreamInstance):
-                try:
-                    self.data[stream.stream_id].append(document_collection)
-                except KeyError as e:
-                    # Deal with the duplicate error by adding microseconds to the time until we succeed
-                    # logging.debug(e.message)
-                    doc = StreamInstance(
-                        timestamp=document_collection.timestamp + timedelta(microseconds=1000),
-                        # timestamp=document_collection.timestamp + timedelta(microseconds=1000),
-                        # MK used 1000 here when storing derived streams later back to mongo
-                        # TODO: come up with a better solution
-                        value=document_collection.value)
-                    return writer(doc)
-            elif isinstance(document_collection, list):
-                for d in document_collection:
-                    writer(d)
-            else:
-                raise TypeError('Expected: [StreamInstance, list<StreamInstance>], got {}. '
-                                .format(type(document_collection)))
-
-        return writer
+    def start_tailing(self, source, modalities, start):
+        """
+        Switch the channel to live tailing. The calculated intervals of the streams then end at the oldest watermark,
+        so that tools are not executed over data that has not arrived yet
+        :param source: Where the watermarks come from, e.g. a SphereWatermarkSource or a FileWatermarkSource
+        :param modalities: The modalities to track
+        :param start: The initial watermark - all data up to this time is assumed to have arrived
+        :return: The new up_to_timestamp
+        """
+        self.watermark_source = source
+        self.watermarks = dict((modality, start) for modality in modalities)
+        return self.refresh_watermarks()
+
+    def refresh_watermarks(self):
+        """
+        Advance each watermark to the newest datetime that has arrived for its modality, and the streams of the channel
+        to the oldest watermark. Only the newest datetime after the previous watermark is fetched.
+        :return: The new up_to_timestamp
+        """
+        if self.watermark_source is None:
+            raise RuntimeError("Tailing has not been started for channel {}".format(self.channel_id))
+        for modality, watermark in self.watermarks.items():
+            newest = self.watermark_source.newest(modality, since=watermark)
+            if newest is not None and newest > watermark:
+                self.watermarks[modality] = newest
+        self.update_streams(min(self.watermarks.values()))
+        return self.up_to_timestamp
+
+    def new_data_since(self, timestamp, modality=None):
+        """
+        Gets the interval of data that has arrived after the given time, as of the last refresh of the watermarks. This
+        is what an online workflow needs to execute to catch up.
+        :param timestamp: The time up to which data has already been processed
+        :param modality: The modality, or None for data that has arrived for all modalities
+        :return: The time interval, or None if nothing new has arrived
+        """
+        watermark = self.up_to_timestamp if modality is None else self.watermarks[modality]
+        if watermark <= timestamp:
+            return None
+        return TimeInterval(timestamp, watermark)
@@ -19,46 +19,440 @@
 #  OR OTHER DEALINGS IN THE SOFTWARE.
 
 import logging
+import numbers
+from collections import defaultdict
+from datetime import timedelta
+from bson.son import SON
 from mongoengine.errors import NotUniqueError, InvalidDocumentError
 from mongoengine.context_managers import switch_db
-from mongoengine import Document, EmbeddedDocumentField, StringField, DateTimeField, DynamicField
-from pymongo.errors import InvalidDocument
+from mongoengine import Document, EmbeddedDocumentField, StringField, DateTimeField, DynamicField, ListField, \
+    IntField
+from pymongo import ReplaceOne, UpdateOne, ASCENDING
+from pymongo.errors import InvalidDocument, BulkWriteError
 
 from hyperstream.channels import DatabaseChannel
 from hyperstream.models import StreamIdField
-from hyperstream import StreamInstance
+from hyperstream import StreamInstance, TimeInterval, DatabaseStream
+from hyperstream.utils import MIN_DATE, MAX_DATE, utcnow, StreamAlreadyExistsError
+
+from sphere_plugins.sphere.utils.stream_keys import summary_stream_key, naive_utc
+
+DUPLICATE_KEY_ERROR = 11000
+
+# The rollup tiers and the length of their periods
+ROLLUP_PERIODS = {
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1)
+}
+
+# How the summaries are merged into rollups, by the suffix of the stream name. A sum of dict values is taken key-wise.
+ROLLUP_KINDS = (
+    ('_hist', 'hist'),
+    ('_count', 'sum'),
+    ('_total', 'sum'),
+    ('_perc', 'range')
+)
 
 
 class SummaryInstanceModel(Document):
     stream_id = EmbeddedDocumentField(document_type=StreamIdField, required=True)
+    stream_key = StringField(required=True, min_length=32, max_length=32)
     stream_type = StringField(required=False, min_length=1, max_length=512)
     datetime = DateTimeField(required=True)
     # tool_version = StringField(required=True, min_length=1, max_length=512)
     value = DynamicField(required=True)
 
+    # The index would clash with documents written before the stream_key, so it is left to ensure_stream_key_index
     meta = {
         'collection': 'summaries',
         'indexes': [
-            {'fields': ['stream_id']},
-            {'fields': ['stream_id', 'datetime'], 'unique': True}
+            {'fields': ['stream_key', 'datetime'], 'unique': True}
         ],
+        'auto_create_index': False,
         'ordering': ['datetime']
     }
 
 
+class SummaryBucketModel(Document):
+    stream_id = EmbeddedDocumentField(document_type=StreamIdField, required=True)
+    stream_key = StringField(required=True, min_length=32, max_length=32)
+    day = DateTimeField(required=True)
+    datetimes = ListField(DateTimeField())
+    values = ListField(DynamicField())
+
+    meta = {
+        'collection': 'summary_buckets',
+        'indexes': [
+            {'fields': ['stream_key', 'day'], 'unique': True}
+        ],
+        'auto_create_index': False,
+        'ordering': ['day']
+    }
+
+
+class SummaryRollupModel(Document):
+    stream_id = EmbeddedDocumentField(document_type=StreamIdField, required=True)
+    stream_key = StringField(required=True, min_length=32, max_length=32)
+    tier = StringField(required=True, choices=tuple(ROLLUP_PERIODS))
+    kind = StringField(required=True)
+    datetime = DateTimeField(required=True)
+    count = IntField(required=True)
+    value = DynamicField(required=True)
+
+    meta = {
+        'collection': 'summary_rollups',
+        'indexes': [
+            {'fields': ['stream_key', 'tier', 'datetime'], 'unique': True}
+        ],
+        'ordering': ['datetime']
+    }
+
+
+def ensure_stream_key_index(collection, time_field):
+    """
+    Create the unique (stream_key, time) index of a summary collection if it does not exist yet. Documents written
+    before the stream_key was introduced would all clash on a null key, so a collection that still holds any of them
+    has to be migrated first.
+    :param collection: The pymongo collection
+    :param time_field: The time field that follows the stream_key in the index
+    :return: None
+    :raises RuntimeError: If the collection has not been migrated
+    """
+    name = 'stream_key_1_{}_1'.format(time_field)
+    if name in collection.index_information():
+        return
+    if collection.find_one({'stream_key': {'$exists': False}}, {'_id': 1}) is not None:
+        raise RuntimeError("The {} collection holds documents without a stream_key, run "
+                           "scripts/migrate_summary_stream_keys.py to migrate it".format(collection.name))
+    collection.create_index([('stream_key', ASCENDING), (time_field, ASCENDING)], unique=True, name=name)
+
+
+def _day(dt):
+    return naive_utc(dt).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _rollup_end(dt, tier):
+    """
+    The end of the rollup period containing dt. Periods are closed on the right, like time intervals, so a summary
+    stamped at midnight belongs to the day (or week, starting on Monday) that it closes.
+    """
+    start = _day(dt)
+    if tier == 'week':
+        start -= timedelta(days=start.weekday())
+    if start == naive_utc(dt):
+        return start
+    return start + ROLLUP_PERIODS[tier]
+
+
+def _rollup_kind(stream_id, rollup_kinds=ROLLUP_KINDS):
+    for suffix, kind in rollup_kinds:
+        if stream_id.name.endswith(suffix):
+            return kind
+    return None
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _merge_keywise(merged, items):
+    merged = defaultdict(int) if merged is None else merged
+    for k, v in items:
+        if _is_number(v):
+            merged[str(k)] += v
+    return merged
+
+
+def _merge(kind, merged, value):
+    """
+    Merge a summary value into the partial rollup of a batch. Values that do not fit the kind, or the values merged so
+    far, are skipped, as are non-numeric entries.
+    :param kind: The rollup kind
+    :param merged: The partial rollup so far, or None
+    :param value: The summary value
+    :return: The updated partial rollup
+    """
+    if kind == 'sum':
+        if isinstance(value, dict):
+            if merged is not None and not isinstance(merged, dict):
+                return merged
+            return _merge_keywise(merged, value.items())
+        if _is_number(value) and not isinstance(merged, dict):
+            return (merged or 0) + value
+        return merged
+    if kind == 'range':
+        if _is_number(value):
+            value = [value]
+        if not isinstance(value, (list, tuple)):
+            return merged
+        values = [v for v in value if _is_number(v)]
+        if not values:
+            return merged
+        if merged is None:
+            return min(values), max(values)
+        return min(merged[0], min(values)), max(merged[1], max(values))
+    if kind == 'hist':
+        if isinstance(value, dict):
+            return _merge_keywise(merged, value.items())
+        if isinstance(value, (list, tuple)):
+            return _merge_keywise(merged, enumerate(value))
+        return merged
+    raise ValueError(kind)
+
+
+def _rollup_update(kind, merged):
+    """
+    The mongo update operators that fold the partial rollup of a batch into the stored rollup document
+    """
+    if kind == 'sum':
+        if isinstance(merged, dict):
+            return {'$inc': dict(('value.' + k, v) for k, v in merged.items())}
+        return {'$inc': {'value': merged}}
+    if kind == 'range':
+        return {'$min': {'value.min': merged[0]}, '$max': {'value.max': merged[1]}}
+    if kind == 'hist':
+        return {'$inc': dict(('value.' + k, v) for k, v in merged.items())}
+    raise ValueError(kind)
+
+
+def _rollup_value(kind, value):
+    """
+    Convert a stored rollup value back to the shape of the summaries it was built from
+    """
+    if kind == 'hist_list':
+        return [value.get(str(i), 0) for i in range(max(map(int, value)) + 1)] if value else []
+    return value
+
+
+class SummaryStream(DatabaseStream):
+    """
+    A stream of the summary channel. HyperStream calls the stream writer once per instance and then updates the
+    calculated intervals at the end of each interval that a tool executes, so the documents buffered by the writer are
+    written out just before the calculated intervals are updated.
+    """
+    @DatabaseStream.calculated_intervals.setter
+    def calculated_intervals(self, intervals):
+        self.channel.flush(self.stream_id)
+        DatabaseStream.calculated_intervals.fset(self, intervals)
+
+
 class SummaryChannel(DatabaseChannel):
     """
     Channel for storing summaries
+
+    The stream writers buffer documents across calls, and send them to mongo as unordered bulk upserts of up to
+    write_batch_size documents. Whatever is left in the buffer of a stream is written when its calculated intervals
+    are updated, so an interval is only marked as calculated once all of its documents are in the database. Reads of a
+    stream write out its buffer first.
+
+    Reads bypass mongoengine and go through a raw pymongo cursor, projected to the datetime and value and served in
+    order by the (stream_key, datetime) index. get_results_many reads many streams with a handful of $in queries.
+
+    With bucketed=True the instances are stored in the summary_buckets collection instead, as one document per stream
+    per day holding parallel arrays of datetimes and values.
+
+    If rollup_tiers are given, histogram, count and percentile summaries are also folded into daily and/or weekly
+    rollups as they are written (histogram and count sums, and the min/max of the percentiles). The kind of rollup
+    of a stream comes from the suffix of its name, see ROLLUP_KINDS. get_results serves a request with a resolution
+    from the coarsest rollup tier that fits it.
     """
-    def get_results(self, stream, time_interval):
+    def __init__(self, channel_id, write_batch_size=1000, read_batch_size=1000, max_streams_per_query=100,
+                 bucketed=False, rollup_tiers=(), rollup_kinds=ROLLUP_KINDS):
+        """
+        Initialise this channel
+        :param channel_id: The channel identifier
+        :param write_batch_size: The number of documents sent to mongo in a single bulk write
+        :param read_batch_size: The number of documents fetched from mongo per cursor round-trip
+        :param max_streams_per_query: The maximum number of stream ids in a single get_results_many query
+        :param bucketed: Whether to store one document per stream per day rather than one per instance
+        :param rollup_tiers: The rollup tiers to maintain, out of ROLLUP_PERIODS. None are maintained by default.
+        :param rollup_kinds: The (stream name suffix, rollup kind) pairs that pick the streams to roll up
+        """
+        super(SummaryChannel, self).__init__(channel_id=channel_id)
+        self.write_batch_size = write_batch_size
+        self.read_batch_size = read_batch_size
+        self.max_streams_per_query = max_streams_per_query
+        self.bucketed = bucketed
+        self.rollup_tiers = sorted(rollup_tiers, key=ROLLUP_PERIODS.get)
+        self.rollup_kinds = rollup_kinds
+        self._indexed = set()
+        self._pending = defaultdict(list)
+
+    def create_stream(self, stream_id, sandbox=None):
+        """
+        Create the stream
+        :param stream_id: The stream identifier
+        :param sandbox: The sandbox for this stream
+        :return: The stream
+        """
+        if sandbox is not None:
+            raise NotImplementedError
+
+        if stream_id in self.streams:
+            raise StreamAlreadyExistsError("Stream with id '{}' already exists".format(stream_id))
+
+        stream = SummaryStream(channel=self, stream_id=stream_id, calculated_intervals=None,
+                               last_accessed=utcnow(), last_updated=utcnow(), sandbox=sandbox)
+        self.streams[stream_id] = stream
+        return stream
+
+    def purge_stream(self, stream_id, remove_definition=False, sandbox=None):
+        # Otherwise the buffered documents would be written when the purge resets the calculated intervals
+        self._pending.pop(stream_id, None)
+        super(SummaryChannel, self).purge_stream(stream_id, remove_definition=remove_definition, sandbox=sandbox)
+
+    def flush(self, stream_id=None):
+        """
+        Write out the buffered documents of a stream
+        :param stream_id: The stream id, or None for all streams
+        :return: None
+        """
+        for stream_id in list(self._pending) if stream_id is None else [stream_id]:
+            instances = self._pending.pop(stream_id, [])
+            for i in range(0, len(instances), self.write_batch_size):
+                self._write_batch(stream_id, instances[i:i + self.write_batch_size])
+
+    def get_results(self, stream, time_interval, resolution=None):
         """
         Get the results for a given stream
         :param time_interval: The time interval
         :param stream: The stream object
+        :param resolution: The coarsest spacing of results that is acceptable, as a timedelta. If a rollup tier fits,
+        the results come from it, one per period, and the first and last periods may extend beyond the time interval.
+        The values are then those of the rollup, e.g. a dict of min and max for a range rollup.
         :return: A generator over stream instances
         """
-        query = stream.stream_id.as_raw()
-        query['datetime'] = {'$gt': time_interval.start, '$lte': time_interval.end}
+        self.flush(stream.stream_id)
+        tier = self._rollup_tier(stream.stream_id, resolution)
+        if tier is not None:
+            for instance in self._find_rollups(stream.stream_id, tier, time_interval):
+                yield instance
+            return
+        for _, t, value in self._find(summary_stream_key(stream.stream_id), time_interval):
+            yield StreamInstance(timestamp=t, value=value)
+
+    def get_results_many(self, streams, time_interval):
+        """
+        Get the results for many streams at once. The stream ids are fetched with $in queries of up to
+        max_streams_per_query streams each, and the results are split back out per stream.
+        :param streams: The stream objects
+        :param time_interval: The time interval
+        :return: A dict from stream id to a generator over its stream instances
+        """
+        results = dict((stream.stream_id, []) for stream in streams)
+        for stream_id in results:
+            self.flush(stream_id)
+        keys = dict((summary_stream_key(stream.stream_id), stream.stream_id) for stream in streams)
+        stream_ids = list(results)
+
+        for i in range(0, len(stream_ids), self.max_streams_per_query):
+            chunk = stream_ids[i:i + self.max_streams_per_query]
+            query_key = {'$in': [summary_stream_key(stream_id) for stream_id in chunk]}
+            for key, t, value in self._find(query_key, time_interval, with_stream_key=True):
+                results[keys[key]].append(StreamInstance(timestamp=t, value=value))
+
+        return dict((stream_id, iter(instances)) for stream_id, instances in results.items())
+
+    def _collection(self):
+        model = SummaryBucketModel if self.bucketed else SummaryInstanceModel
+        with switch_db(model, 'hyperstream'):
+            collection = model._get_collection()
+        if model not in self._indexed:
+            ensure_stream_key_index(collection, 'day' if self.bucketed else 'datetime')
+            self._indexed.add(model)
+        return collection
+
+    def _find(self, query_key, time_interval, with_stream_key=False):
+        """
+        Run a raw query against the summaries, in whichever layout they are stored
+        :param query_key: The stream_key part of the query
+        :param time_interval: The time interval
+        :param with_stream_key: Whether to fetch the stream_key of each document as well
+        :return: A generator over (stream_key, datetime, value) tuples, in time order for each stream
+        """
+        if self.bucketed:
+            query = {
+                'stream_key': query_key,
+                'day': {'$gte': _day(time_interval.start), '$lte': _day(time_interval.end)}
+            }
+            projection = {'_id': 0, 'datetimes': 1, 'values': 1}
+            if with_stream_key:
+                projection['stream_key'] = 1
+            cursor = self._collection().find(query, projection) \
+                .sort('day', ASCENDING) \
+                .batch_size(self.read_batch_size)
+            start, end = naive_utc(time_interval.start), naive_utc(time_interval.end)
+            for bucket in cursor:
+                for t, value in sorted(zip(bucket['datetimes'], bucket['values']), key=lambda x: x[0]):
+                    if start < naive_utc(t) <= end:
+                        yield bucket.get('stream_key'), t, value
+        else:
+            query = {
+                'stream_key': query_key,
+                'datetime': {'$gt': time_interval.start, '$lte': time_interval.end}
+            }
+            projection = {'_id': 0, 'datetime': 1, 'value': 1}
+            if with_stream_key:
+                projection['stream_key'] = 1
+            cursor = self._collection().find(query, projection) \
+                .sort('datetime', ASCENDING) \
+                .batch_size(self.read_batch_size)
+            for doc in cursor:
+                yield doc.get('stream_key'), doc['datetime'], doc['value']
+
+    def _rollup_tier(self, stream_id, resolution):
+        if resolution is None or _rollup_kind(stream_id, self.rollup_kinds) is None:
+            return None
+        tiers = [tier for tier in self.rollup_tiers if ROLLUP_PERIODS[tier] <= resolution]
+        return tiers[-1] if tiers else None
+
+    def _find_rollups(self, stream_id, tier, time_interval):
+        query = {
+            'stream_key': summary_stream_key(stream_id),
+            'tier': tier,
+            'datetime': {'$gt': time_interval.start, '$lte': _rollup_end(time_interval.end, tier)}
+        }
+        with switch_db(SummaryRollupModel, 'hyperstream'):
+            collection = SummaryRollupModel._get_collection()
+        cursor = collection.find(query, {'_id': 0, 'kind': 1, 'datetime': 1, 'value': 1}) \
+            .sort('datetime', ASCENDING) \
+            .batch_size(self.read_batch_size)
+        for doc in cursor:
+            yield StreamInstance(timestamp=doc['datetime'], value=_rollup_value(doc['kind'], doc['value']))
+
+    def rebuild_rollups(self, stream):
+        """
+        Rebuild the rollups of a stream from scratch, e.g. for summaries written before the rollups existed
+        :param stream: The stream object
+        :return: None
+        """
+        self.flush(stream.stream_id)
+        with switch_db(SummaryRollupModel, 'hyperstream'):
+            collection = SummaryRollupModel._get_collection()
+        collection.delete_many({'stream_key': summary_stream_key(stream.stream_id)})
+
+        batch = []
+        for _, t, value in self._find(summary_stream_key(stream.stream_id), TimeInterval(MIN_DATE, MAX_DATE)):
+            batch.append(StreamInstance(t, value))
+            if len(batch) >= self.write_batch_size:
+                self._update_rollups(stream.stream_id, batch)
+                batch = []
+        self._update_rollups(stream.stream_id, batch)
+
+    def get_results_documents(self, stream, time_interval):
+        """
+        Get the results for a given stream through the mongoengine Document model. Slower than get_results, but kept
+        for comparison and for debugging the raw query.
+        :param time_interval: The time interval
+        :param stream: The stream object
+        :return: A generator over stream instances
+        """
+        self.flush(stream.stream_id)
+        self._collection()
+        query = {
+            'stream_key': summary_stream_key(stream.stream_id),
+            'datetime': {'$gt': time_interval.start, '$lte': time_interval.end}
+        }
         with switch_db(SummaryInstanceModel, 'hyperstream'):
             for instance in SummaryInstanceModel.objects(__raw__=query):
                 yield StreamInstance(timestamp=instance.datetime, value=instance.value)
@@ -66,32 +460,251 @@ class SummaryChannel(DatabaseChannel):
     def get_stream_writer(self, stream):
         """
         Gets the database channel writer
-        The mongoengine model checks whether a stream_id/datetime pair already exists in the DB (unique pairs)
-        Should be overridden by users' personal channels - allows for non-mongo outputs.
+        The documents are buffered, and written in bulk once write_batch_size of them are waiting or the calculated
+        intervals of the stream are updated. A stream_id/datetime pair that already exists in the DB with the same value
+        is left untouched, and one with a different value raises a NotUniqueError.
         :param stream: The stream
         :return: The stream writer function
         """
+        if type(stream) is DatabaseStream:
+            # The channel manager loads existing streams as plain DatabaseStreams. SummaryStream only overrides the
+            # calculated_intervals setter, so they can be switched over in place.
+            stream.__class__ = SummaryStream
 
         def writer(document_collection):
-            with switch_db(SummaryInstanceModel, 'hyperstream'):
-                if isinstance(document_collection, StreamInstance):
-                    document_collection = [document_collection]
-
-                for t, doc in document_collection:
-                    instance = SummaryInstanceModel(
-                        stream_id=stream.stream_id.as_dict(),
-                        datetime=t,
-                        value=doc)
-                    try:
-                        instance.save()
-                    except NotUniqueError as e:
-                        # Implies that this has already been written to the database
-                        # Raise an error if the value differs from that in the database
-                        logging.warn("Found duplicate document: {}".format(e.message))
-                        existing = SummaryInstanceModel.objects(stream_id=stream.stream_id.as_dict(), datetime=t)[0]
-                        if existing.value != doc:
-                            raise e
-                    except (InvalidDocumentError, InvalidDocument) as e:
-                        # Something wrong with the document - log the error
-                        logging.error(e)
+            if isinstance(document_collection, StreamInstance):
+                document_collection = [document_collection]
+
+            pending = self._pending[stream.stream_id]
+            for t, doc in document_collection:
+                pending.append(StreamInstance(t, doc))
+            if len(pending) >= self.write_batch_size or not isinstance(stream, SummaryStream):
+                self.flush(stream.stream_id)
         return writer
+
+    @staticmethod
+    def _raw_document(stream_id, key, t, value):
+        return SON([
+            ('stream_id', SON([('name', stream_id.name), ('meta_data', stream_id.meta_data)])),
+            ('stream_key', key),
+            ('datetime', t),
+            ('value', value)
+        ])
+
+    def _write_batch(self, stream_id, instances):
+        if self.bucketed:
+            inserted, conflicts = self._write_bucket_batch(stream_id, instances)
+        else:
+            inserted, conflicts = self._write_instance_batch(stream_id, instances)
+        self._update_rollups(stream_id, inserted)
+        if conflicts:
+            raise NotUniqueError("{} documents for stream {} already exist with a different value, the first at {}"
+                                 .format(len(conflicts), stream_id, conflicts[0]))
+
+    def _update_rollups(self, stream_id, instances):
+        """
+        Fold newly written instances into the rollup tiers, with one upsert per tier and period in a single bulk write
+        :param stream_id: The stream id
+        :param instances: The instances that were not in the database before
+        :return: None
+        """
+        kind = _rollup_kind(stream_id, self.rollup_kinds)
+        if kind is None or not self.rollup_tiers or not instances:
+            return
+
+        merged = {}
+        counts = defaultdict(int)
+        for t, value in instances:
+            for tier in self.rollup_tiers:
+                period = (tier, _rollup_end(t, tier))
+                merged[period] = _merge(kind, merged.get(period), value)
+                counts[period] += 1
+
+        key = summary_stream_key(stream_id)
+        stored_kind = 'hist_list' if kind == 'hist' and not isinstance(instances[0].value, dict) else kind
+        updates = []
+        for (tier, end), partial in merged.items():
+            if partial is None or partial == {}:
+                continue
+            update = _rollup_update(kind, partial)
+            update.setdefault('$inc', {})['count'] = counts[(tier, end)]
+            update['$setOnInsert'] = {
+                'stream_id': SON([('name', stream_id.name), ('meta_data', stream_id.meta_data)]),
+                'kind': stored_kind
+            }
+            updates.append(UpdateOne({'stream_key': key, 'tier': tier, 'datetime': end}, update, upsert=True))
+
+        with switch_db(SummaryRollupModel, 'hyperstream'):
+            collection = SummaryRollupModel._get_collection()
+        if updates:
+            collection.bulk_write(updates, ordered=False)
+
+    def _write_instance_batch(self, stream_id, instances):
+        """
+        Upsert a batch of instances in a single unordered bulk write. The filter includes the value, so an existing
+        identical document is a no-op while an existing document with a different value violates the unique
+        (stream_key, datetime) index and is reported back in the same round-trip.
+        :param stream_id: The stream id
+        :param instances: The stream instances
+        :return: The instances that were inserted, and the datetimes that clash with a different stored value
+        """
+        key = summary_stream_key(stream_id)
+        documents = [self._raw_document(stream_id, key, t, doc) for t, doc in instances]
+        filters = [{'stream_key': key, 'datetime': d['datetime'], 'value': d['value']} for d in documents]
+        collection = self._collection()
+        with switch_db(SummaryInstanceModel, 'hyperstream'):
+            try:
+                result = collection.bulk_write([ReplaceOne(f, d, upsert=True) for f, d in zip(filters, documents)],
+                                               ordered=False)
+                return [instances[i] for i in sorted(result.upserted_ids)], []
+            except BulkWriteError as e:
+                errors = e.details['writeErrors']
+                if any(error['code'] != DUPLICATE_KEY_ERROR for error in errors):
+                    raise
+                inserted = [instances[u['index']] for u in sorted(e.details['upserted'], key=lambda u: u['index'])]
+                conflicts = self._find_conflicts(collection, stream_id, [documents[error['index']] for error in errors])
+                return inserted, conflicts
+            except InvalidDocument:
+                # Something wrong with one of the documents - fall back to writing them one at a time
+                return self._write_one_by_one(stream_id, instances)
+
+    def _write_bucket_batch(self, stream_id, instances):
+        """
+        Append a batch of instances to their day buckets. The buckets touched by the batch are read first, so that
+        instances already stored with the same value are skipped and ones stored with a different value are reported
+        as conflicts. The remainder are pushed to the buckets in a single unordered bulk write.
+
+        Each push only applies if none of its datetimes is in the bucket yet. If another writer has added one of them
+        since the bucket was read, the upsert clashes with the unique (stream_key, day) index instead, and that bucket
+        is read and pushed again.
+        :param stream_id: The stream id
+        :param instances: The stream instances
+        :return: The instances that were inserted, and the datetimes that clash with a different stored value
+        """
+        key = summary_stream_key(stream_id)
+        days = defaultdict(list)
+        for t, doc in instances:
+            days[_day(t)].append((t, doc))
+
+        def push(day, datetimes, values):
+            return UpdateOne(
+                {'stream_key': key, 'day': day, 'datetimes': {'$nin': datetimes}},
+                {
+                    '$setOnInsert': {'stream_id': SON([('name', stream_id.name), ('meta_data', stream_id.meta_data)])},
+                    '$push': {'datetimes': {'$each': datetimes}, 'values': {'$each': values}}
+                },
+                upsert=True)
+
+        collection = self._collection()
+        inserted = []
+        conflicts = []
+        while days:
+            updates, day_conflicts = self._bucket_updates(collection, key, days)
+            conflicts.extend(day_conflicts)
+            if not updates:
+                break
+            try:
+                collection.bulk_write([push(*update) for update in updates], ordered=False)
+                failed = set()
+            except BulkWriteError as e:
+                errors = e.details['writeErrors']
+                if any(error['code'] != DUPLICATE_KEY_ERROR for error in errors):
+                    raise
+                failed = set(error['index'] for error in errors)
+            except InvalidDocument:
+                # Something wrong with one of the documents - fall back to pushing them one at a time
+                inserted.extend(self._push_one_by_one(collection, push, updates))
+                break
+            for i, (day, datetimes, values) in enumerate(updates):
+                if i not in failed:
+                    inserted.extend(StreamInstance(t, doc) for t, doc in zip(datetimes, values))
+            days = dict((updates[i][0], days[updates[i][0]]) for i in failed)
+        return inserted, conflicts
+
+    @staticmethod
+    def _bucket_updates(collection, key, days):
+        """
+        Compare the instances of each day against its stored bucket
+        :param collection: The pymongo collection
+        :param key: The stream key
+        :param days: dict of day -> list of (datetime, value) pairs
+        :return: The (day, datetimes, values) to push, and the datetimes that clash with a different stored value
+        """
+        existing = {}
+        query = {'stream_key': key, 'day': {'$in': list(days)}}
+        for bucket in collection.find(query, {'_id': 0, 'datetimes': 1, 'values': 1}):
+            existing.update(zip(map(naive_utc, bucket['datetimes']), bucket['values']))
+
+        updates = []
+        conflicts = []
+        for day, items in days.items():
+            datetimes, values = [], []
+            for t, doc in items:
+                if naive_utc(t) in existing:
+                    if existing[naive_utc(t)] != doc:
+                        conflicts.append(t)
+                    continue
+                existing[naive_utc(t)] = doc
+                datetimes.append(t)
+                values.append(doc)
+            if datetimes:
+                updates.append((day, datetimes, values))
+        return updates, conflicts
+
+    @staticmethod
+    def _push_one_by_one(collection, push, updates):
+        inserted = []
+        for day, datetimes, values in updates:
+            for t, doc in zip(datetimes, values):
+                try:
+                    collection.bulk_write([push(day, [t], [doc])])
+                    inserted.append(StreamInstance(t, doc))
+                except BulkWriteError:
+                    # Implies that another writer has pushed it in the meantime
+                    logging.warn("Found duplicate document for {}".format(t))
+                except InvalidDocument as e:
+                    logging.error(e)
+        return inserted
+
+    @staticmethod
+    def _find_conflicts(collection, stream_id, documents):
+        """
+        Compare the values of documents that clashed with the unique index against those in the database. Embedded
+        documents only match in mongo if their keys are in the same order, so not every clash is a real conflict.
+        :param collection: The pymongo collection
+        :param stream_id: The stream id
+        :param documents: The documents that clashed
+        :return: The datetimes of the documents whose value differs from the stored one
+        """
+        logging.warn("Found {} duplicate documents for stream {}".format(len(documents), stream_id))
+        query = {
+            'stream_key': summary_stream_key(stream_id),
+            'datetime': {'$in': [d['datetime'] for d in documents]}
+        }
+        cursor = collection.find(query, {'datetime': 1, 'value': 1})
+        existing = dict((naive_utc(d['datetime']), d['value']) for d in cursor)
+        return [d['datetime'] for d in documents if existing.get(naive_utc(d['datetime'])) != d['value']]
+
+    @staticmethod
+    def _write_one_by_one(stream_id, instances):
+        inserted, conflicts = [], []
+        for t, doc in instances:
+            instance = SummaryInstanceModel(
+                stream_id=stream_id.as_dict(),
+                stream_key=summary_stream_key(stream_id),
+                datetime=t,
+                value=doc)
+            try:
+                instance.save()
+                inserted.append(StreamInstance(t, doc))
+            except NotUniqueError as e:
+                # Implies that this has already been written to the database
+                # Report a conflict if the value differs from that in the database
+                logging.warn("Found duplicate document: {}".format(e.message))
+                existing = SummaryInstanceModel.objects(stream_key=summary_stream_key(stream_id), datetime=t)[0]
+                if existing.value != doc:
+                    conflicts.append(t)
+            except (InvalidDocumentError, InvalidDocument) as e:
+                # Something wrong with the document - log the error
+                logging.error(e)
+        return inserted, conflicts
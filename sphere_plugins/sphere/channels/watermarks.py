@@ -0,0 +1,97 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import os
+
+from dateutil.parser import parse
+from pymongo import DESCENDING
+
+from hyperstream.utils import UTC
+
+
+def _utc(dt):
+    return dt.replace(tzinfo=UTC) if dt.tzinfo is None else dt
+
+
+class SphereWatermarkSource(object):
+    """
+    Watermarks from the SPHERE MongoDB. Each call fetches a single datetime: the newest one of the modality.
+    """
+    def __init__(self, collections, filters=None):
+        """
+        :param collections: The pymongo collection of each modality, e.g. {'wearable': db['wearable']}
+        :param filters: Any filters to apply to the documents, e.g. to restrict to a house
+        """
+        self.collections = collections
+        self.filters = filters
+
+    def newest(self, modality, since):
+        """
+        Gets the newest datetime of the modality after the given time
+        :param modality: The modality
+        :param since: The previous watermark
+        :return: The newest datetime, or None if no new data has arrived
+        """
+        query = dict(self.filters or {})
+        query['datetime'] = {'$gt': since}
+        docs = self.collections[modality].find(query, {'_id': False, 'datetime': True}) \
+            .sort('datetime', DESCENDING).limit(1)
+        for doc in docs:
+            return _utc(doc['datetime'])
+        return None
+
+
+class FileWatermarkSource(object):
+    """
+    File-backed stand-in for the SPHERE MongoDB, for testing live workflows without a mongod. Each modality is a file
+    <modality>.jsonl in the given directory, with one JSON document containing an ISO 8601 datetime per line. Files are
+    tailed: each call only reads the lines appended since the previous one.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.offsets = {}
+
+    def newest(self, modality, since):
+        """
+        Gets the newest datetime of the modality after the given time
+        :param modality: The modality
+        :param since: The previous watermark
+        :return: The newest datetime, or None if no new data has arrived
+        """
+        filename = os.path.join(self.path, modality + '.jsonl')
+        if not os.path.exists(filename):
+            return None
+
+        newest = None
+        with open(filename) as f:
+            f.seek(self.offsets.get(modality, 0))
+            while True:
+                line = f.readline()
+                if not line.endswith('\n'):
+                    # Nothing more, or a line that is still being written
+                    break
+                self.offsets[modality] = f.tell()
+                if not line.strip():
+                    continue
+                dt = _utc(parse(json.loads(line)['datetime']))
+                if dt > since and (newest is None or dt > newest):
+                    newest = dt
+        return newest
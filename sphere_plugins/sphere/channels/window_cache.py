@@ -0,0 +1,202 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pickle
+from datetime import datetime, timedelta
+
+from hyperstream.utils import UTC, utcnow
+
+from sphere_plugins.sphere.channels.projection import project
+from sphere_plugins.sphere.utils.raw_documents import aware_utc, sphere_fetch, to_columns, from_columns
+
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+# Buckets are fetched with this much margin either side, so that documents exactly on a bucket boundary end up in the
+# right bucket whatever the bounds convention of the connector
+BOUNDARY_MARGIN = timedelta(milliseconds=1)
+
+globs = {'window_cache': None}
+
+
+class RawWindowCache(object):
+    """
+    Read-through cache of raw SPHERE documents on local disk, so that backfills and retraining do not download the same
+    windows from the MongoDB again. Windows are split into fixed time buckets, and each bucket of each query (modality,
+    elements, filters, fields) is stored as a compressed columnar file. Buckets that are still open (or too recent for
+    late data to have settled) are always fetched from the database and never stored. The least recently used files are
+    evicted when the cache grows beyond max_bytes.
+    """
+    def __init__(self, path, max_bytes=10 * 1024 ** 3, bucket_size=timedelta(hours=1), settle_time=timedelta(hours=1),
+                 fetch=sphere_fetch):
+        """
+        :param path: The directory for the cache files
+        :param max_bytes: The maximum total size of the cache files
+        :param bucket_size: The length of the time buckets
+        :param settle_time: How long after the end of a bucket it can still receive data
+        :param fetch: The function that fetches the documents for a query from the database
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.bucket_size = bucket_size
+        self.settle_time = settle_time
+        self.fetch = fetch
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.total_bytes = sum(size for _, _, size in self._files())
+
+    def _files(self):
+        for filename in os.listdir(self.path):
+            if filename.endswith('.gz'):
+                try:
+                    stat = os.stat(os.path.join(self.path, filename))
+                except OSError:
+                    continue
+                yield filename, stat.st_mtime, stat.st_size
+
+    def _filename(self, query, bucket_start):
+        key = json.dumps([query, self.bucket_size.total_seconds(), bucket_start.isoformat()], sort_keys=True,
+                         default=str)
+        return os.path.join(self.path, hashlib.md5(key.encode('utf-8')).hexdigest() + '.gz')
+
+    def buckets(self, start, end):
+        """
+        Gets the time buckets that cover the given window
+        :param start: The start of the window
+        :param end: The end of the window
+        :return: The start times of the buckets
+        """
+        first = EPOCH + self.bucket_size * int((aware_utc(start) - EPOCH).total_seconds() //
+                                               self.bucket_size.total_seconds())
+        bucket_start = first
+        while bucket_start < aware_utc(end):
+            yield bucket_start
+            bucket_start += self.bucket_size
+
+    def get_data(self, time_interval, modality, elements=None, filters=None, rename_keys=False, fields=None):
+        """
+        Gets the documents of the modality in the given time interval, in the same way as DataWindow.get_data.
+        :param time_interval: The time interval
+        :param modality: The modality
+        :param elements: The elements to fetch
+        :param filters: The filters to apply
+        :param rename_keys: Whether to rename the keys
+        :param fields: The fields to keep, or None for all of them
+        :return: The documents
+        """
+        start, end = aware_utc(time_interval.start), aware_utc(time_interval.end)
+        query = [modality, sorted(elements) if elements else None, filters, rename_keys]
+        if fields is not None:
+            query.append(sorted(fields))
+        closed_until = utcnow() - self.settle_time
+
+        open_from = None
+        for bucket_start in self.buckets(start, end):
+            bucket_end = bucket_start + self.bucket_size
+            if bucket_end > closed_until:
+                open_from = max(bucket_start, start)
+                break
+            for doc in self._get_bucket(query, bucket_start, bucket_end, fields):
+                if start < aware_utc(doc['datetime']) <= end:
+                    yield doc
+
+        if open_from is not None:
+            for doc in project(self.fetch(open_from, end, modality, elements, filters, rename_keys), modality, fields):
+                yield doc
+
+    def _get_bucket(self, query, bucket_start, bucket_end, fields):
+        filename = self._filename(query, bucket_start)
+        try:
+            with gzip.open(filename, 'rb') as f:
+                docs = from_columns(pickle.load(f))
+            os.utime(filename, None)
+            self.hits += 1
+            return docs
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            # Not cached, or evicted by another process in the meantime
+            pass
+
+        self.misses += 1
+        docs = self.fetch(bucket_start - BOUNDARY_MARGIN, bucket_end + BOUNDARY_MARGIN, *query[:4])
+        docs = [doc for doc in project(docs, query[0], fields)
+                if bucket_start < aware_utc(doc['datetime']) <= bucket_end]
+        self._store(filename, docs)
+        return docs
+
+    def _store(self, filename, docs):
+        tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+        try:
+            with gzip.open(tmp_filename, 'wb') as f:
+                pickle.dump(to_columns(docs), f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_filename, filename)
+            self.total_bytes += os.path.getsize(filename)
+        except (IOError, OSError) as e:
+            logging.warn("Failed to cache SPHERE window {}: {}".format(filename, e))
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            return
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used files until the cache is within max_bytes
+        """
+        files = sorted(self._files(), key=lambda f: f[1])
+        self.total_bytes = sum(size for _, _, size in files)
+        for filename, _, size in files:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, filename))
+            except OSError:
+                pass
+            self.total_bytes -= size
+
+
+def get_window_cache():
+    """
+    Gets the global raw window cache. This is disabled unless it has been configured with configure_window_cache, or the
+    SPHERE_WINDOW_CACHE environment variable gives the cache directory.
+    :return: The cache, or None
+    """
+    if globs['window_cache'] is None and os.environ.get('SPHERE_WINDOW_CACHE'):
+        max_bytes = os.environ.get('SPHERE_WINDOW_CACHE_BYTES')
+        configure_window_cache(os.environ['SPHERE_WINDOW_CACHE'],
+                               **(dict(max_bytes=int(max_bytes)) if max_bytes else {}))
+    return globs['window_cache']
+
+
+def configure_window_cache(path, **kwargs):
+    """
+    Sets up the global raw window cache used by the Sphere tool
+    :param path: The directory for the cache files, or None to disable the cache
+    :param kwargs: Other arguments to RawWindowCache
+    :return: The cache
+    """
+    globs['window_cache'] = RawWindowCache(path, **kwargs) if path else None
+    return globs['window_cache']
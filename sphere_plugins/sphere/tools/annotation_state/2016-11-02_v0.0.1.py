@@ -24,9 +24,36 @@ OR OTHER DEALINGS IN THE SOFTWARE.
 from hyperstream.stream import StreamInstance
 from hyperstream.tool import Tool, check_input_stream_count
 from hyperstream import TimeInterval, TimeIntervals
+from sphere_plugins.sphere.utils.stream_keys import summary_stream_key, naive_utc
+from mongoengine import Document, StringField, DateTimeField, IntField, ListField
+from mongoengine.context_managers import switch_db
 from copy import deepcopy
+from itertools import chain
 import logging
 
+# The number of snapshots kept per stream. Older ones are deleted, so intervals before them are replayed from start_time
+MAX_SNAPSHOTS = 48
+
+
+class AnnoStateSnapshotModel(Document):
+    """
+    The state of the annotations of a stream after all of the annotations up to the given datetime
+    """
+    stream_key = StringField(required=True, min_length=32, max_length=32)
+    start_time = DateTimeField(required=True)
+    datetime = DateTimeField(required=True)
+    last_experiment = IntField(required=True)
+    # [tier, [labels]] pairs, as tiers are not necessarily valid field names
+    annotations = ListField(required=True)
+
+    meta = {
+        'collection': 'anno_state_snapshots',
+        'indexes': [
+            {'fields': ['stream_key', 'start_time', 'datetime'], 'unique': True}
+        ],
+        'ordering': ['datetime']
+    }
+
 
 # this tool currently assumes non-overlapping sliding windows in its first input stream
 
@@ -35,21 +62,58 @@ class AnnoState(Tool):
         super(AnnoState, self).__init__(start_time=start_time)
         self.start_time = start_time
 
+    def load_snapshot(self, stream_key, timestamp):
+        """
+        Gets the latest snapshot of the annotation state at or before the given time
+        :return: The time, annotations and last experiment of the snapshot, or None if there is none
+        """
+        with switch_db(AnnoStateSnapshotModel, 'hyperstream'):
+            snapshot = AnnoStateSnapshotModel.objects(
+                stream_key=stream_key, start_time=naive_utc(self.start_time),
+                datetime__lte=naive_utc(timestamp)).order_by('-datetime').first()
+        if snapshot is None:
+            return None
+        annotations = dict((tier, set(labels)) for tier, labels in snapshot.annotations)
+        return snapshot.datetime.replace(tzinfo=timestamp.tzinfo), annotations, snapshot.last_experiment
+
+    def save_snapshot(self, stream_key, timestamp, annotations, last_experiment):
+        """
+        Saves a snapshot of the annotation state, and deletes all but the latest MAX_SNAPSHOTS of the stream
+        """
+        with switch_db(AnnoStateSnapshotModel, 'hyperstream'):
+            snapshots = AnnoStateSnapshotModel.objects(stream_key=stream_key, start_time=naive_utc(self.start_time))
+            snapshots.filter(datetime=naive_utc(timestamp)).update_one(
+                upsert=True,
+                set__last_experiment=last_experiment,
+                set__annotations=[[tier, sorted(labels)] for tier, labels in annotations.items()])
+            expired = snapshots.order_by('-datetime').skip(MAX_SNAPSHOTS).first()
+            if expired is not None:
+                snapshots.filter(datetime__lte=expired.datetime).delete()
+
     # noinspection PyCompatibility
     @check_input_stream_count(2)
     def _execute(self, sources, alignment_stream, interval):
-        interval2 = TimeInterval(self.start_time, interval.end)
         windows = iter(sources[0].window(interval, force_calculation=True))
-        data = iter(sources[1].window(interval2, force_calculation=True))
+        try:
+            first = next(windows)
+        except StopIteration:
+            return
+        windows = chain([first], windows)
 
-        # run from self.start_time to interval.start to find out the state at the beginning of the interval
+        # resume from the latest snapshot at or before the start of the first window, or else from self.start_time,
+        # to find out the state at the beginning of the interval
         # then from there on yield documents according to the sliding window,
         # containing the active annotations within the window
+        stream_key = summary_stream_key(sources[1].stream_id)
+        snapshot = self.load_snapshot(stream_key, first[1].start)
+        if snapshot is not None:
+            checkpoint, annotations, last_experiment = snapshot
+        else:
+            checkpoint, annotations, last_experiment = self.start_time, {}, 0
+        data = iter(sources[1].window(TimeInterval(checkpoint, interval.end), force_calculation=True))
 
         win_future = []
         data_future = []
-        annotations = {}
-        last_experiment = 0
 
         while True:
             if len(data_future) == 0:
@@ -68,6 +132,8 @@ class AnnoState(Tool):
                 except StopIteration:
                     pass
             if len(win_future) == 0:
+                # all annotations up to the end of the last window have been applied
+                self.save_snapshot(stream_key, win_end, annotations, last_experiment)
                 return
 
             # the current annotation has potential effect on the current window
@@ -24,10 +24,100 @@ OR OTHER DEALINGS IN THE SOFTWARE.
 from hyperstream.stream import StreamInstance
 from hyperstream.tool import Tool, check_input_stream_count
 from hyperstream import TimeInterval
-from copy import deepcopy
+from hyperstream.utils import UTC
+import numpy as np
 import logging
 import datetime
 
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+STILL_OPEN = np.iinfo(np.int64).max
+
+
+def _micros(t):
+    d = t - EPOCH
+    return (d.days * 86400 + d.seconds) * 1000000 + d.microseconds
+
+
+def label_intervals(events, until):
+    """
+    Turns trigger events into per tier label intervals. A label is open from the event that starts it up to and
+    excluding the event that ends it, and starting a label which is already open has no effect.
+
+    :param events: (micros, timestamp, trigger, tier, label) tuples in time order
+    :param until: events after this time (in micros) are ignored
+    :return: dict of tier -> (event times, labels, label index, open times, close times) where the close time of a
+             label which is still open is STILL_OPEN
+    """
+    tiers = {}
+    for micros, tt, trigger, tier, label in events:
+        if micros > until:
+            break
+        if tier not in tiers:
+            tiers[tier] = ([], [], [], {})
+        times, opened, closed, open_labels = tiers[tier]
+        times.append(micros)
+        if trigger == 1:
+            if label not in open_labels:
+                open_labels[label] = micros
+        elif trigger == -1:
+            if label in open_labels:
+                opened.append((label, open_labels.pop(label)))
+                closed.append(micros)
+            else:
+                logging.warn("At time {} label {} of tier {} ending without a start".format(tt, label, tier))
+        else:
+            raise ValueError("trigger must have value +1 or -1")
+
+    intervals = {}
+    for tier, (times, opened, closed, open_labels) in tiers.items():
+        for label, micros in open_labels.items():
+            opened.append((label, micros))
+            closed.append(STILL_OPEN)
+        labels = sorted(set(label for label, _ in opened))
+        index = dict((label, k) for k, label in enumerate(labels))
+        intervals[tier] = (np.array(times, dtype=np.int64), labels,
+                           np.array([index[label] for label, _ in opened], dtype=np.int64),
+                           np.array([micros for _, micros in opened], dtype=np.int64),
+                           np.array(closed, dtype=np.int64))
+    return intervals
+
+
+def label_windows(starts, ends, intervals):
+    """
+    Assigns the active labels of each tier to every window at once. A tier is 'MIX' in a window if it has an event
+    within the window, otherwise it has the labels which are open at the end of the window. Tiers are only present
+    from the window in which their first event happens.
+
+    :param starts: The window start times in micros, sorted and non-overlapping
+    :param ends: The window end times in micros
+    :param intervals: The label intervals as returned by label_intervals
+    :return: A list of dicts of tier -> list of labels, one per window
+    """
+    n = len(ends)
+    results = [{} for _ in range(n)]
+    for tier, (times, labels, index, opened, closed) in intervals.items():
+        first = np.searchsorted(ends, times[0], side='left')
+        mix = np.searchsorted(times, ends, side='right') > np.searchsorted(times, starts, side='right')
+
+        # a label is active in the windows whose end is within its interval
+        depth = np.zeros((len(labels), n + 1), dtype=np.int32)
+        np.add.at(depth, (index, np.searchsorted(ends, opened, side='left')), 1)
+        np.add.at(depth, (index, np.searchsorted(ends, closed, side='left')), -1)
+        active = np.cumsum(depth, axis=1)[:, :n] > 0
+
+        # the labels only need working out where the state of the tier changes
+        state = np.vstack((mix, active))
+        changes = np.flatnonzero(np.any(state[:, first + 1:] != state[:, first:-1], axis=0)) + first + 1
+        bounds = [first] + changes.tolist() + [n]
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            if mix[lo]:
+                value = ['MIX']
+            else:
+                value = list(set(labels[k] for k in np.flatnonzero(active[:, lo])))
+            for i in range(lo, hi):
+                results[i][tier] = list(value)
+    return results
+
 
 class AnnotationStateLocation(Tool):
     """
@@ -40,73 +130,20 @@ class AnnotationStateLocation(Tool):
 
     @check_input_stream_count(2)
     def _execute(self, sources, alignment_stream, interval):
-        data = list(sources[1].window(interval, force_calculation=True))
-        timestamps = [x.timestamp for x in data]
-        try:
-            interval2 = TimeInterval(min(timestamps) - datetime.timedelta(microseconds=1), max(timestamps))
-        except ValueError:
+        events = [(_micros(tt), tt, dd['trigger'], dd['tier'], dd['label'])
+                  for tt, dd in sources[1].window(interval, force_calculation=True)]
+        if not events:
             # TODO: Something more intelligent - This is raised when the source stream is empty
             return
+        interval2 = TimeInterval(events[0][1] - datetime.timedelta(microseconds=1), events[-1][1])
 
-        windows = iter(sources[0].window(interval2, force_calculation=True))
-        data = iter(data)
-
-        # run from self.start_time to interval.start to find out the state at the beginning of the interval
-        # then from there on yield documents according to the sliding window,
-        # containing the active annotations within the window
-
-        win_future = []
-        data_future = []
-        annotations = {}
-
-        while True:
-            if len(data_future) == 0:
-                try:
-                    doc = next(data)
-                    data_future.append(doc)
-                except StopIteration:
-                    pass
-            if len(win_future) == 0:
-                try:
-                    _, win = next(windows)
-                    win_future.append(win)
-                    win_start = win_future[0].start
-                    win_end = win_future[0].end
-                    win_annotations = deepcopy(annotations)
-                except StopIteration:
-                    pass
-            if len(win_future) == 0:
-                return
-
-            # the current annotation has potential effect on the current window
-            if (len(data_future) > 0) and (data_future[0].timestamp <= win_end):
-                doc = data_future.pop(0)
-                tt, dd = doc
-                trigger = dd['trigger']
-                tier = dd['tier']
-                label = dd['label']
-                if not annotations.has_key(tier):
-                    annotations[tier] = set()
-                if trigger == 1:
-                    annotations[tier].add(label)
-                elif trigger == -1:
-                    try:
-                        annotations[tier].remove(label)  # raises KeyError if removing a label which is not present
-                    except KeyError:
-                        logging.warn("At time {} label {} of tier {} ending without a start".
-                                     format(tt, label, tier))
-                else:
-                    raise ValueError("trigger must have value +1 or -1")
-
-                if tt > win_start:  # the current annotation is changing a tier within the current window
-                    win_annotations[tier] = {'MIX'}
-                else:
-                    win_annotations[tier] = annotations[tier].copy()
-            else:
-                # must yield a window because it has been finished
-                # now convert the sets into lists
-                res = {}
-                for tier in win_annotations.keys():
-                    res[tier] = list(win_annotations[tier])
-                yield StreamInstance(win_end, res)
-                win_future.pop(0)
+        windows = [win for _, win in sources[0].window(interval2, force_calculation=True)]
+        if not windows:
+            return
+        starts = np.array([_micros(win.start) for win in windows], dtype=np.int64)
+        ends = np.array([_micros(win.end) for win in windows], dtype=np.int64)
+
+        # turn the annotations into label intervals, then label all of the windows in one pass over their boundaries
+        intervals = label_intervals(events, ends[-1])
+        for win, res in zip(windows, label_windows(starts, ends, intervals)):
+            yield StreamInstance(win.end, res)
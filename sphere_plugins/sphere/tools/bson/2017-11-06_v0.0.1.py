@@ -21,12 +21,9 @@
 from hyperstream.stream import StreamInstance, StreamMetaInstance
 from hyperstream.tool import MultiOutputTool
 from sphere_plugins.sphere.channels.bson_channel import SphereDataWindow, SphereExperiment
+from sphere_plugins.sphere.channels.bson_files import get_bson_files
 
-from copy import deepcopy
 
-
-# todo:
-# load actual item collections for date range from files
 class Bson(MultiOutputTool):
     def __init__(self, modality, elements=None, filters=None, rename_keys=False, annotators=None, dedupe=False,
                  default_house='1'):
@@ -36,12 +33,11 @@ class Bson(MultiOutputTool):
     def _execute(self, source, splitting_stream, interval, meta_data_id, output_plate_values):
         if source is not None:
             raise ValueError("Sphere tool does not expect an input source")
-        window = SphereExperiment(interval, self.annotators) if self.annotators else SphereDataWindow(interval)
-        source = window.modalities[self.modality]
+        docs = self.fetch(interval)
 
         if self.dedupe:
             previous = None
-            for instance in source.get_data(self.elements, self.filters, self.rename_keys):
+            for instance in docs:
                 if previous:
                     current = self.reformat(instance)
                     if current.stream_instance.timestamp == previous.stream_instance.timestamp:
@@ -63,16 +59,29 @@ class Bson(MultiOutputTool):
             if previous:
                 yield previous
         else:
-            for instance in source.get_data(self.elements, self.filters, self.rename_keys):
+            for instance in docs:
                 yield self.reformat(instance)
 
+    def fetch(self, interval):
+        """
+        Gets the raw documents, straight from the indexed BSON dump files if they are configured and the query can be
+        served from them (no elements, key renaming or annotators), or otherwise through the data window
+        :param interval: The time interval
+        :return: The documents
+        """
+        files = get_bson_files()
+        if files is not None and self.elements is None and not self.rename_keys and not self.annotators:
+            return files.get_data(interval, self.modality, self.filters)
+
+        window = SphereExperiment(interval, self.annotators) if self.annotators else SphereDataWindow(interval)
+        return window.modalities[self.modality].get_data(self.elements, self.filters, self.rename_keys)
+
     def reformat(self, doc):
-        doc = deepcopy(doc)
-        dt = doc.pop('datetime')
-        if 'hid' in doc and doc['hid'] is not None:
-            house_id = doc.pop('hid')
-            meta_data = ('house', house_id)
+        # A shallow copy is enough, as only the top level keys are removed. Deep copying was the main cost of ingestion
+        value = dict(doc)
+        dt = value.pop('datetime')
+        if value.get('hid') is not None:
+            house_id = value.pop('hid')
         else:
             house_id = self.default_house
-            meta_data = ('house', house_id)
-        return StreamMetaInstance(stream_instance=StreamInstance(dt, doc), meta_data=meta_data)
+        return StreamMetaInstance(stream_instance=StreamInstance(dt, value), meta_data=('house', house_id))
@@ -21,18 +21,41 @@
 from hyperstream.stream import StreamInstance
 from hyperstream.tool import Tool, check_input_stream_count
 from math import sqrt
+from itertools import chain
+import numpy as np
+
+
+def magnitudes(samples):
+    """
+    Calculates the magnitudes of a block of accelerometer samples in one go
+    :param samples: An n x 3 array of x, y and z
+    :return: An array of the n magnitudes
+    """
+    samples = np.asarray(samples)
+    return np.sqrt(samples[:, 0]**2 + samples[:, 1]**2 + samples[:, 2]**2)
 
 
 class CalcAccMagnitude(Tool):
     """
     Calculates the magnitude of acceleration = sqrt(x**2+y**2+z**2)
+    In block mode the samples of the whole interval are calculated in one vectorised call, and a single
+    (timestamps, magnitudes) instance is emitted at the end of the interval
     """
 
-    def __init__(self):
-        super(CalcAccMagnitude, self).__init__()
+    def __init__(self, block=False):
+        super(CalcAccMagnitude, self).__init__(block=block)
+        self.block = block
 
     @check_input_stream_count(1)
     def _execute(self, sources, alignment_stream, interval):
+        if self.block:
+            data = list(sources[0].window(interval, force_calculation=True))
+            if data:
+                samples = np.fromiter(chain.from_iterable(d[:3] for _, d in data), dtype=float,
+                                      count=3 * len(data)).reshape(len(data), 3)
+                yield StreamInstance(interval.end, ([time for time, _ in data], magnitudes(samples)))
+            return
+
         for time, data in sources[0].window(interval, force_calculation=True):
             magnitude = sqrt(data[0]**2+data[1]**2+data[2]**2)
             yield StreamInstance(time, magnitude)
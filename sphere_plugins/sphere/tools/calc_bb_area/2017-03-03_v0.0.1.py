@@ -20,18 +20,41 @@
 
 from hyperstream.stream import StreamInstance
 from hyperstream.tool import Tool, check_input_stream_count
+from itertools import chain
+import numpy as np
+
+
+def areas(boxes):
+    """
+    Calculates the areas of a block of 2d bounding boxes in one go
+    :param boxes: An n x 4 array of left, top, right and bottom
+    :return: An array of the n areas
+    """
+    boxes = np.asarray(boxes)
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
 
 
 class CalcBbArea(Tool):
     """
     Calculates the area of a 2d bounding box
+    In block mode the boxes of the whole interval are calculated in one vectorised call, and a single
+    (timestamps, areas) instance is emitted at the end of the interval
     """
 
-    def __init__(self):
-        super(CalcBbArea, self).__init__()
+    def __init__(self, block=False):
+        super(CalcBbArea, self).__init__(block=block)
+        self.block = block
 
     @check_input_stream_count(1)
     def _execute(self, sources, alignment_stream, interval):
+        if self.block:
+            data = list(sources[0].window(interval, force_calculation=True))
+            if data:
+                boxes = np.fromiter(chain.from_iterable(d[:4] for _, d in data), dtype=float,
+                                    count=4 * len(data)).reshape(len(data), 4)
+                yield StreamInstance(interval.end, ([time for time, _ in data], areas(boxes)))
+            return
+
         for time, data in sources[0].window(interval, force_calculation=True):
             # area = (data['right']-data['left'])*(data['bottom']-data['top'])
             area = (data[2]-data[0])*(data[3]-data[1])
@@ -20,18 +20,42 @@
 
 from hyperstream.stream import StreamInstance
 from hyperstream.tool import Tool, check_input_stream_count
+from itertools import chain
+import numpy as np
+
+
+def volumes(boxes):
+    """
+    Calculates the volumes in litres of a block of 3d bounding boxes in one go
+    :param boxes: An n x 6 array of left, top, front, right, bottom and back
+    :return: An array of the n volumes
+    """
+    boxes = np.asarray(boxes)
+    width, height, depth = boxes[:, 3] - boxes[:, 0], boxes[:, 1] - boxes[:, 4], boxes[:, 5] - boxes[:, 2]
+    return width / 100.0 * height / 100.0 * depth / 100.0
 
 
 class CalcBbVolume(Tool):
     """
     Calculates the volume of a 3d bounding box in litres
+    In block mode the boxes of the whole interval are calculated in one vectorised call, and a single
+    (timestamps, volumes) instance is emitted at the end of the interval
     """
 
-    def __init__(self):
-        super(CalcBbVolume, self).__init__()
+    def __init__(self, block=False):
+        super(CalcBbVolume, self).__init__(block=block)
+        self.block = block
 
     @check_input_stream_count(1)
     def _execute(self, sources, alignment_stream, interval):
+        if self.block:
+            data = list(sources[0].window(interval, force_calculation=True))
+            if data:
+                boxes = np.fromiter(chain.from_iterable(d[:6] for _, d in data), dtype=float,
+                                    count=6 * len(data)).reshape(len(data), 6)
+                yield StreamInstance(interval.end, ([time for time, _ in data], volumes(boxes)))
+            return
+
         for time, data in sources[0].window(interval, force_calculation=True):
             # volume = (data['right']-data['left'])/100.0*(data['top']-data['bottom'])/100.0*(data['back']-data['front'])/100.0
             volume = (data[3]-data[0])/100.0*(data[1]-data[4])/100.0*(data[5]-data[2])/100.0
@@ -26,10 +26,9 @@ from hyperstream.tool import Tool, check_input_stream_count
 from hyperstream import TimeInterval, TimeIntervals
 from copy import deepcopy
 import logging
+from sphere_plugins.sphere.utils import sweep
 
 
-# this tool currently assumes non-overlapping sliding windows in its first input stream
-
 class ChunkActivity(Tool):
     def __init__(self):
         super(ChunkActivity, self).__init__()
@@ -37,14 +36,9 @@ class ChunkActivity(Tool):
     # noinspection PyCompatibility
     @check_input_stream_count(3)
     def _execute(self, sources, alignment_stream, interval):
-
-        def get_chunk(data, time):
-            items = [d for t,d in data if t >= time.start and t <= time.end]
-            return [(time.end, items),]
-
-        for time, inter in sources[0].window(interval, force_calculation=True):
-            activities = list()
-            for t,items in get_chunk(sources[1].window(interval, force_calculation=True), inter):
-                activities = [i['video-Activity'] for i in items if 'video-Activity' in i.keys()]
+        windows = sources[0].window(interval, force_calculation=True)
+        data = sources[1].window(interval, force_calculation=True)
+        for inter, items in sweep(windows, data):
+            activities = [i['video-Activity'] for i in items if 'video-Activity' in i.keys()]
             yield StreamInstance(inter.end, activities)
 
@@ -0,0 +1,113 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+from hyperstream import TimeInterval
+from hyperstream.stream import StreamInstance
+from hyperstream.tool import Tool, check_input_stream_count
+from collections import deque
+from datetime import timedelta
+from itertools import chain
+import numpy as np
+import logging
+
+THRESHOLD = 1.8
+
+
+def find_taps(buffer, time):
+    """
+    Finds the taps in the window of magnitudes ending at the given time
+    :param buffer: The (time, magnitude) stream instances in the window
+    :param time: The end of the window
+    :return: The list of taps if the window has the required pattern, otherwise None
+    """
+    values = np.fromiter((magnitude for _, magnitude in buffer), dtype=float, count=len(buffer))
+    high = np.flatnonzero(~(values < THRESHOLD))
+
+    # too high magnitude outside of the 4 sec window, or at the ends of the window where taps cannot be counted
+    if buffer[high[0]].timestamp < time - timedelta(seconds=6):
+        return None
+    if buffer[high[-1]].timestamp > time - timedelta(seconds=2):
+        return None
+    if high[0] == 0 or high[-1] == len(buffer) - 1:
+        return None
+
+    peaks = high[(values[high] > values[high - 1]) & (values[high] > values[high + 1])]
+    if len(peaks) < 3:
+        return None
+    return [buffer[i] for i in peaks]
+
+
+class Detect5Taps(Tool):
+    """
+    Detects 5 consecutive taps from the wearable timestamped magnitudes.
+    The required pattern:
+    2 sec of below 1.8 magnitude, then
+    within 4 sec at least 3 magnitudes each above 1.8 and each higher than neighbours
+    then 2 sec of below 1.8 magnitude;
+    Outputs the taps and all the magnitudes of the window if it has the required pattern.
+
+    Unlike v0.0.1, which took sliding lists of magnitudes, this consumes the sliding windows and the magnitude stream
+    directly, keeping only the magnitudes of the current window in a ring buffer. Windows without any magnitude above
+    the threshold are passed over without looking at their magnitudes.
+    """
+
+    def __init__(self):
+        super(Detect5Taps, self).__init__()
+
+    @check_input_stream_count(2)
+    def _execute(self, sources, alignment_stream, interval):
+        windows = iter(sources[0].window(interval, force_calculation=True))
+        try:
+            first = next(windows)
+        except StopIteration:
+            return
+        data = iter(sources[1].window(TimeInterval(first.value.start, interval.end), force_calculation=True))
+        wearable = [w for (s, w) in sources[1].stream_id.meta_data if s == 'wearable'][0]
+
+        buffer = deque()
+        n_high = 0
+        future = None
+
+        for time, window in chain([first], windows):
+            while buffer and buffer[0].timestamp <= window.start:
+                if not buffer.popleft().value < THRESHOLD:
+                    n_high -= 1
+
+            while True:
+                if future is None:
+                    future = next(data, None)
+                    if future is None:
+                        break
+                if future.timestamp > window.end:
+                    break
+                if future.timestamp > window.start:
+                    buffer.append(future)
+                    if not future.value < THRESHOLD:
+                        n_high += 1
+                future = None
+
+            if n_high == 0:
+                continue
+
+            tap_list = find_taps(buffer, time)
+            if tap_list is not None:
+                logging.info('\n'.join('{0} {1:.2} {2:%Y-%m-%d %H:%M:%S.%f}'.format(wearable, tap.value, tap.timestamp)
+                                       for tap in tap_list))
+                yield StreamInstance(time, dict(tap_list=tap_list, all_10_sec=list(buffer)))
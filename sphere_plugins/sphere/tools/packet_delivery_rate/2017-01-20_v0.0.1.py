@@ -20,6 +20,7 @@
 
 from hyperstream.stream import StreamInstance
 from hyperstream.tool import Tool, check_input_stream_count
+import numpy as np
 
 # ignore seqnums before this one: accept that they may be lost because of network starting up
 MIN_SEQNUM = 5
@@ -29,75 +30,222 @@ MAX_OO_SEQNUM = 50
 MAX_STARTUP_SEQNUM = 100
 
 
-def get_pdr(seqnums, max_startup_seqnum = MAX_STARTUP_SEQNUM):
-    total = 0
-    present = 0
-
-    if len(seqnums):
-        current_set = set()
-        max_seqnum = None
-        for s in seqnums:
-            if s < MIN_SEQNUM:
-                continue
-            if max_seqnum is None or s > max_seqnum:
-                max_seqnum = s
-            delta = max_seqnum - s
-            if delta > MAX_OO_SEQNUM and (max_startup_seqnum is None or s <= MAX_STARTUP_SEQNUM):
-                # reboot detected
-                if len(current_set):
-                    total += max_seqnum - min(current_set) + 1
-                    present += len(current_set)
-                # reinitialize the variables
-                current_set = set()
-                max_seqnum = s
-            # always add the s unless it's too small
-            current_set.add(s)
-
-        if len(current_set):
-            total += max_seqnum - min(current_set) + 1
-            present += len(current_set)
+def _valid(seqnums):
+    seqnums = np.asarray(seqnums, dtype=np.int64).ravel()
+    return seqnums[seqnums >= MIN_SEQNUM]
+
+
+def _segment_ids(n, starts):
+    segment = np.zeros(n, dtype=np.int64)
+    segment[starts[1:]] = 1
+    return np.cumsum(segment)
+
 
+def find_segments(seqnums, max_startup_seqnum=MAX_STARTUP_SEQNUM, starts=(0,)):
+    """
+    Splits the seqnums into the runs between reboots. A reboot is detected where a seqnum is too far behind the
+    largest seqnum since the last reboot. As each reboot resets that maximum, the reboots are found a generation at a
+    time, with one running maximum over the whole array per generation.
+
+    :param seqnums: The seqnums (at least MIN_SEQNUM) as a numpy array
+    :param max_startup_seqnum: Only seqnums up to this can signal a reboot, or None if any can
+    :param starts: The sorted indices at which segments are known to start, such as the first seqnum of each device
+    :return: The sorted indices at which the segments start
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    if not len(seqnums):
+        return starts[:0]
+    if max_startup_seqnum is None:
+        startup = np.ones(len(seqnums), dtype=bool)
+    else:
+        startup = seqnums <= MAX_STARTUP_SEQNUM
+    # offsetting each segment above the previous ones stops the running maximum carrying across segments
+    offset = int(seqnums.max()) + 1
+
+    # the segments before the earliest reboot found so far are settled
+    settled = 0
+    while True:
+        shift = _segment_ids(len(seqnums) - settled, starts[starts >= settled] - settled) * offset
+        running = np.maximum.accumulate(seqnums[settled:] + shift) - shift
+        reboots = np.flatnonzero((running - seqnums[settled:] > MAX_OO_SEQNUM) & startup[settled:])
+        if not len(reboots):
+            return starts
+        # only the first reboot of each segment is certain, as it resets the maximum for the rest of the segment
+        first = np.concatenate(([0], np.flatnonzero(np.diff(shift[reboots])) + 1))
+        starts = np.union1d(starts, reboots[first] + settled)
+        settled += reboots[0]
+
+
+def segment_counts(seqnums, starts):
+    """
+    Counts the distinct seqnums and the expected number of seqnums in each segment
+    :param seqnums: The seqnums as a numpy array
+    :param starts: The sorted indices at which the segments start
+    :return: The present and total counts as numpy arrays, one per segment
+    """
+    offset = int(seqnums.max()) + 1
+    keys = np.sort(seqnums + _segment_ids(len(seqnums), starts) * offset)
+    distinct = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+    present = np.bincount(distinct // offset, minlength=len(starts))
+    total = np.maximum.reduceat(seqnums, starts) - np.minimum.reduceat(seqnums, starts) + 1
+    return present, total
+
+
+def _pdr(present, total):
+    present, total = int(present), int(total)
     pdr = float(present) / total if total else 0.0
 
     # TODO Meelis: check the format and change if it has to be something else
     return (present, total, pdr)
 
 
+def get_pdr(seqnums, max_startup_seqnum = MAX_STARTUP_SEQNUM):
+    seqnums = _valid(seqnums)
+    if not len(seqnums):
+        return _pdr(0, 0)
+    present, total = segment_counts(seqnums, find_segments(seqnums, max_startup_seqnum))
+    return _pdr(present.sum(), total.sum())
+
+
+def get_pdrs(seqnums_by_device, max_startup_seqnum=MAX_STARTUP_SEQNUM):
+    """
+    Calculates the packet delivery rate of every device in one go
+    :param seqnums_by_device: dict of device -> list of seqnums
+    :param max_startup_seqnum: Only seqnums up to this can signal a reboot, or None if any can
+    :return: dict of device -> (present, total, pdr)
+    """
+    result = dict((device, _pdr(0, 0)) for device in seqnums_by_device)
+    devices = []
+    arrays = []
+    for device, seqnums in seqnums_by_device.items():
+        seqnums = _valid(seqnums)
+        if len(seqnums):
+            devices.append(device)
+            arrays.append(seqnums)
+    if not devices:
+        return result
+
+    # each device starts a segment of its own, so the devices are split into segments together
+    firsts = np.cumsum([0] + [len(seqnums) for seqnums in arrays[:-1]])
+    seqnums = np.concatenate(arrays)
+    starts = find_segments(seqnums, max_startup_seqnum, firsts)
+    present, total = segment_counts(seqnums, starts)
+    first_segments = np.searchsorted(starts, firsts)
+    for device, p, t in zip(devices, np.add.reduceat(present, first_segments), np.add.reduceat(total, first_segments)):
+        result[device] = _pdr(p, t)
+    return result
+
+
+class StreamingPdr(object):
+    """
+    Calculates the packet delivery rate of consecutive lists of seqnums of each device, carrying the segment since
+    the last reboot from one list to the next. Seqnums are then counted once even if they arrive in neighbouring lists,
+    and the seqnums lost between lists are counted as well, so the sums of the present and total counts are those of
+    get_pdr over all the seqnums.
+    """
+    def __init__(self, max_startup_seqnum=MAX_STARTUP_SEQNUM):
+        self.max_startup_seqnum = max_startup_seqnum
+        # (stream, device) -> (minimum, seen) of the current segment, where seen[i] is whether minimum + i has arrived
+        self.states = {}
+        # stream -> end of the last interval
+        self.ends = {}
+
+    def __repr__(self):
+        return "{}(max_startup_seqnum={})".format(self.__class__.__name__, self.max_startup_seqnum)
+
+    def start(self, stream, time_interval):
+        """
+        Starts the next interval of the stream, forgetting the state of its devices unless the interval follows on
+        from the last one
+        :param stream: The stream
+        :param time_interval: The time interval
+        """
+        if self.ends.get(stream) != time_interval.start:
+            for key in [key for key in self.states if key[0] == stream]:
+                del self.states[key]
+        self.ends[stream] = time_interval.end
+
+    @staticmethod
+    def _seen(seqnums, minimum=None, seen=None):
+        """
+        Marks the seqnums as seen in the segment
+        :param seqnums: The seqnums of the segment as a numpy array
+        :param minimum: The smallest seqnum seen before, or None if the segment is new
+        :param seen: Whether each seqnum from the minimum has been seen before
+        :return: The new minimum and seen
+        """
+        if minimum is None:
+            minimum, maximum = seqnums.min(), seqnums.max()
+        else:
+            maximum = max(minimum + len(seen) - 1, seqnums.max())
+            previous, minimum = minimum, min(minimum, seqnums.min())
+        marked = np.zeros(maximum - minimum + 1, dtype=bool)
+        if seen is not None:
+            marked[previous - minimum:previous - minimum + len(seen)] = seen
+        marked[seqnums - minimum] = True
+        return minimum, marked
+
+    def update(self, stream, device, seqnums):
+        """
+        Calculates the packet delivery rate of the next list of seqnums of the device
+        :param stream: The stream
+        :param device: The device, or None if the stream is of a single device
+        :param seqnums: The seqnums since the last update
+        :return: The present and total counts and the packet delivery rate of these seqnums
+        """
+        seqnums = _valid(seqnums)
+        state = self.states.get((stream, device))
+        if not len(seqnums):
+            return _pdr(0, 0)
+        if state is None:
+            starts = find_segments(seqnums, self.max_startup_seqnum)
+            present, total = segment_counts(seqnums, starts)
+            state = self._seen(seqnums[starts[-1]:])
+        else:
+            # the largest seqnum so far goes first so that the segment carries on from it
+            minimum, seen = state
+            seqnums = np.concatenate(([minimum + len(seen) - 1], seqnums))
+            starts = find_segments(seqnums, self.max_startup_seqnum)
+            present, total = segment_counts(seqnums, starts)
+            end = starts[1] if len(starts) > 1 else len(seqnums)
+            state = self._seen(seqnums[1:end], minimum, seen) if end > 1 else state
+            present[0] = state[1].sum() - seen.sum()
+            total[0] = len(state[1]) - len(seen)
+            if len(starts) > 1:
+                state = self._seen(seqnums[starts[-1]:])
+
+        self.states[(stream, device)] = state
+        return _pdr(present.sum(), total.sum())
+
+
 class PacketDeliveryRate(Tool):
     """
-    For each document assumed to be a list of sequence numbers, calculate the packet delivery rate
+    For each document assumed to be a list of sequence numbers, calculate the packet delivery rate.
+    A document can also be a dict of device -> list of sequence numbers, which gives a dict of device -> rate.
+    If streaming, the reboot state of each stream is carried from one document to the next, and across executions
+    as long as they follow on from each other.
     """
-    def __init__(self, field_specific_params=dict()):
-        super(PacketDeliveryRate, self).__init__(field_specific_params=field_specific_params)
+    def __init__(self, field_specific_params=dict(), streaming=False):
+        super(PacketDeliveryRate, self).__init__(field_specific_params=field_specific_params, streaming=streaming)
+        self.streaming = streaming
+        self._pdr = StreamingPdr(MAX_STARTUP_SEQNUM)
 
     @check_input_stream_count(1)
     def _execute(self, sources, alignment_stream, interval):
+        stream_id = sources[0].stream_id
+        if self.streaming:
+            self._pdr.start(stream_id, interval)
+
         for t, d in sources[0].window(interval, force_calculation=True):
             # TODO: if this is a wearable, should set pass "None" instead of MAX_STARTUP_SEQNUM
-            yield StreamInstance(t, get_pdr(d, MAX_STARTUP_SEQNUM))
-
-
-# --- testing code
-
-def test(msg, result, expected_result):
-    if result != expected_result:
-        print("test failed:", msg, result, expected_result)
-        return False
-    return True
-
-
-def test_all():
-    test("in order", get_pdr([11, 12, 13, 14]),  (4, 4, 1.0))
-    test("mixed", get_pdr([11, 12, 14, 13]),  (4, 4, 1.0))
-    test("reversed", get_pdr([14, 13, 12, 11]),  (4, 4, 1.0))
-    test("duplicates", get_pdr([11, 12, 13, 13, 14]),  (4, 4, 1.0))
-    test("missing one", get_pdr([11, 12, 14]),  (3, 4, 0.75))
-    test("missing two", get_pdr([11, 14]),  (2, 4, 0.5))
-    test("empty sequence", get_pdr([]),  (0, 0, 0.0))
-    test("small only", get_pdr([1, 2, 3]),  (0, 0, 0.0))
-    test("with reboot", get_pdr([100, 101, 102, 103, 5, 6, 7, 8]),  (8, 8, 1.0))
-    test("with reboot and missing", get_pdr([100, 101, 6, 8]),  (4, 5, 0.8))
-    test("with reboot two times", get_pdr([1000, 56, 5]),  (3, 3, 1.0))
-    print("all tests done")
+            if isinstance(d, dict):
+                if self.streaming:
+                    yield StreamInstance(t, dict((device, self._pdr.update(stream_id, device, seqnums))
+                                                 for device, seqnums in d.items()))
+                else:
+                    yield StreamInstance(t, get_pdrs(d, MAX_STARTUP_SEQNUM))
+            elif self.streaming:
+                yield StreamInstance(t, self._pdr.update(stream_id, None, d))
+            else:
+                yield StreamInstance(t, get_pdr(d, MAX_STARTUP_SEQNUM))
 
-# test_all()
@@ -21,27 +21,79 @@
 from hyperstream.stream import StreamInstance
 from hyperstream.tool import Tool, check_input_stream_count
 
+import numpy as np
+
+OUTPUTS = ('list', 'rows', 'block')
+
 
 class RssiToVector(Tool):
     """
-    Simple tool that picks out a component of the data dict if it is a range of values. If compliment is true,
-    the component is picked out if it is not in the list. e.g. to delete None values, use:
-    ComponentFilter(key, values=[None], complement=true)
+    Turns the gateway subdocs of each packet into a vector of rssi values, one per aid, with the default value for
+    the aids which did not receive the packet. The output can be
+        list: one list per packet (default)
+        rows: one float32 numpy row per packet, as views into a matrix for the whole interval
+        block: a single (timestamps, float32 matrix) instance for the whole interval
     """
-    def __init__(self, aids, default_value):
-        super(RssiToVector, self).__init__(aids=aids, default_value=default_value)
+    def __init__(self, aids, default_value, output='list'):
+        super(RssiToVector, self).__init__(aids=aids, default_value=default_value, output=output)
+        if output not in OUTPUTS:
+            raise ValueError("output must be one of {}".format(", ".join(OUTPUTS)))
         self.aids = aids
         self.default_value = default_value
+        self.output = output
+
+    def columns(self):
+        """
+        Gets the columns of each aid in the vector
+        :return: dict of aid -> list of columns
+        """
+        columns = {}
+        for i, aid in enumerate(self.aids):
+            columns.setdefault(aid, []).append(i)
+        return columns
+
+    def to_matrix(self, data):
+        """
+        Fills a preallocated float32 matrix with the rssi values of the packets, where later gateway subdocs of a
+        packet overwrite earlier ones for the same aid. Missing rssi values (None) become NaN, like a None default value
+        :param data: The (timestamp, packet) stream instances
+        :return: The timestamps and the matrix
+        """
+        data = list(data)
+        columns = self.columns()
+        default_value = np.nan if self.default_value is None else self.default_value
+        matrix = np.full((len(data), len(self.aids)), default_value, dtype=np.float32)
+
+        rows, cols, values = [], [], []
+        for row, (_, doc) in enumerate(data):
+            for subdoc in doc.get("gw", ()):
+                for col in columns.get(subdoc["aid"], ()):
+                    rows.append(row)
+                    cols.append(col)
+                    values.append(np.nan if subdoc["rssi"] is None else subdoc["rssi"])
+        matrix[rows, cols] = values
+        return [time for time, _ in data], matrix
 
     @check_input_stream_count(1)
     def _execute(self, sources, alignment_stream, interval):
-        for time, data in sources[0].window(interval, force_calculation=True):
-            res = self.aids[:]
-            for i in range(len(res)):
-                res[i] = self.default_value
-            if "gw" in data.keys():
-                for subdoc in data["gw"]:
-                    for i in range(len(self.aids)):
-                        if subdoc["aid"]==self.aids[i]:
-                            res[i] = subdoc["rssi"]
+        data = sources[0].window(interval, force_calculation=True)
+
+        if self.output == 'block':
+            timestamps, matrix = self.to_matrix(data)
+            if timestamps:
+                yield StreamInstance(interval.end, (timestamps, matrix))
+            return
+
+        if self.output == 'rows':
+            timestamps, matrix = self.to_matrix(data)
+            for time, row in zip(timestamps, matrix):
+                yield StreamInstance(time, row)
+            return
+
+        columns = self.columns()
+        for time, doc in data:
+            res = [self.default_value] * len(self.aids)
+            for subdoc in doc.get("gw", ()):
+                for col in columns.get(subdoc["aid"], ()):
+                    res[col] = subdoc["rssi"]
             yield StreamInstance(time, res)
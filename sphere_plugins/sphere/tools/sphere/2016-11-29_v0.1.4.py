@@ -22,17 +22,15 @@ from hyperstream.stream import StreamInstance, StreamMetaInstance
 from hyperstream.tool import MultiOutputTool
 from sphere_plugins.sphere.channels.sphere_channel import SphereDataWindow, SphereExperiment
 
-from copy import deepcopy
-
 
 def reformat(doc):
-    doc = deepcopy(doc)
-    dt = doc.pop('datetime')
-    if 'hid' in doc and doc['hid'] is not None:
-        house_id = doc.pop('hid')
+    value = dict(doc)
+    dt = value.pop('datetime')
+    if value.get('hid') is not None:
+        house_id = value.pop('hid')
     else:
         house_id = '1'
-    return StreamMetaInstance(stream_instance=StreamInstance(dt, doc), meta_data=('house', house_id))
+    return StreamMetaInstance(stream_instance=StreamInstance(dt, value), meta_data=('house', house_id))
 
 
 class Sphere(MultiOutputTool):
@@ -18,59 +18,166 @@
 #  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
 #  OR OTHER DEALINGS IN THE SOFTWARE.
 
+import logging
+from collections import Counter, OrderedDict
+
 from hyperstream.stream import StreamInstance, StreamMetaInstance
 from hyperstream.tool import MultiOutputTool
+from sphere_plugins.sphere.channels.chunked_fetch import get_chunked_fetcher
+from sphere_plugins.sphere.channels.projection import project
+from sphere_plugins.sphere.channels.shared_scan import get_shared_scan
 from sphere_plugins.sphere.channels.sphere_channel import SphereDataWindow, SphereExperiment
+from sphere_plugins.sphere.channels.window_cache import get_window_cache
+
+
+DEDUPE_POLICIES = ('first', 'merge', 'raise')
+
+
+class StreamingDeduplicator(object):
+    """
+    De-duplicates records keyed by (house, timestamp, any extra key fields) in a single pass. The records are expected
+    in timestamp order, so only the records of the current timestamp are held. Those of the last timestamp are carried
+    over to the next interval if it follows on from the last one, so that duplicates on the boundary between intervals
+    are caught as well.
+
+    Conflict policies:
+        first: keep the first record and drop the duplicates
+        merge: add the fields of the duplicates to the first record, keeping the first value of conflicting fields
+        raise: as merge, but raise a ValueError on conflicting fields
+    """
+    def __init__(self, policy, keys):
+        if policy not in DEDUPE_POLICIES:
+            raise ValueError("Unknown de-duplication policy {}".format(policy))
+        self.policy = policy
+        self.keys = tuple(keys)
+        self.carry_over = {}
+        self.end = None
+        self.counts = Counter()
+
+    def __repr__(self):
+        # Keeps the hash of the tool independent of the carry over buffer and counters
+        return "{}(policy={!r}, keys={!r})".format(self.__class__.__name__, self.policy, self.keys)
 
-from copy import deepcopy
+    def start(self, interval):
+        """
+        Starts the next interval, forgetting the carried over records unless the interval follows on from the last one
+        :param interval: The time interval
+        """
+        if self.end != interval.start:
+            self.carry_over = {}
+        self.end = interval.end
+
+    def key(self, instance):
+        value = instance.stream_instance.value
+        return (instance.meta_data, instance.stream_instance.timestamp) + tuple(value.get(k) for k in self.keys)
+
+    def reconcile(self, value, duplicate):
+        self.counts['merged'] += 1
+        if self.policy == 'first':
+            return
+        for k, v in duplicate.stream_instance.value.items():
+            if k not in value:
+                value[k] = v
+            elif v != value[k]:
+                if self.policy == 'raise':
+                    raise ValueError("De-duplication failed for {} at {}".format(
+                        k, duplicate.stream_instance.timestamp))
+                self.counts['conflicts'] += 1
+
+    def process(self, instances):
+        """
+        De-duplicate the records of an interval
+        :param instances: The records as stream meta instances, in timestamp order
+        :return: The de-duplicated records
+        """
+        timestamp = None
+        group = OrderedDict()
+        for instance in instances:
+            self.counts['records'] += 1
+            if instance.stream_instance.timestamp != timestamp:
+                for emitted in group.values():
+                    yield emitted
+                self.counts['emitted'] += len(group)
+                timestamp = instance.stream_instance.timestamp
+                group = OrderedDict()
+
+            key = self.key(instance)
+            if key in self.carry_over:
+                # Already emitted with the previous interval, so the duplicate can only be checked and dropped
+                self.counts['carried_over'] += 1
+                self.reconcile(dict(self.carry_over[key].stream_instance.value), instance)
+            elif key in group:
+                self.reconcile(group[key].stream_instance.value, instance)
+            else:
+                group[key] = instance
+
+        for emitted in group.values():
+            yield emitted
+        self.counts['emitted'] += len(group)
+        if group:
+            self.carry_over = group
 
 
 class Sphere(MultiOutputTool):
     def __init__(self, modality, elements=None, filters=None, rename_keys=False, annotators=None, dedupe=False,
-                 default_house='1'):
+                 default_house='1', dedupe_keys=None, fields=None):
+        """
+        :param dedupe: The de-duplication policy (first, merge or raise), or False for none. True means raise.
+        :param dedupe_keys: Any fields that identify a record along with the house and timestamp, e.g. ('uid',)
+        :param fields: The fields of the documents used downstream. The others are dropped straight after fetching.
+        """
         super(Sphere, self).__init__(modality=modality, elements=elements, filters=filters, rename_keys=rename_keys,
-                                     annotators=annotators, dedupe=dedupe, default_house=default_house)
+                                     annotators=annotators, dedupe=dedupe, default_house=default_house,
+                                     dedupe_keys=dedupe_keys, fields=fields)
+        if dedupe:
+            self._deduplicator = StreamingDeduplicator(
+                policy='raise' if dedupe is True else dedupe,
+                keys=dedupe_keys or ())
 
     def _execute(self, source, splitting_stream, interval, meta_data_id, output_plate_values):
         if source is not None:
             raise ValueError("Sphere tool does not expect an input source")
-        window = SphereExperiment(interval, self.annotators) if self.annotators else SphereDataWindow(interval)
-        source = window.modalities[self.modality]
+        docs = self.fetch(interval)
 
         if self.dedupe:
-            previous = None
-            for instance in source.get_data(self.elements, self.filters, self.rename_keys):
-                if previous:
-                    current = self.reformat(instance)
-                    if current.stream_instance.timestamp == previous.stream_instance.timestamp:
-                        if current.meta_data != previous.meta_data:
-                            raise ValueError("Incompatible meta data")
-                        # Try to reconcile the two items
-                        for k, v in current.stream_instance.value.items():
-                            if k in previous.stream_instance.value:
-                                if v != previous.stream_instance.value[k]:
-                                    raise ValueError("De-duplication failed")
-                            else:
-                                previous.stream_instance.value[k] = v
-                    else:
-                        tmp = previous
-                        previous = current
-                        yield tmp
-                else:
-                    previous = self.reformat(instance)
-            if previous:
-                yield previous
+            self._deduplicator.start(interval)
+            for instance in self._deduplicator.process(self.reformat(doc) for doc in docs):
+                yield instance
+            logging.debug("Sphere {} de-duplication counts: {}".format(
+                self.modality, dict(self._deduplicator.counts)))
         else:
-            for instance in source.get_data(self.elements, self.filters, self.rename_keys):
+            for instance in docs:
                 yield self.reformat(instance)
 
+    def fetch(self, interval):
+        """
+        Gets the raw documents from the shared scan, the window cache or the chunked fetcher, whichever is configured
+        first, or otherwise straight from the database
+        :param interval: The time interval
+        :return: The documents
+        """
+        query = (self.modality, self.elements, self.filters, self.rename_keys, self.fields)
+        if not self.annotators:
+            scan = get_shared_scan()
+            docs = scan.get_data(interval, *query) if scan is not None else None
+            if docs is not None:
+                return docs
+            for source in (get_window_cache(), get_chunked_fetcher()):
+                if source is not None:
+                    return source.get_data(interval, *query)
+
+        if self.annotators:
+            docs = SphereExperiment(interval, self.annotators).modalities[self.modality].get_data(
+                self.elements, self.filters, self.rename_keys)
+            return project(docs, self.modality, self.fields)
+        return SphereDataWindow(interval).get_data(*query)
+
     def reformat(self, doc):
-        doc = deepcopy(doc)
-        dt = doc.pop('datetime')
-        if 'hid' in doc and doc['hid'] is not None:
-            house_id = doc.pop('hid')
-            meta_data = ('house', house_id)
+        # A shallow copy is enough, as only the top level keys are removed. Deep copying was the main cost of ingestion
+        value = dict(doc)
+        dt = value.pop('datetime')
+        if value.get('hid') is not None:
+            house_id = value.pop('hid')
         else:
             house_id = self.default_house
-            meta_data = ('house', house_id)
-        return StreamMetaInstance(stream_instance=StreamInstance(dt, doc), meta_data=meta_data)
+        return StreamMetaInstance(stream_instance=StreamInstance(dt, value), meta_data=('house', house_id))
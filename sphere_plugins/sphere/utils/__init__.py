@@ -21,4 +21,6 @@
 
 from sklearn_utils import FillZeros, serialise_dict, serialise_to_json, deserialise_json_pipeline, serialise_pipeline
 from hmm_utils import RoomRssiHMM
-from utils import ArgumentParser
+from utils import ArgumentParser, sweep
+from stream_keys import summary_stream_key, naive_utc
+from raw_documents import aware_utc, sphere_fetch, to_columns, from_columns
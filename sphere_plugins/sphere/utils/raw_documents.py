@@ -0,0 +1,72 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+from hyperstream.utils import UTC
+
+
+def aware_utc(dt):
+    """
+    The connectors hand back naive UTC datetimes, so mark them as UTC before comparing against time intervals
+    """
+    return dt.replace(tzinfo=UTC) if dt.tzinfo is None else dt
+
+
+def sphere_fetch(start, end, modality, elements, filters, rename_keys):
+    """
+    Fetch the raw documents of a modality from the SPHERE MongoDB
+    :param start: The start of the window
+    :param end: The end of the window
+    :param modality: The modality
+    :param elements: The elements to fetch
+    :param filters: Any filters to apply to the documents
+    :param rename_keys: Whether to rename the keys of the documents
+    :return: The list of documents
+    """
+    from sphere_plugins.sphere.channels.sphere_channel import SphereDataWindow
+    window = SphereDataWindow((start, end))
+    return window.modalities[modality].get_data(elements, filters, rename_keys)
+
+
+def to_columns(docs):
+    """
+    Converts a list of documents to columns. Keys that are missing from some of the documents also store the row indices
+    of the documents that have them.
+    """
+    columns = {}
+    for i, doc in enumerate(docs):
+        for k, v in doc.items():
+            if k not in columns:
+                columns[k] = ([], [])
+            columns[k][0].append(i)
+            columns[k][1].append(v)
+    return dict(
+        n=len(docs),
+        columns=[(k, None if len(rows) == len(docs) else rows, values) for k, (rows, values) in columns.items()])
+
+
+def from_columns(data):
+    """
+    Converts columns written by to_columns back to a list of documents
+    """
+    docs = [{} for _ in range(data['n'])]
+    for k, rows, values in data['columns']:
+        for i, v in zip(range(data['n']) if rows is None else rows, values):
+            docs[i][k] = v
+    return docs
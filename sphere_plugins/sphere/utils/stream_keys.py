@@ -0,0 +1,48 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+
+import hashlib
+import json
+
+from hyperstream.utils import UTC
+
+
+def summary_stream_key(stream_id):
+    """
+    A compact key for a stream id, used in place of the embedded stream_id document for queries and indexes. It is the
+    md5 of the name and sorted meta data, so it matches StreamId equality, which ignores the meta data order.
+    :param stream_id: The stream id, either as a StreamId or as a raw document read back from mongo
+    :return: The key as a 32 character hex string
+    """
+    if isinstance(stream_id, dict):
+        name, meta_data = stream_id['name'], stream_id['meta_data']
+    else:
+        name, meta_data = stream_id.name, stream_id.meta_data
+    canonical = json.dumps([name, sorted(list(m) for m in meta_data)], separators=(',', ':'))
+    return hashlib.md5(canonical.encode('utf-8')).hexdigest()
+
+
+def naive_utc(dt):
+    """
+    Mongo hands back naive UTC datetimes, so strip the timezone before comparing against them
+    """
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(UTC).replace(tzinfo=None)
+    return dt
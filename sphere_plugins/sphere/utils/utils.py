@@ -20,6 +20,7 @@
 
 import argparse
 import logging
+from collections import deque
 
 
 class ArgumentParser(object):
@@ -87,3 +88,28 @@ class ArgumentParser(object):
         parser.add_argument("--loglevel", dest='loglevel', nargs='?', type=int, default=default_loglevel,
                             choices=ArgumentParser.CHOICES)
         return parser.parse_args()
+
+
+def sweep(windows, data):
+    """
+    Walks the windows and the data once, both in time order, pairing each window with the data in it
+    (start <= t <= end). The data of overlapping windows is held in a deque, so the cost is linear in the number of
+    windows and records.
+    :param windows: The (time, window) pairs, with the starts and ends of the windows in time order
+    :param data: The (time, value) pairs of the data, in time order
+    :return: The windows and their values
+    """
+    data = iter(data)
+    pending = next(data, None)
+    current = deque()
+    start = None
+    for time, window in windows:
+        if start is not None and window.start < start:
+            raise ValueError("Windows must be in time order")
+        start = window.start
+        while pending is not None and pending[0] <= window.end:
+            current.append(pending)
+            pending = next(data, None)
+        while current and current[0][0] < window.start:
+            current.popleft()
+        yield window, [value for t, value in current if t <= window.end]
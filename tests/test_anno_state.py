@@ -0,0 +1,178 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import imp
+import os
+import unittest
+from datetime import datetime, timedelta
+
+from mongoengine import connect
+from mongoengine.connection import get_connection, ConnectionFailure
+from mongoengine.context_managers import switch_db
+
+from hyperstream import StreamId, TimeInterval, UTC
+from hyperstream.stream import StreamInstance
+
+TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sphere_plugins', 'sphere', 'tools')
+
+anno_state = imp.load_source('annotation_state', os.path.join(TOOLS, 'annotation_state', '2016-11-02_v0.0.1.py'))
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+minute = timedelta(minutes=1)
+
+
+def annotation(minutes, tier, label, trigger):
+    return StreamInstance(t1 + timedelta(minutes=minutes), dict(tier=tier, label=label, trigger=trigger))
+
+
+ANNOTATIONS = [
+    annotation(1, 'Experiment', 'Experiment Time', 1),
+    annotation(2, 'Location', 'kitchen', 1),
+    annotation(7, 'Location', 'kitchen', -1),
+    annotation(7.5, 'Location', 'hall', 1),
+    annotation(12, 'Posture', 'standing', 1),
+    annotation(16, 'Experiment', 'Experiment Time', -1),
+    annotation(18, 'Experiment', 'Experiment Time', 1),
+    annotation(25, 'Location', 'hall', -1)
+]
+
+
+class Windows(object):
+    def window(self, time_interval, force_calculation=False):
+        t = time_interval.start
+        while t < time_interval.end:
+            yield t + minute, TimeInterval(t, t + minute)
+            t += minute
+
+
+class Annotations(object):
+    stream_id = StreamId('annotations', meta_data=(('house', '1'),))
+
+    def window(self, time_interval, force_calculation=False):
+        return iter([a for a in ANNOTATIONS if time_interval.start < a.timestamp <= time_interval.end])
+
+
+class MemorySnapshots(object):
+    """
+    Keeps the snapshots of an AnnoState in memory rather than in mongo
+    """
+    def __init__(self, tool):
+        self.snapshots = {}
+        self.loaded = []
+        tool.load_snapshot = self.load
+        tool.save_snapshot = self.save
+
+    def load(self, stream_key, timestamp):
+        times = [t for t in self.snapshots if t <= timestamp]
+        if not times:
+            self.loaded.append(None)
+            return None
+        self.loaded.append(max(times))
+        annotations, last_experiment = self.snapshots[max(times)]
+        return max(times), dict((tier, set(labels)) for tier, labels in annotations.items()), last_experiment
+
+    def save(self, stream_key, timestamp, annotations, last_experiment):
+        self.snapshots[timestamp] = dict((tier, set(labels)) for tier, labels in annotations.items()), last_experiment
+
+
+def execute(tool, start, end):
+    return list(tool._execute(sources=[Windows(), Annotations()], alignment_stream=None,
+                              interval=TimeInterval(t1 + start * minute, t1 + end * minute)))
+
+
+class TestAnnoState(unittest.TestCase):
+    def replayed(self, start, end):
+        tool = anno_state.AnnoState(start_time=t1)
+        MemorySnapshots(tool)
+        return execute(tool, start, end)
+
+    def test_resume_from_snapshot(self):
+        tool = anno_state.AnnoState(start_time=t1)
+        snapshots = MemorySnapshots(tool)
+        # The snapshot at the end of the first interval is in the middle of the kitchen label
+        execute(tool, 0, 5)
+        self.assertEqual(sorted(snapshots.snapshots), [t1 + 5 * minute])
+        self.assertEqual(execute(tool, 5, 30), self.replayed(5, 30))
+        self.assertEqual(snapshots.loaded[-1], t1 + 5 * minute)
+
+        # An interval that starts after the latest snapshot replays the annotations in between
+        self.assertEqual(execute(tool, 14, 20), self.replayed(14, 20))
+        self.assertEqual(snapshots.loaded[-1], t1 + 5 * minute)
+
+        # And snapshots after the start of the interval are not used
+        self.assertEqual(execute(tool, 3, 10), self.replayed(3, 10))
+        self.assertEqual(snapshots.loaded[-1], None)
+
+    def test_windows(self):
+        states = dict((instance.timestamp, instance.value) for instance in self.replayed(0, 30))
+        # A tier that changes within a window, including at its end, is mixed
+        self.assertEqual(states[t1 + minute], {'Experiment': {'MIX'}})
+        self.assertEqual(states[t1 + 2 * minute], {'Experiment': {1}, 'Location': {'MIX'}})
+        self.assertEqual(states[t1 + 3 * minute], {'Experiment': {1}, 'Location': {'kitchen'}})
+        self.assertEqual(states[t1 + 8 * minute], {'Experiment': {1}, 'Location': {'MIX'}})
+        self.assertEqual(states[t1 + 12 * minute], {'Experiment': {1}, 'Location': {'hall'}, 'Posture': {'MIX'}})
+        # Nothing is output outside of an experiment
+        self.assertNotIn(t1 + 17 * minute, states)
+        self.assertEqual(states[t1 + 19 * minute], {'Experiment': {2}, 'Location': {'hall'}, 'Posture': {'standing'}})
+        self.assertEqual(len(states), 29)
+
+class TestAnnoStateSnapshots(unittest.TestCase):
+    """
+    Saves snapshots to mongo, through the hyperstream connection if there is one or else a local mongod. Like
+    HyperStream, this connects the default alias as well, which switch_db needs.
+    """
+    stream_key = '0' * 32
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            get_connection('hyperstream')
+        except ConnectionFailure:
+            connect(db='hyperstream_test')
+            connect(db='hyperstream_test', alias='hyperstream')
+
+    def tearDown(self):
+        with switch_db(anno_state.AnnoStateSnapshotModel, 'hyperstream'):
+            anno_state.AnnoStateSnapshotModel.objects(stream_key=self.stream_key).delete()
+
+    def test_snapshots(self):
+        tool = anno_state.AnnoState(start_time=t1)
+        for i in range(anno_state.MAX_SNAPSHOTS + 5):
+            tool.save_snapshot(self.stream_key, t1 + i * minute, {'Location': {'kitchen', str(i)}}, i)
+        # Saving the same time again replaces the snapshot
+        tool.save_snapshot(self.stream_key, t1 + 10 * minute, {'Location': {'hall'}}, 100)
+
+        with switch_db(anno_state.AnnoStateSnapshotModel, 'hyperstream'):
+            self.assertEqual(anno_state.AnnoStateSnapshotModel.objects(stream_key=self.stream_key).count(),
+                             anno_state.MAX_SNAPSHOTS)
+        # The oldest snapshots have been deleted
+        self.assertIsNone(tool.load_snapshot(self.stream_key, t1 + 4 * minute))
+        self.assertEqual(tool.load_snapshot(self.stream_key, t1 + 10.5 * minute),
+                         (t1 + 10 * minute, {'Location': {'hall'}}, 100))
+        self.assertEqual(tool.load_snapshot(self.stream_key, t1 + 100 * minute),
+                         (t1 + (anno_state.MAX_SNAPSHOTS + 4) * minute,
+                          {'Location': {'kitchen', str(anno_state.MAX_SNAPSHOTS + 4)}}, anno_state.MAX_SNAPSHOTS + 4))
+
+        # Snapshots are kept apart by the start time of the tool
+        other = anno_state.AnnoState(start_time=t1 - minute)
+        self.assertIsNone(other.load_snapshot(self.stream_key, t1 + 100 * minute))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import imp
+import logging
+import os
+import random
+import unittest
+from copy import deepcopy
+from datetime import datetime, timedelta
+
+from hyperstream import TimeInterval, UTC
+from hyperstream.stream import StreamInstance
+
+TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sphere_plugins', 'sphere', 'tools')
+
+AnnotationStateLocation = imp.load_source(
+    'annotation_state_location',
+    os.path.join(TOOLS, 'annotation_state_location', '2017-05-06_v0.1.1.py')).AnnotationStateLocation
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+second = timedelta(seconds=1)
+
+
+def event(seconds, tier, label, trigger):
+    return StreamInstance(t1 + seconds * second, dict(tier=tier, label=label, trigger=trigger))
+
+
+class Source(object):
+    def __init__(self, instances):
+        self.instances = instances
+
+    def window(self, time_interval, force_calculation=False):
+        return iter([i for i in self.instances if time_interval.start < i.timestamp <= time_interval.end])
+
+
+def event_loop(windows, data):
+    """
+    The event loop of AnnotationStateLocation before the label intervals, which steps through the windows and the
+    annotations together
+    """
+    timestamps = [x.timestamp for x in data]
+    if not timestamps:
+        return
+    windows = iter(windows.window(TimeInterval(min(timestamps) - timedelta(microseconds=1), max(timestamps))))
+    data = iter(data)
+    win_future = []
+    data_future = []
+    annotations = {}
+    while True:
+        if len(data_future) == 0:
+            try:
+                data_future.append(next(data))
+            except StopIteration:
+                pass
+        if len(win_future) == 0:
+            try:
+                _, win = next(windows)
+                win_future.append(win)
+                win_start = win.start
+                win_end = win.end
+                win_annotations = deepcopy(annotations)
+            except StopIteration:
+                pass
+        if len(win_future) == 0:
+            return
+        if len(data_future) > 0 and data_future[0].timestamp <= win_end:
+            tt, dd = data_future.pop(0)
+            tier, label = dd['tier'], dd['label']
+            if tier not in annotations:
+                annotations[tier] = set()
+            if dd['trigger'] == 1:
+                annotations[tier].add(label)
+            elif label in annotations[tier]:
+                annotations[tier].remove(label)
+            if tt > win_start:
+                win_annotations[tier] = {'MIX'}
+            else:
+                win_annotations[tier] = annotations[tier].copy()
+        else:
+            yield StreamInstance(win_end, dict((tier, list(labels)) for tier, labels in win_annotations.items()))
+            win_future.pop(0)
+
+
+def windows_of(bounds):
+    return Source([StreamInstance(t1 + end * second, TimeInterval(t1 + start * second, t1 + end * second))
+                   for start, end in bounds])
+
+
+class TestAnnotationStateLocation(unittest.TestCase):
+    def setUp(self):
+        # Ends without a start are logged as warnings
+        logging.disable(logging.WARNING)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def assert_matches_event_loop(self, windows, annotations):
+        interval = TimeInterval(t1 - 1000 * second, t1 + 1000 * second)
+        result = list(AnnotationStateLocation()._execute(
+            sources=[windows, Source(annotations)], alignment_stream=None, interval=interval))
+        expected = list(event_loop(windows, annotations))
+        sort = lambda instances: [(t, dict((tier, sorted(labels)) for tier, labels in value.items()))
+                                  for t, value in instances]
+        self.assertEqual(sort(result), sort(expected))
+        return sort(result)
+
+    def test_labels(self):
+        windows = windows_of((i, i + 10) for i in range(0, 100, 10))
+        annotations = [
+            event(5, 'Location', 'kitchen', 1),
+            # Closes exactly on the end of a window, so the tier is mixed in that window
+            event(20, 'Location', 'kitchen', -1),
+            event(20, 'Location', 'hall', 1),
+            # A tier that first appears part way through
+            event(42, 'Posture', 'standing', 1),
+            event(45, 'Posture', 'sitting', 1),
+            event(70, 'Posture', 'standing', -1),
+            event(75, 'Location', 'hall', -1)
+        ]
+        result = self.assert_matches_event_loop(windows, annotations)
+        self.assertEqual(result, [
+            (t1 + 10 * second, {'Location': ['MIX']}),
+            (t1 + 20 * second, {'Location': ['MIX']}),
+            (t1 + 30 * second, {'Location': ['hall']}),
+            (t1 + 40 * second, {'Location': ['hall']}),
+            (t1 + 50 * second, {'Location': ['hall'], 'Posture': ['MIX']}),
+            (t1 + 60 * second, {'Location': ['hall'], 'Posture': ['sitting', 'standing']}),
+            (t1 + 70 * second, {'Location': ['hall'], 'Posture': ['MIX']})])
+
+    def test_random(self):
+        random.seed(1)
+        for _ in range(50):
+            bounds, start = [], 0
+            for _ in range(random.randint(1, 30)):
+                start += random.choice((0, 0, 0, 5))
+                length = random.randint(1, 10)
+                bounds.append((start, start + length))
+                start += length
+            annotations = sorted(
+                (event(random.randint(-5, start + 5), random.choice(('Location', 'Posture', 'Activity')),
+                       random.choice('abc'), random.choice((1, 1, -1))) for _ in range(random.randint(1, 40))),
+                key=lambda instance: instance.timestamp)
+            self.assert_matches_event_loop(windows_of(bounds), annotations)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import imp
+import os
+import unittest
+from datetime import datetime, timedelta
+
+from hyperstream import TimeInterval, UTC
+from hyperstream.stream import StreamInstance
+
+TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sphere_plugins', 'sphere', 'tools')
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+second = timedelta(seconds=1)
+
+
+def load_tool(name, cls):
+    return getattr(imp.load_source(name, os.path.join(TOOLS, name, '2017-03-03_v0.0.1.py')), cls)
+
+
+class Source(object):
+    def __init__(self, instances):
+        self.instances = instances
+
+    def window(self, time_interval, force_calculation=False):
+        return iter(self.instances)
+
+
+class TestBlockKernels(unittest.TestCase):
+    interval = TimeInterval(t1, t1 + 10 * second)
+
+    def assert_block_matches(self, tool_class, width):
+        instances = [StreamInstance(t1 + (i + 1) * second, [float((i * (j + 3)) % 17) - 8 for j in range(width)])
+                     for i in range(10)]
+        per_instance = list(tool_class()._execute(sources=[Source(instances)], alignment_stream=None,
+                                                  interval=self.interval))
+        block = list(tool_class(block=True)._execute(sources=[Source(instances)], alignment_stream=None,
+                                                     interval=self.interval))
+
+        self.assertEqual(len(block), 1)
+        self.assertEqual(block[0].timestamp, self.interval.end)
+        timestamps, values = block[0].value
+        self.assertEqual(timestamps, [i.timestamp for i in per_instance])
+        self.assertEqual(values.tolist(), [i.value for i in per_instance])
+
+        # Nothing is emitted for an empty interval
+        self.assertEqual(list(tool_class(block=True)._execute(sources=[Source([])], alignment_stream=None,
+                                                              interval=self.interval)), [])
+
+    def test_acc_magnitude(self):
+        self.assert_block_matches(load_tool('calc_acc_magnitude', 'CalcAccMagnitude'), 3)
+
+    def test_bb_area(self):
+        self.assert_block_matches(load_tool('calc_bb_area', 'CalcBbArea'), 4)
+
+    def test_bb_volume(self):
+        self.assert_block_matches(load_tool('calc_bb_volume', 'CalcBbVolume'), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
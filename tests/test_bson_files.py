@@ -0,0 +1,117 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from bson import BSON
+from bson.errors import InvalidBSON
+from bson.regex import Regex
+
+from hyperstream import TimeInterval, UTC
+from sphere_plugins.sphere.channels.bson_files import BsonFileReader, BsonFileSource, INDEX_SUFFIX
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+second = timedelta(seconds=1)
+
+
+def write_bson(filename, docs):
+    with open(filename, 'wb') as f:
+        for doc in docs:
+            f.write(BSON.encode(doc))
+
+
+class TestBsonFiles(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_reader(self):
+        filename = os.path.join(self.path, 'wearable.bson')
+        # Out of order, with various fields before the datetime
+        docs = [dict(uid='a', seq=i, xl=[1.0, 2.0], meta={'x': 1}, datetime=t1 + ((i * 7) % 20) * second)
+                for i in range(20)]
+        docs.append(dict(pattern=Regex('^a'), datetime=t1 + 20 * second))
+        docs.append(dict(uid='no datetime'))
+        write_bson(filename, docs)
+
+        reader = BsonFileReader(filename)
+        self.assertTrue(os.path.exists(filename + INDEX_SUFFIX))
+        self.assertEqual(len(reader.times), 21)
+
+        result = list(reader.read(t1 + 4 * second, t1 + 8 * second))
+        self.assertEqual([doc['datetime'] for doc in result], [t1 + i * second for i in range(5, 9)])
+        self.assertEqual(result[0], [doc for doc in docs if doc.get('datetime') == t1 + 5 * second][0])
+        reader.close()
+
+        # The sidecar index is reused
+        reader = BsonFileReader(filename)
+        self.assertEqual(len(list(reader.read(t1 - second, t1 + 20 * second))), 21)
+        reader.close()
+
+    def test_invalid_lengths(self):
+        filename = os.path.join(self.path, 'wearable.bson')
+        valid = BSON.encode(dict(datetime=t1))
+        for data, offset in ((b'\x00\x00\x00\x00\x00', 0),
+                             (valid + b'\xfb\xff\xff\xff\x00', len(valid)),
+                             (valid + valid[:-1], len(valid)),
+                             (valid + b'\x05\x00', len(valid))):
+            with open(filename, 'wb') as f:
+                f.write(data)
+            with self.assertRaisesRegexp(InvalidBSON, 'at offset {} '.format(offset)):
+                BsonFileReader(filename)
+            self.assertFalse(os.path.exists(filename + INDEX_SUFFIX))
+
+    def test_source(self):
+        write_bson(os.path.join(self.path, 'wearable_1.bson'),
+                   [dict(datetime=t1 + i * second, hid='1') for i in range(0, 10, 2)])
+        write_bson(os.path.join(self.path, 'wearable_2.bson'),
+                   [dict(datetime=t1 + i * second, hid='2') for i in range(1, 10, 2)])
+        write_bson(os.path.join(self.path, 'video.bson'), [dict(datetime=t1 + second)])
+
+        source = BsonFileSource(self.path)
+        docs = list(source.get_data(TimeInterval(t1, t1 + 9 * second), 'wearable'))
+        self.assertEqual([doc['datetime'] for doc in docs], [t1 + i * second for i in range(1, 10)])
+        docs = list(source.get_data(TimeInterval(t1, t1 + 9 * second), 'wearable', filters={'hid': '2'}))
+        self.assertEqual(len(docs), 5)
+        source.close()
+
+    def test_parallel_decode(self):
+        for i in range(3):
+            write_bson(os.path.join(self.path, 'video_{}.bson'.format(i)),
+                       [dict(datetime=t1 + (3 * j + i) * second, uid=str(i), seq=j, features=[0.5] * j)
+                        if j % 4 else dict(datetime=t1 + (3 * j + i) * second, uid=str(i))
+                        for j in range(20)])
+        interval = TimeInterval(t1 + 5 * second, t1 + 50 * second)
+
+        serial = BsonFileSource(self.path)
+        parallel = BsonFileSource(self.path, processes=2, chunk_docs=4)
+        self.assertEqual(list(parallel.get_data(interval, 'video')), list(serial.get_data(interval, 'video')))
+        self.assertEqual(len(list(parallel.get_data(interval, 'video', filters={'uid': '1'}))), 15)
+        serial.close()
+        parallel.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from hyperstream import TimeInterval, UTC
+from sphere_plugins.sphere.channels.chunked_fetch import ChunkedFetcher
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+minute = timedelta(minutes=1)
+
+
+class SlowDatabase(object):
+    def __init__(self, docs, latency=0.05):
+        self.docs = docs
+        self.latency = latency
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def fetch(self, start, end, modality, elements, filters, rename_keys):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.latency)
+        with self.lock:
+            self.active -= 1
+        # Inclusive on both ends, so documents on the boundaries are returned twice
+        return [dict(doc) for doc in self.docs if start <= doc['datetime'] <= end]
+
+
+class TestChunkedFetch(unittest.TestCase):
+    def test_strict_order(self):
+        database = SlowDatabase([dict(datetime=t1 + i * minute, uid=str(i % 3)) for i in range(600)])
+        fetcher = ChunkedFetcher(chunk_size=60 * minute, workers=4, prefetch=6, fetch=database.fetch)
+        interval = TimeInterval(t1, t1 + 600 * minute)
+
+        docs = list(fetcher.get_data(interval, 'wearable'))
+        self.assertEqual(docs, [doc for doc in database.docs if doc['datetime'] > t1])
+        self.assertEqual(database.max_active, 4)
+
+    def test_single_chunk(self):
+        database = SlowDatabase([dict(datetime=t1 + i * minute) for i in range(10)], latency=0)
+        fetcher = ChunkedFetcher(chunk_size=60 * minute, fetch=database.fetch)
+        self.assertEqual(len(list(fetcher.get_data(TimeInterval(t1, t1 + 10 * minute), 'wearable'))), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
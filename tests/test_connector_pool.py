@@ -0,0 +1,74 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import os
+import threading
+import unittest
+
+from sphere_plugins.sphere.channels.connector_pool import ConnectorPool
+
+
+class TestConnectorPool(unittest.TestCase):
+    def test_threads(self):
+        pool = ConnectorPool(object, size=2)
+        main = pool.get()
+        self.assertIs(pool.get(), main)
+
+        connectors = []
+        barrier = threading.Event()
+
+        def worker():
+            connectors.append(pool.get())
+            barrier.wait()
+
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while len(connectors) < 3:
+            pass
+        metrics = pool.metrics()
+        self.assertEqual(metrics['connectors'], 2)
+        self.assertEqual(metrics['in_use'], 2)
+        self.assertEqual(metrics['threads'], 4)
+        self.assertEqual(len(set(map(id, connectors + [main]))), 2)
+
+        barrier.set()
+        for thread in threads:
+            thread.join()
+        metrics = pool.metrics()
+        self.assertEqual(metrics['threads'], 1)
+        self.assertEqual(metrics['created'], 2)
+        self.assertEqual(metrics['peak_in_use'], 2)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "requires fork")
+    def test_fork(self):
+        pool = ConnectorPool(object, size=2)
+        parent = pool.get()
+        pid = os.fork()
+        if pid == 0:
+            # The child must not reuse the parent's connector
+            ok = pool.get() is not parent and pool.metrics()['forks'] == 1 and pool.created == 1
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        self.assertIs(pool.get(), parent)
+
+
+if __name__ == '__main__':
+    unittest.main()
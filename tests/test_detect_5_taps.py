@@ -0,0 +1,138 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import imp
+import logging
+import os
+import random
+import unittest
+from datetime import datetime, timedelta
+
+from hyperstream import StreamId, TimeInterval, UTC
+from hyperstream.stream import StreamInstance
+
+TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sphere_plugins', 'sphere', 'tools')
+
+
+def load_tool(version):
+    return imp.load_source('detect_5_taps_' + version.replace('.', '_'),
+                           os.path.join(TOOLS, 'detect_5_taps', version + '.py')).Detect5Taps
+
+
+Detect5TapsLists = load_tool('2017-04-29_v0.0.1')
+Detect5Taps = load_tool('2026-10-18_v0.1.0')
+
+t1 = datetime(2017, 4, 29, 15, 26, 0, 0, UTC)
+second = timedelta(seconds=1)
+tick = timedelta(milliseconds=100)
+
+# As in the list_wearable_sync_events workflow: 8 second windows every second
+WINDOW = 8 * second
+
+
+class Magnitudes(object):
+    stream_id = StreamId('acc_per_uid_magnitude', meta_data=(('house', '1'), ('wearable', 'A')))
+
+    def __init__(self, instances):
+        self.instances = instances
+
+    def window(self, time_interval, force_calculation=False):
+        return iter([i for i in self.instances if time_interval.start < i.timestamp <= time_interval.end])
+
+
+class Windows(object):
+    def window(self, time_interval, force_calculation=False):
+        t = t1 + WINDOW
+        while t <= time_interval.end:
+            if t > time_interval.start:
+                yield StreamInstance(t, TimeInterval(t - WINDOW, t))
+            t += second
+
+
+class MagnitudeLists(Magnitudes):
+    """
+    The sliding lists of magnitudes that v0.0.1 took, one per window
+    """
+    def window(self, time_interval, force_calculation=False):
+        for t, window in Windows().window(time_interval):
+            yield StreamInstance(t, list(Magnitudes.window(self, window)))
+
+
+def magnitudes(bursts, seconds=60):
+    """
+    Magnitudes every 100ms below the threshold, apart from the bursts of taps
+    :param bursts: The (start, number of taps, spacing) of each burst, in seconds
+    """
+    values = [1.0 + 0.5 * random.random() for _ in range(int(seconds / 0.1))]
+    for start, taps, spacing in bursts:
+        for k in range(taps):
+            i = int(round((start + k * spacing) / 0.1))
+            values[i - 1] = max(values[i - 1], 1.9)
+            values[i] = 2.0 + random.random()
+    return [StreamInstance(t1 + (i + 1) * tick, value) for i, value in enumerate(values)]
+
+
+class TestDetect5Taps(unittest.TestCase):
+    def setUp(self):
+        # The detected taps are logged
+        logging.disable(logging.INFO)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def assert_matches_lists(self, data, step):
+        """
+        Runs v0.1.0 over consecutive intervals of step seconds, and compares the result with v0.0.1 over the whole time
+        """
+        interval = TimeInterval(t1, t1 + 60 * second)
+        expected = list(Detect5TapsLists()._execute(
+            sources=[MagnitudeLists(data)], alignment_stream=None, interval=interval))
+        result = []
+        for start in range(0, 60, step):
+            result.extend(Detect5Taps()._execute(
+                sources=[Windows(), Magnitudes(data)], alignment_stream=None,
+                interval=TimeInterval(t1 + start * second, t1 + (start + step) * second)))
+        self.assertEqual(result, expected)
+        return result
+
+    def test_bursts(self):
+        random.seed(3)
+        data = magnitudes([
+            # Taps across the boundary between intervals
+            (18.5, 5, 0.3),
+            # Too few taps
+            (31.0, 2, 0.3),
+            # Taps spread over more than 4 seconds
+            (40.0, 5, 1.2),
+            (51.0, 4, 0.4)])
+        result = self.assert_matches_lists(data, step=10)
+        self.assertEqual([len(r.value['tap_list']) for r in result], [5, 5, 5, 4, 4, 4])
+        self.assertEqual([r.timestamp for r in result],
+                         [t1 + s * second for s in (22, 23, 24, 55, 56, 57)])
+
+    def test_random(self):
+        random.seed(5)
+        for _ in range(20):
+            bursts = [(random.uniform(k * 12 + 1, k * 12 + 6), random.randint(1, 7), random.uniform(0.2, 1.0))
+                      for k in range(4)]
+            self.assert_matches_lists(magnitudes(bursts), step=random.choice((1, 7, 10, 60)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import unittest
+from datetime import datetime, timedelta
+
+from hyperstream import TimeInterval, StreamInstance, UTC
+from sphere_plugins.sphere.channels.memory_storage import ShiftingStreamInstanceCollection, \
+    SequencedStreamInstanceCollection, ColumnarStreamInstanceCollection, COLLISION_SHIFT
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+second = timedelta(seconds=1)
+interval = TimeInterval(t1 - second, t1 + 10 * second)
+
+
+class TestMemoryStorage(unittest.TestCase):
+    def test_shifting_collection(self):
+        collection = ShiftingStreamInstanceCollection()
+        collection.extend([StreamInstance(t1, i) for i in range(3)] + [StreamInstance(t1, 0)])
+        self.assertEqual(collection.window(interval), [
+            StreamInstance(t1, 0),
+            StreamInstance(t1 + COLLISION_SHIFT, 1),
+            StreamInstance(t1 + 2 * COLLISION_SHIFT, 2)
+        ])
+
+    def test_sequenced_collection(self):
+        collection = SequencedStreamInstanceCollection()
+        collection.extend([StreamInstance(t1 + second, 'a'), StreamInstance(t1, 'b'),
+                           StreamInstance(t1 + second, 'c'), StreamInstance(t1, 'd')])
+        self.assertEqual(len(collection), 4)
+        self.assertEqual(collection.window(interval), [
+            StreamInstance(t1, 'b'),
+            StreamInstance(t1, 'd'),
+            StreamInstance(t1 + second, 'a'),
+            StreamInstance(t1 + second, 'c')
+        ])
+        self.assertEqual(collection.window(TimeInterval(t1, t1 + second)), [
+            StreamInstance(t1 + second, 'a'),
+            StreamInstance(t1 + second, 'c')
+        ])
+
+    def test_columnar_collection(self):
+        instances = [StreamInstance(t1 + (i % 7) * second, dict(uid=str(i % 3), rss=-40 - i, x=i / 2.0))
+                     for i in range(20)]
+        # Ragged values, and keys missing from some rows
+        instances += [StreamInstance(t1 + i * second, dict(uid='A', xl=[i, i + 1])) for i in range(5)]
+        for chunk_size in (3, 4096):
+            columnar = ColumnarStreamInstanceCollection()
+            columnar.chunk_size = chunk_size
+            sequenced = SequencedStreamInstanceCollection()
+            for collection in (columnar, sequenced):
+                collection.extend(instances[:10])
+                collection.window(interval)
+                collection.extend(instances[10:])
+            self.assertEqual(len(columnar), len(instances))
+            for time_interval in (interval, TimeInterval(t1 + second, t1 + 3 * second)):
+                self.assertEqual(columnar.window(time_interval), sequenced.window(time_interval))
+
+    def test_deep_collisions(self):
+        # Used to recurse once per collision
+        collection = SequencedStreamInstanceCollection()
+        collection.extend(StreamInstance(t1, i) for i in range(5000))
+        self.assertEqual([v for t, v in collection.window(interval)], list(range(5000)))
+        collection = ShiftingStreamInstanceCollection()
+        collection.extend(StreamInstance(t1, i) for i in range(2000))
+        self.assertEqual(len(collection), 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()
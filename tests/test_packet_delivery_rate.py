@@ -0,0 +1,163 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import imp
+import os
+import random
+import unittest
+from datetime import datetime, timedelta
+
+from hyperstream import TimeInterval, UTC
+
+TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sphere_plugins', 'sphere', 'tools')
+
+pdr = imp.load_source('packet_delivery_rate_v0_0_1',
+                      os.path.join(TOOLS, 'packet_delivery_rate', '2017-01-20_v0.0.1.py'))
+
+
+def get_pdr_loop(seqnums, max_startup_seqnum=pdr.MAX_STARTUP_SEQNUM):
+    """
+    The original get_pdr, one seqnum at a time
+    """
+    total = 0
+    present = 0
+    current_set = set()
+    max_seqnum = None
+    for s in seqnums:
+        if s < pdr.MIN_SEQNUM:
+            continue
+        if max_seqnum is None or s > max_seqnum:
+            max_seqnum = s
+        if max_seqnum - s > pdr.MAX_OO_SEQNUM and (max_startup_seqnum is None or s <= pdr.MAX_STARTUP_SEQNUM):
+            if len(current_set):
+                total += max_seqnum - min(current_set) + 1
+                present += len(current_set)
+            current_set = set()
+            max_seqnum = s
+        current_set.add(s)
+    if len(current_set):
+        total += max_seqnum - min(current_set) + 1
+        present += len(current_set)
+    return (present, total, float(present) / total if total else 0.0)
+
+
+def random_seqnums(n):
+    """
+    Seqnums with losses, duplicates, reordering and reboots, including late seqnums far behind the largest one
+    """
+    seqnums = []
+    s = random.randint(1, 300)
+    for _ in range(n):
+        r = random.random()
+        if r < 0.05:
+            s = random.randint(1, 120)
+        elif r < 0.1 and seqnums:
+            seqnums.append(random.choice(seqnums))
+            continue
+        elif r < 0.15:
+            s = max(1, s - random.randint(1, 200))
+        else:
+            s += random.randint(1, 3)
+        seqnums.append(s)
+    return seqnums
+
+
+def split(seqnums):
+    cuts = sorted(random.randint(0, len(seqnums)) for _ in range(random.randint(0, 5)))
+    return [seqnums[i:j] for i, j in zip([0] + cuts, cuts + [len(seqnums)])]
+
+
+class TestPacketDeliveryRate(unittest.TestCase):
+    def test_get_pdr(self):
+        self.assertEqual(pdr.get_pdr([11, 12, 13, 14]), (4, 4, 1.0))
+        self.assertEqual(pdr.get_pdr([11, 12, 14, 13]), (4, 4, 1.0))
+        self.assertEqual(pdr.get_pdr([14, 13, 12, 11]), (4, 4, 1.0))
+        self.assertEqual(pdr.get_pdr([11, 12, 13, 13, 14]), (4, 4, 1.0))
+        self.assertEqual(pdr.get_pdr([11, 12, 14]), (3, 4, 0.75))
+        self.assertEqual(pdr.get_pdr([11, 14]), (2, 4, 0.5))
+        self.assertEqual(pdr.get_pdr([]), (0, 0, 0.0))
+        self.assertEqual(pdr.get_pdr([1, 2, 3]), (0, 0, 0.0))
+        self.assertEqual(pdr.get_pdr([100, 101, 102, 103, 5, 6, 7, 8]), (8, 8, 1.0))
+        self.assertEqual(pdr.get_pdr([100, 101, 6, 8]), (4, 5, 0.8))
+        self.assertEqual(pdr.get_pdr([1000, 56, 5]), (3, 3, 1.0))
+
+    def test_get_pdr_random(self):
+        random.seed(1)
+        for _ in range(500):
+            seqnums = random_seqnums(random.randint(0, 100))
+            for max_startup_seqnum in (pdr.MAX_STARTUP_SEQNUM, None):
+                self.assertEqual(pdr.get_pdr(seqnums, max_startup_seqnum), get_pdr_loop(seqnums, max_startup_seqnum))
+
+    def test_get_pdrs(self):
+        random.seed(2)
+        for _ in range(200):
+            seqnums_by_device = dict((device, random_seqnums(random.randint(0, 50))) for device in range(4))
+            for max_startup_seqnum in (pdr.MAX_STARTUP_SEQNUM, None):
+                self.assertEqual(pdr.get_pdrs(seqnums_by_device, max_startup_seqnum),
+                                 dict((device, get_pdr_loop(seqnums, max_startup_seqnum))
+                                      for device, seqnums in seqnums_by_device.items()))
+        self.assertEqual(pdr.get_pdrs({'a': [1, 2], 'b': []}), {'a': (0, 0, 0.0), 'b': (0, 0, 0.0)})
+
+    def test_streaming_late_seqnum(self):
+        # 150 is far behind the largest seqnum, but too large to be a reboot, so it is a duplicate
+        streaming = pdr.StreamingPdr()
+        results = [streaming.update('s', None, seqnums) for seqnums in ([150, 151], list(range(152, 260)), [150])]
+        self.assertEqual(results[-1], (0, 0, 0.0))
+        self.assertEqual(tuple(map(sum, zip(*results)))[:2], pdr.get_pdr(list(range(150, 260)) + [150])[:2])
+
+    def test_streaming_random_splits(self):
+        random.seed(3)
+        for _ in range(2000):
+            seqnums = random_seqnums(random.randint(0, 100))
+            expected = get_pdr_loop(seqnums)
+            streaming = pdr.StreamingPdr()
+            results = [streaming.update('s', 'd', part) for part in split(seqnums)]
+            self.assertEqual((sum(r[0] for r in results), sum(r[1] for r in results)), expected[:2], seqnums)
+
+    def test_streaming_tool(self):
+        random.seed(4)
+        t1 = datetime(2017, 1, 20, 0, 0, 0, 0, UTC)
+        documents = [(t1 + timedelta(minutes=i), dict((device, random_seqnums(20)) for device in 'ab'))
+                     for i in range(1, 31)]
+
+        class Source(object):
+            stream_id = 'seqnums'
+
+            def window(self, time_interval, force_calculation=False):
+                return iter([(t, d) for t, d in documents if time_interval.start < t <= time_interval.end])
+
+        tool = pdr.PacketDeliveryRate(streaming=True)
+        results = []
+        for start in range(0, 30, 7):
+            interval = TimeInterval(t1 + timedelta(minutes=start), t1 + timedelta(minutes=min(start + 7, 30)))
+            results.extend(tool._execute(sources=[Source()], alignment_stream=None, interval=interval))
+        self.assertEqual(len(results), len(documents))
+        for device in 'ab':
+            expected = get_pdr_loop([s for t, d in documents for s in d[device]])
+            self.assertEqual((sum(r.value[device][0] for r in results), sum(r.value[device][1] for r in results)),
+                             expected[:2])
+
+        # an interval that does not follow on from the last one starts afresh
+        interval = TimeInterval(t1, t1 + timedelta(minutes=1))
+        result = list(tool._execute(sources=[Source()], alignment_stream=None, interval=interval))[0]
+        self.assertEqual(result.value, pdr.get_pdrs(documents[0][1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import unittest
+from datetime import datetime
+
+from sphere_plugins.sphere.channels import projection
+
+t1 = datetime(2016, 4, 28, 20, 0, 0)
+
+
+class TestProjection(unittest.TestCase):
+    def test_project(self):
+        docs = [{'datetime': t1, 'hid': '1', 'uid': 'a', 'video-2DCen': [1, 2], 'video-FeaturesREID': list(range(100))}
+                for _ in range(projection.SAMPLE_EVERY + 1)]
+        projected = list(projection.project(docs, 'video_test', {'uid', 'video-2DCen'}))
+        self.assertEqual(projected[0], {'datetime': t1, 'hid': '1', 'uid': 'a', 'video-2DCen': [1, 2]})
+        self.assertIn('video-FeaturesREID', docs[0])
+
+        report = projection.dropped_fields_report()['video_test']
+        self.assertEqual(report['docs'], len(docs))
+        self.assertGreater(report['fraction_dropped'], 0.5)
+        self.assertLess(report['fraction_dropped'], 1)
+
+    def test_find_projected(self):
+        class Collection(object):
+            def find(self, query, projection):
+                finds.append((query, projection))
+                return self
+
+            def sort(self, field, direction):
+                sorts.append((field, direction))
+                return self
+
+        finds, sorts = [], []
+        t2 = datetime(2016, 4, 28, 21, 0, 0)
+        projection.find_projected(Collection(), t1, t2, {'uid': 'a'}, {'uid', 'video-2DCen'})
+        self.assertEqual(finds, [(
+            {'uid': 'a', 'datetime': {'$gt': t1, '$lte': t2}},
+            {'_id': False, 'datetime': True, 'hid': True, 'uid': True, 'video-2DCen': True})])
+        self.assertEqual(sorts, [('datetime', 1)])
+
+    def test_no_projection(self):
+        docs = [{'datetime': t1, 'x': 1}]
+        self.assertEqual(list(projection.project(docs, 'wearable_test', None)), docs)
+        self.assertNotIn('wearable_test', projection.dropped_fields_report())
+
+
+if __name__ == '__main__':
+    unittest.main()
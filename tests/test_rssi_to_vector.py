@@ -0,0 +1,99 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import imp
+import os
+import unittest
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from hyperstream import TimeInterval, UTC
+from hyperstream.stream import StreamInstance
+
+TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sphere_plugins', 'sphere', 'tools')
+
+RssiToVector = imp.load_source(
+    'rssi_to_vector', os.path.join(TOOLS, 'rssi_to_vector', '2016-10-25_v0.0.1.py')).RssiToVector
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+second = timedelta(seconds=1)
+
+PACKETS = [
+    StreamInstance(t1 + second, {'gw': [{'aid': 'a', 'rssi': -60}, {'aid': 'b', 'rssi': -70}]}),
+    # A missing value, a later subdoc for the same aid, and an aid that is not in the vector
+    StreamInstance(t1 + 2 * second, {'gw': [{'aid': 'a', 'rssi': None}, {'aid': 'c', 'rssi': -80},
+                                            {'aid': 'c', 'rssi': -75}, {'aid': 'x', 'rssi': -50}]}),
+    StreamInstance(t1 + 3 * second, {}),
+]
+
+
+class Source(object):
+    def __init__(self, instances):
+        self.instances = instances
+
+    def window(self, time_interval, force_calculation=False):
+        return iter(self.instances)
+
+
+def execute(tool, instances=PACKETS):
+    return list(tool._execute(sources=[Source(instances)], alignment_stream=None,
+                              interval=TimeInterval(t1, t1 + 3 * second)))
+
+
+class TestRssiToVector(unittest.TestCase):
+    aids = ['a', 'b', 'c', 'a']
+
+    def test_list(self):
+        self.assertEqual(execute(RssiToVector(self.aids, -100)), [
+            StreamInstance(t1 + second, [-60, -70, -100, -60]),
+            StreamInstance(t1 + 2 * second, [None, -100, -75, None]),
+            StreamInstance(t1 + 3 * second, [-100, -100, -100, -100])])
+
+    def test_rows(self):
+        rows = execute(RssiToVector(self.aids, -100, output='rows'))
+        self.assertEqual([row.timestamp for row in rows], [instance.timestamp for instance in PACKETS])
+        self.assertTrue(all(row.value.dtype == np.float32 for row in rows))
+        np.testing.assert_array_equal(np.array([row.value for row in rows]), [
+            [-60, -70, -100, -60],
+            [np.nan, -100, -75, np.nan],
+            [-100, -100, -100, -100]])
+
+    def test_block(self):
+        block = execute(RssiToVector(self.aids, None, output='block'))
+        self.assertEqual(len(block), 1)
+        self.assertEqual(block[0].timestamp, t1 + 3 * second)
+        timestamps, matrix = block[0].value
+        self.assertEqual(timestamps, [instance.timestamp for instance in PACKETS])
+        self.assertEqual(matrix.dtype, np.float32)
+        # A None default value is NaN as well
+        np.testing.assert_array_equal(matrix, [
+            [-60, -70, np.nan, -60],
+            [np.nan, np.nan, -75, np.nan],
+            [np.nan, np.nan, np.nan, np.nan]])
+
+        self.assertEqual(execute(RssiToVector(self.aids, None, output='block'), []), [])
+
+    def test_output(self):
+        with self.assertRaises(ValueError):
+            RssiToVector(self.aids, -100, output='matrix')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import unittest
+from datetime import datetime, timedelta
+
+from hyperstream import TimeInterval, UTC
+from sphere_plugins.sphere.channels.projection import project
+from sphere_plugins.sphere.channels.shared_scan import SharedScan, get_shared_scan
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+minute = timedelta(minutes=1)
+
+DOCS = {
+    'environmental': [dict(datetime=t1 + i * minute, uid='e', temperature=20.0 + i) for i in range(3)],
+    'wearable': [dict(datetime=t1 + i * minute, uid='w', aid='a', rss=-60 - i, xl1=[0, 0, 1]) for i in range(3)]
+}
+
+
+class FakeModality(object):
+    fetched = []
+
+    def __init__(self, modality):
+        self.modality = modality
+
+    def get_data(self, elements, filters, rename_keys):
+        FakeModality.fetched.append(self.modality)
+        return [dict(doc) for doc in DOCS[self.modality]]
+
+
+class FakeWindow(object):
+    opened = 0
+
+    def __init__(self, time_interval):
+        FakeWindow.opened += 1
+        self.modalities = dict((modality, FakeModality(modality)) for modality in DOCS)
+
+    def get_data(self, modality, elements=None, filters=None, rename_keys=False, fields=None):
+        # As SphereDataWindow does without a direct database connection
+        return project(self.modalities[modality].get_data(elements, filters, rename_keys), modality, fields)
+
+
+class TestSharedScan(unittest.TestCase):
+    def setUp(self):
+        FakeWindow.opened = 0
+        FakeModality.fetched = []
+
+    def test_one_window_per_interval(self):
+        scan = SharedScan([dict(modality='environmental'),
+                           dict(modality='wearable', elements={'rss'}, fields={'uid', 'aid', 'rss'})],
+                          open_window=FakeWindow)
+        interval = TimeInterval(t1, t1 + 3 * minute)
+
+        self.assertEqual(scan.get_data(interval, 'environmental'), DOCS['environmental'])
+        rss = scan.get_data(interval, 'wearable', elements={'rss'}, fields={'rss', 'aid', 'uid'})
+        self.assertEqual([sorted(doc) for doc in rss], [['aid', 'datetime', 'rss', 'uid']] * 3)
+        self.assertEqual(FakeWindow.opened, 1)
+
+        # Queries that are not part of the scan are left to the caller
+        self.assertIsNone(scan.get_data(interval, 'wearable', elements={'xl'}))
+
+        # A new interval scans every query again
+        FakeModality.fetched = []
+        next_interval = TimeInterval(t1 + 3 * minute, t1 + 6 * minute)
+        scan.get_data(next_interval, 'environmental')
+        self.assertEqual(sorted(FakeModality.fetched), ['environmental', 'wearable'])
+        self.assertEqual(FakeWindow.opened, 2)
+
+        # Executing the same interval again only fetches the query that was already taken
+        FakeModality.fetched = []
+        self.assertEqual(scan.get_data(next_interval, 'environmental'), DOCS['environmental'])
+        self.assertEqual(FakeModality.fetched, ['environmental'])
+        self.assertEqual(FakeWindow.opened, 3)
+
+    def test_overlapping_interval(self):
+        scan = SharedScan([dict(modality='environmental'), dict(modality='wearable')], open_window=FakeWindow)
+        interval = TimeInterval(t1, t1 + 3 * minute)
+        scan.get_data(interval, 'environmental')
+
+        # Part of the interval was already calculated for the other factor, so it only needs the rest of it
+        FakeModality.fetched = []
+        scan.get_data(TimeInterval(t1 + minute, t1 + 3 * minute), 'wearable')
+        self.assertEqual(FakeModality.fetched, ['wearable'])
+        self.assertEqual(list(scan.pending), [(interval, ('wearable', None, 'null', False, None))])
+
+        # The documents of the scan are still there for a factor that executes the whole interval
+        FakeModality.fetched = []
+        self.assertEqual(scan.get_data(interval, 'wearable'), DOCS['wearable'])
+        self.assertEqual(FakeModality.fetched, [])
+        self.assertEqual(FakeWindow.opened, 2)
+
+    def test_scope(self):
+        scan = SharedScan([dict(modality='environmental'), dict(modality='wearable')], open_window=FakeWindow)
+        self.assertIsNone(get_shared_scan())
+        with scan:
+            self.assertIs(get_shared_scan(), scan)
+            scan.get_data(TimeInterval(t1, t1 + 3 * minute), 'environmental')
+            self.assertEqual(len(scan.pending), 1)
+
+            # Moving on to the next interval drops the unclaimed wearable documents of the last one
+            scan.get_data(TimeInterval(t1 + 3 * minute, t1 + 6 * minute), 'environmental')
+            self.assertEqual(list(scan.pending), [(TimeInterval(t1 + 3 * minute, t1 + 6 * minute),
+                                                   ('wearable', None, 'null', False, None))])
+
+        # As does leaving the with block
+        self.assertIsNone(get_shared_scan())
+        self.assertEqual(scan.pending, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import imp
+import os
+import unittest
+from datetime import datetime, timedelta
+
+from hyperstream import TimeInterval, UTC
+from hyperstream.stream import StreamInstance, StreamMetaInstance
+
+TOOLS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sphere_plugins', 'sphere', 'tools')
+sphere = imp.load_source('sphere_tool', os.path.join(TOOLS, 'sphere', '2017-04-21_v0.2.0.py'))
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+second = timedelta(seconds=1)
+
+
+def record(t, **value):
+    return StreamMetaInstance(stream_instance=StreamInstance(t, value), meta_data=('house', '1'))
+
+
+class TestSphereDedupe(unittest.TestCase):
+    def run_interval(self, deduplicator, interval, records):
+        deduplicator.start(interval)
+        return [r.stream_instance.value for r in deduplicator.process(records)]
+
+    def test_merge_by_house_and_timestamp(self):
+        deduplicator = sphere.StreamingDeduplicator('raise', keys=())
+        records = [record(t1 + second, a=1), record(t1 + second, b=2), record(t1 + 2 * second, a=3)]
+        self.assertEqual(self.run_interval(deduplicator, TimeInterval(t1, t1 + 2 * second), records),
+                         [{'a': 1, 'b': 2}, {'a': 3}])
+        self.assertEqual(deduplicator.counts['merged'], 1)
+
+        with self.assertRaises(ValueError):
+            deduplicator.start(TimeInterval(t1, t1 + 2 * second))
+            list(deduplicator.process([record(t1 + second, a=1), record(t1 + second, a=2)]))
+
+    def test_carry_over(self):
+        deduplicator = sphere.StreamingDeduplicator('first', keys=('uid',))
+        first = TimeInterval(t1, t1 + 2 * second)
+        self.run_interval(deduplicator, first, [record(t1 + 2 * second, uid='a')])
+
+        # The duplicate on the boundary was written with the previous interval
+        second_interval = TimeInterval(t1 + 2 * second, t1 + 4 * second)
+        values = self.run_interval(deduplicator, second_interval,
+                                   [record(t1 + 2 * second, uid='a'), record(t1 + 2 * second, uid='b')])
+        self.assertEqual(values, [{'uid': 'b'}])
+        self.assertEqual(deduplicator.counts['carried_over'], 1)
+
+    def test_rerun_and_gap_forget_carry_over(self):
+        deduplicator = sphere.StreamingDeduplicator('first', keys=())
+        interval = TimeInterval(t1, t1 + 2 * second)
+        records = [record(t1 + 2 * second, a=1)]
+        self.assertEqual(self.run_interval(deduplicator, interval, records), [{'a': 1}])
+
+        # Re-running the same interval, e.g. after a purge, must emit the records again
+        self.assertEqual(self.run_interval(deduplicator, interval, records), [{'a': 1}])
+
+        # As must an interval that does not follow on from the last one
+        self.run_interval(deduplicator, TimeInterval(t1 + 2 * second, t1 + 4 * second), [record(t1 + 4 * second, a=2)])
+        gap = TimeInterval(t1 + 10 * second, t1 + 12 * second)
+        self.assertEqual(self.run_interval(deduplicator, gap, [record(t1 + 4 * second, a=2)]), [{'a': 2}])
+        self.assertEqual(deduplicator.counts['carried_over'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from pymongo import DESCENDING
+
+from hyperstream import TimeInterval, TimeIntervals, StreamId, UTC
+from hyperstream.utils import MIN_DATE
+from sphere_plugins.sphere.channels.sphere_channel import SphereChannel
+from sphere_plugins.sphere.channels.watermarks import FileWatermarkSource, SphereWatermarkSource
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+second = timedelta(seconds=1)
+
+
+class Cursor(list):
+    def sort(self, key, direction):
+        self.calls.append(('sort', key, direction))
+        return self
+
+    def limit(self, n):
+        self.calls.append(('limit', n))
+        return Cursor(self[:n])
+
+
+class Collection(object):
+    def __init__(self, datetimes):
+        self.datetimes = datetimes
+        self.calls = []
+
+    def find(self, query, projection):
+        self.calls.append(('find', query, projection))
+        docs = [{'datetime': dt} for dt in sorted(self.datetimes, reverse=True) if dt > query['datetime']['$gt']]
+        cursor = Cursor(docs)
+        cursor.calls = self.calls
+        return cursor
+
+
+class TestSphereTailing(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def ingest(self, modality, *timestamps):
+        with open(os.path.join(self.path, modality + '.jsonl'), 'a') as f:
+            for t in timestamps:
+                f.write(json.dumps({'datetime': t.isoformat(), 'uid': 'a'}) + '\n')
+
+    def test_watermarks(self):
+        channel = SphereChannel("sphere_test")
+        stream = channel.create_stream(stream_id=StreamId('environmental'))
+        self.ingest('environmental', t1 + second, t1 + 3 * second)
+        self.ingest('wearable', t1 + 2 * second)
+
+        up_to = channel.start_tailing(FileWatermarkSource(self.path), ['environmental', 'wearable'], start=t1)
+        self.assertEqual(up_to, t1 + 2 * second)
+        self.assertEqual(stream.calculated_intervals, TimeIntervals([(MIN_DATE, t1 + 2 * second)]))
+        self.assertEqual(channel.watermarks['environmental'], t1 + 3 * second)
+        self.assertEqual(channel.new_data_since(t1), TimeInterval(t1, t1 + 2 * second))
+        self.assertEqual(channel.new_data_since(t1, 'environmental'), TimeInterval(t1, t1 + 3 * second))
+
+        # Nothing new has arrived
+        self.assertEqual(channel.refresh_watermarks(), t1 + 2 * second)
+        self.assertIsNone(channel.new_data_since(t1 + 2 * second))
+
+        # Only the wearable catches up, and a late document does not move the watermark back
+        self.ingest('wearable', t1 + 5 * second, t1 + 4 * second)
+        self.assertEqual(channel.refresh_watermarks(), t1 + 3 * second)
+        self.assertEqual(channel.new_data_since(t1 + 2 * second), TimeInterval(t1 + 2 * second, t1 + 3 * second))
+        self.assertEqual(channel.watermarks['wearable'], t1 + 5 * second)
+        self.assertEqual(stream.calculated_intervals, TimeIntervals([(MIN_DATE, t1 + 3 * second)]))
+
+    def test_sphere_watermarks(self):
+        collection = Collection([t1 + second, t1 + 3 * second, t1 + 2 * second])
+        source = SphereWatermarkSource({'environmental': collection}, filters={'hid': 1})
+        self.assertEqual(source.newest('environmental', since=t1), t1 + 3 * second)
+        self.assertIsNone(source.newest('environmental', since=t1 + 3 * second))
+
+        # Only the newest datetime is fetched
+        self.assertEqual(collection.calls[:3], [
+            ('find', {'hid': 1, 'datetime': {'$gt': t1}}, {'_id': False, 'datetime': True}),
+            ('sort', 'datetime', DESCENDING),
+            ('limit', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,436 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import unittest
+from datetime import datetime, timedelta
+from itertools import count
+
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from bson.son import SON
+from mongoengine import NotUniqueError
+
+from hyperstream import StreamId, StreamInstance, TimeInterval, TimeIntervals, DatabaseStream, UTC
+
+from sphere_plugins.sphere.channels import summary_channel
+from sphere_plugins.sphere.channels.summary_channel import SummaryChannel, SummaryStream, ensure_stream_key_index
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+minute = timedelta(minutes=1)
+
+MISSING = object()
+
+
+def normalise(value):
+    """
+    Converts a value as BSON would: naive UTC datetimes, plain dicts and lists
+    """
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(UTC).replace(tzinfo=None)
+    if isinstance(value, dict):
+        return dict((k, normalise(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [normalise(v) for v in value]
+    return value
+
+
+def aware(value):
+    """
+    Converts a stored value as a tz aware client would read it
+    """
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=UTC)
+    if isinstance(value, dict):
+        return dict((k, aware(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [aware(v) for v in value]
+    return value
+
+
+def is_operator(value):
+    return isinstance(value, dict) and len(value) > 0 and all(k.startswith('$') for k in value)
+
+
+OPERATORS = {
+    '$in': lambda value, arg: value in arg,
+    '$nin': lambda value, arg: not any(v in arg for v in value) if isinstance(value, list) else value not in arg,
+    '$gt': lambda value, arg: value is not MISSING and value > arg,
+    '$gte': lambda value, arg: value is not MISSING and value >= arg,
+    '$lte': lambda value, arg: value is not MISSING and value <= arg,
+    '$exists': lambda value, arg: (value is not MISSING) == arg
+}
+
+
+def same(a, b):
+    """
+    Embedded documents only match in mongo if their keys are in the same order
+    """
+    if isinstance(a, dict) and isinstance(b, dict):
+        return list(a) == list(b) and all(same(a[k], b[k]) for k in a)
+    return a == b
+
+
+def matches(doc, query):
+    for field, condition in query.items():
+        value = doc.get(field, MISSING)
+        if is_operator(condition):
+            if not all(OPERATORS[op](value, arg) for op, arg in condition.items()):
+                return False
+        elif not same(value, condition):
+            return False
+    return True
+
+
+def apply_update(doc, update, inserting):
+    for op, fields in update.items():
+        for path, arg in fields.items():
+            parent = doc
+            keys = path.split('.')
+            for key in keys[:-1]:
+                parent = parent.setdefault(key, {})
+            key = keys[-1]
+            if op == '$setOnInsert':
+                if inserting:
+                    parent[key] = arg
+            elif op == '$inc':
+                parent[key] = parent.get(key, 0) + arg
+            elif op == '$min':
+                parent[key] = min(parent[key], arg) if key in parent else arg
+            elif op == '$max':
+                parent[key] = max(parent[key], arg) if key in parent else arg
+            elif op == '$push':
+                parent.setdefault(key, []).extend(arg['$each'])
+            else:
+                raise NotImplementedError(op)
+
+
+class DuplicateKey(Exception):
+    pass
+
+
+class BulkWriteResult(object):
+    def __init__(self, upserted_ids):
+        self.upserted_ids = upserted_ids
+
+
+class Cursor(object):
+    def __init__(self, docs, projection):
+        self.docs = docs
+        self.projection = projection
+
+    def sort(self, field, direction):
+        return Cursor(sorted(self.docs, key=lambda doc: doc[field], reverse=direction < 0), self.projection)
+
+    def batch_size(self, n):
+        return self
+
+    def __iter__(self):
+        # Projected after sorting, as in mongo
+        keep = [k for k, v in self.projection.items() if v] if self.projection else None
+        if keep is not None and self.projection.get('_id', 1):
+            keep.append('_id')
+        for doc in self.docs:
+            yield doc if keep is None else dict((k, doc[k]) for k in keep if k in doc)
+
+
+class FakeCollection(object):
+    """
+    Just enough of a pymongo collection for the summary channel: unique indexes, upserts and the query operators it uses
+    """
+    def __init__(self, name='summaries'):
+        self.name = name
+        self.docs = []
+        self.indexes = {}
+        self.ids = count()
+        self.bulk_writes = 0
+        self.queries = []
+        # Called before the next bulk write, e.g. to let another writer in between a read and a write
+        self.before_bulk_write = []
+
+    def index_information(self):
+        return dict((name, {'key': fields}) for name, fields in self.indexes.items())
+
+    def create_index(self, keys, unique=False, name=None):
+        self.indexes[name] = [k for k, _ in keys]
+
+    def insert_one(self, doc):
+        doc = normalise(doc)
+        doc['_id'] = next(self.ids)
+        for fields in self.indexes.values():
+            if any(all(d.get(f) == doc.get(f) for f in fields) for d in self.docs):
+                raise DuplicateKey()
+        self.docs.append(doc)
+        return doc['_id']
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        query = normalise(query)
+        return Cursor([aware(doc) for doc in self.docs if matches(doc, query)], projection)
+
+    def find_one(self, query, projection=None):
+        return next(iter(self.find(query, projection)), None)
+
+    def bulk_write(self, requests, ordered=True):
+        while self.before_bulk_write:
+            self.before_bulk_write.pop(0)()
+        self.bulk_writes += 1
+        errors, upserted = [], []
+        for i, request in enumerate(requests):
+            try:
+                _id = self._write(request)
+            except DuplicateKey:
+                errors.append({'index': i, 'code': 11000, 'errmsg': 'E11000 duplicate key error'})
+                if ordered:
+                    break
+                continue
+            if _id is not None:
+                upserted.append({'index': i, '_id': _id})
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'upserted': upserted})
+        return BulkWriteResult(dict((u['index'], u['_id']) for u in upserted))
+
+    def _write(self, request):
+        query = normalise(request._filter)
+        existing = [doc for doc in self.docs if matches(doc, query)]
+        if isinstance(request, ReplaceOne):
+            if existing:
+                existing[0].clear()
+                existing[0].update(normalise(request._doc), _id=existing[0].get('_id'))
+                return None
+            return self.insert_one(request._doc)
+        if existing:
+            apply_update(existing[0], normalise(request._doc), inserting=False)
+            return None
+        doc = dict((k, v) for k, v in query.items() if not is_operator(v))
+        apply_update(doc, normalise(request._doc), inserting=True)
+        return self.insert_one(doc)
+
+
+class StreamDefinition(object):
+    """
+    Stands in for the StreamDefinitionModel of a stream
+    """
+    def __init__(self):
+        self.intervals = TimeIntervals()
+
+    def get_calculated_intervals(self):
+        return self.intervals
+
+    def set_calculated_intervals(self, intervals):
+        self.intervals = TimeIntervals(intervals)
+
+
+class TestSummaryChannel(unittest.TestCase):
+    models = (summary_channel.SummaryInstanceModel, summary_channel.SummaryBucketModel,
+              summary_channel.SummaryRollupModel)
+
+    def setUp(self):
+        self.collections = dict((model, FakeCollection()) for model in self.models)
+        for model in self.models:
+            model._get_collection = classmethod(lambda cls: self.collections[cls])
+
+    def tearDown(self):
+        for model in self.models:
+            # Falls back to the Document class method again
+            del model._get_collection
+
+    @staticmethod
+    def create_stream(channel, name, stream_type=SummaryStream):
+        stream_id = StreamId(name, meta_data=(('house', '1'),))
+        stream = stream_type(channel=channel, stream_id=stream_id, calculated_intervals=None, last_accessed=None,
+                             last_updated=None, sandbox=None, mongo_model=StreamDefinition())
+        # The stream definition would otherwise be saved to the hyperstream database
+        stream.save = lambda: None
+        channel.streams[stream_id] = stream
+        return stream
+
+    @staticmethod
+    def execute(stream, interval, instances):
+        # As Tool.execute does: one writer call per instance, then the interval is marked as calculated
+        for instance in instances:
+            stream.writer(instance)
+        stream.calculated_intervals += interval
+
+    def test_one_bulk_write_per_interval(self):
+        channel = SummaryChannel('summary_test', write_batch_size=100)
+        stream = self.create_stream(channel, 'rss_count')
+        collection = self.collections[summary_channel.SummaryInstanceModel]
+        interval = TimeInterval(t1, t1 + 60 * minute)
+        instances = [StreamInstance(t1 + (i + 1) * minute, i) for i in range(60)]
+
+        for instance in instances:
+            stream.writer(instance)
+        self.assertEqual(collection.bulk_writes, 0)
+        stream.calculated_intervals += interval
+        self.assertEqual(collection.bulk_writes, 1)
+        self.assertEqual(list(channel.get_results(stream, interval)), instances)
+
+        # Full batches are written as they fill up, and the rest at the end of the interval
+        self.execute(stream, TimeInterval(t1 + 60 * minute, t1 + 310 * minute),
+                     [StreamInstance(t1 + (i + 61) * minute, i) for i in range(250)])
+        self.assertEqual(collection.bulk_writes, 4)
+        self.assertEqual(len(collection.docs), 310)
+
+    def test_loaded_streams_are_batched(self):
+        channel = SummaryChannel('summary_test')
+        stream = self.create_stream(channel, 'rss_count', stream_type=DatabaseStream)
+        collection = self.collections[summary_channel.SummaryInstanceModel]
+        self.execute(stream, TimeInterval(t1, t1 + 10 * minute),
+                     [StreamInstance(t1 + (i + 1) * minute, i) for i in range(10)])
+        self.assertIsInstance(stream, SummaryStream)
+        self.assertEqual(collection.bulk_writes, 1)
+        self.assertEqual(stream.calculated_intervals, TimeIntervals([TimeInterval(t1, t1 + 10 * minute)]))
+
+    def test_raw_reader(self):
+        channel = SummaryChannel('summary_test', read_batch_size=2)
+        stream = self.create_stream(channel, 'rss_count')
+        instances = [StreamInstance(t1 + (i + 1) * minute, {'a': i, 'b': [i]}) for i in range(5)]
+        self.execute(stream, TimeInterval(t1, t1 + 5 * minute), reversed(instances))
+        self.assertEqual(list(channel.get_results(stream, TimeInterval(t1, t1 + 5 * minute))), instances)
+        # Intervals are open on the left and closed on the right
+        self.assertEqual(list(channel.get_results(stream, TimeInterval(t1 + minute, t1 + 3 * minute))), instances[1:3])
+        self.assertEqual(list(channel.get_results(stream, TimeInterval(t1 - minute, t1))), [])
+        other = self.create_stream(channel, 'rss_total')
+        self.assertEqual(list(channel.get_results(other, TimeInterval(t1, t1 + 5 * minute))), [])
+
+    def test_conflicts(self):
+        channel = SummaryChannel('summary_test')
+        stream = self.create_stream(channel, 'rss_count')
+        collection = self.collections[summary_channel.SummaryInstanceModel]
+        interval = TimeInterval(t1, t1 + 2 * minute)
+        self.execute(stream, interval, [StreamInstance(t1 + minute, SON([('a', 1), ('b', 2)])),
+                                        StreamInstance(t1 + 2 * minute, 2)])
+
+        # Rewriting the same values is a no-op, even with the keys of an embedded document in a different order
+        self.execute(stream, interval, [StreamInstance(t1 + minute, SON([('b', 2), ('a', 1)])),
+                                        StreamInstance(t1 + 2 * minute, 2)])
+        self.assertEqual(len(collection.docs), 2)
+
+        # A different value is reported, while the rest of the batch is still written
+        with self.assertRaises(NotUniqueError):
+            self.execute(stream, TimeInterval(t1, t1 + 3 * minute), [StreamInstance(t1 + 2 * minute, 3),
+                                                                     StreamInstance(t1 + 3 * minute, 4)])
+        self.assertEqual([(doc['datetime'], doc['value']) for doc in collection.docs],
+                         [(datetime(2016, 4, 28, 20, 1), {'a': 1, 'b': 2}), (datetime(2016, 4, 28, 20, 2), 2),
+                          (datetime(2016, 4, 28, 20, 3), 4)])
+
+    def test_rollups_count_new_documents_only(self):
+        channel = SummaryChannel('summary_test', rollup_tiers=('day',))
+        stream = self.create_stream(channel, 'rss_count')
+        self.execute(stream, TimeInterval(t1, t1 + 3 * minute),
+                     [StreamInstance(t1 + (i + 1) * minute, i + 1) for i in range(3)])
+        with self.assertRaises(NotUniqueError):
+            self.execute(stream, TimeInterval(t1, t1 + 5 * minute),
+                         [StreamInstance(t1 + 2 * minute, 2), StreamInstance(t1 + 3 * minute, 30),
+                          StreamInstance(t1 + 4 * minute, 4), StreamInstance(t1 + 5 * minute, 5)])
+        day = datetime(2016, 4, 29, tzinfo=UTC)
+        self.assertEqual(list(channel.get_results(stream, TimeInterval(t1, t1 + 5 * minute), timedelta(days=1))),
+                         [StreamInstance(day, 1 + 2 + 3 + 4 + 5)])
+        rollups = self.collections[summary_channel.SummaryRollupModel].docs
+        self.assertEqual([doc['count'] for doc in rollups], [5])
+
+    def test_get_results_many(self):
+        channel = SummaryChannel('summary_test', max_streams_per_query=2)
+        interval = TimeInterval(t1, t1 + 3 * minute)
+        streams = [self.create_stream(channel, 'rss_count_{}'.format(i)) for i in range(5)]
+        for i, stream in enumerate(streams):
+            self.execute(stream, interval, [StreamInstance(t1 + (j + 1) * minute, [i, j]) for j in range(i)])
+        collection = self.collections[summary_channel.SummaryInstanceModel]
+        del collection.queries[:]
+
+        results = channel.get_results_many(streams, TimeInterval(t1 + minute, t1 + 3 * minute))
+        self.assertEqual(len(collection.queries), 3)
+        self.assertEqual(set(results), set(stream.stream_id for stream in streams))
+        for i, stream in enumerate(streams):
+            expected = [StreamInstance(t1 + (j + 1) * minute, [i, j]) for j in range(1, min(i, 3))]
+            self.assertEqual(list(results[stream.stream_id]), expected)
+            self.assertEqual(list(channel.get_results(stream, TimeInterval(t1 + minute, t1 + 3 * minute))), expected)
+
+    def test_bucketed(self):
+        channel = SummaryChannel('summary_test', bucketed=True)
+        stream = self.create_stream(channel, 'rss_count')
+        collection = self.collections[summary_channel.SummaryBucketModel]
+        interval = TimeInterval(t1, t1 + 300 * minute)
+        instances = [StreamInstance(t1 + (i + 1) * 60 * minute, i) for i in range(5)]
+        self.execute(stream, interval, instances)
+        self.assertEqual([doc['day'] for doc in collection.docs], [datetime(2016, 4, 28), datetime(2016, 4, 29)])
+        self.assertEqual(list(channel.get_results(stream, interval)), instances)
+        self.assertEqual(list(channel.get_results(stream, TimeInterval(t1 + 60 * minute, t1 + 240 * minute))),
+                         instances[1:4])
+
+        self.execute(stream, interval, instances)
+        self.assertEqual(sum(len(doc['datetimes']) for doc in collection.docs), 5)
+        with self.assertRaises(NotUniqueError):
+            self.execute(stream, interval, [StreamInstance(t1 + 60 * minute, 10)])
+
+    def test_bucketed_concurrent_writers(self):
+        channel = SummaryChannel('summary_test', bucketed=True)
+        stream = self.create_stream(channel, 'rss_count')
+        other = self.create_stream(SummaryChannel('summary_test', bucketed=True), 'rss_count')
+        collection = self.collections[summary_channel.SummaryBucketModel]
+        interval = TimeInterval(t1, t1 + 300 * minute)
+        instances = [StreamInstance(t1 + (i + 1) * 60 * minute, i) for i in range(5)]
+        self.execute(stream, interval, instances[:2])
+
+        # The other writer pushes to both days after the buckets have been read, so both pushes have to be retried
+        collection.before_bulk_write.append(lambda: self.execute(other, interval, instances[1:2] + instances[3:4]))
+        self.execute(stream, interval, instances)
+        self.assertEqual(collection.bulk_writes, 4)
+        self.assertEqual(list(channel.get_results(stream, interval)), instances)
+        self.assertEqual([len(doc['datetimes']) for doc in collection.docs], [3, 2])
+
+    def test_ensure_stream_key_index(self):
+        collection = FakeCollection()
+        ensure_stream_key_index(collection, 'datetime')
+        self.assertEqual(collection.indexes, {'stream_key_1_datetime_1': ['stream_key', 'datetime']})
+
+        # Documents written before the stream_key have to be migrated before the index can be built
+        collection = FakeCollection()
+        collection.insert_one({'stream_id': {'name': 'rss_count', 'meta_data': []}, 'datetime': t1, 'value': 1})
+        with self.assertRaises(RuntimeError):
+            ensure_stream_key_index(collection, 'datetime')
+        self.assertEqual(collection.indexes, {})
+
+        # Once the index exists the collection is not checked again
+        collection.create_index([('stream_key', 1), ('datetime', 1)], unique=True, name='stream_key_1_datetime_1')
+        del collection.queries[:]
+        ensure_stream_key_index(collection, 'datetime')
+        self.assertEqual(collection.queries, [])
+
+    def test_unmigrated_collection(self):
+        collection = self.collections[summary_channel.SummaryInstanceModel]
+        collection.insert_one({'stream_id': {'name': 'rss_count', 'meta_data': []}, 'datetime': t1, 'value': 1})
+        channel = SummaryChannel('summary_test')
+        stream = self.create_stream(channel, 'rss_count')
+        with self.assertRaises(RuntimeError):
+            list(channel.get_results(stream, TimeInterval(t1, t1 + minute)))
+        with self.assertRaises(RuntimeError):
+            self.execute(stream, TimeInterval(t1, t1 + minute), [StreamInstance(t1 + minute, 1)])
+
+    def test_reads_write_out_the_buffer(self):
+        channel = SummaryChannel('summary_test')
+        stream = self.create_stream(channel, 'rss_count')
+        stream.writer(StreamInstance(t1 + minute, 1))
+        self.assertEqual(list(channel.get_results(stream, TimeInterval(t1, t1 + minute))),
+                         [StreamInstance(t1 + minute, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import unittest
+from datetime import datetime, timedelta
+
+from bson.son import SON
+from pymongo import UpdateOne
+
+from hyperstream import StreamId, StreamInstance, UTC
+
+from sphere_plugins.sphere.channels import summary_channel
+from sphere_plugins.sphere.channels.summary_channel import SummaryChannel, _merge, _rollup_kind, _rollup_update
+from sphere_plugins.sphere.utils.stream_keys import summary_stream_key
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+
+
+class TestSummaryRollups(unittest.TestCase):
+    def test_rollups_are_opt_in(self):
+        self.assertEqual(SummaryChannel('summary_test').rollup_tiers, [])
+
+    def test_dict_total(self):
+        stream_id = StreamId('vid_per_uid_counts_agg_total', meta_data=(('house', '1'),))
+        kind = _rollup_kind(stream_id)
+        self.assertEqual(kind, 'sum')
+
+        merged = None
+        for value in ({'a': 1, 'b': 2}, {'a': 3, 'c': 'x'}, 4, None):
+            merged = _merge(kind, merged, value)
+        self.assertEqual(dict(merged), {'a': 4, 'b': 2})
+        self.assertEqual(_rollup_update(kind, merged), {'$inc': {'value.a': 4, 'value.b': 2}})
+
+    def test_numeric_total(self):
+        merged = None
+        for value in (1, 2.5, {'a': 1}, 'x', True):
+            merged = _merge('sum', merged, value)
+        self.assertEqual(merged, 3.5)
+        self.assertEqual(_rollup_update('sum', merged), {'$inc': {'value': 3.5}})
+
+    def test_range_skips_non_numeric(self):
+        merged = None
+        for value in ([1, None, 3], ['x'], 0.5, {'a': 1}):
+            merged = _merge('range', merged, value)
+        self.assertEqual(merged, (0.5, 3))
+
+    def test_update_rollups_with_dict_total(self):
+        channel = SummaryChannel('summary_test', rollup_tiers=('day',))
+        updates = []
+
+        class Collection(object):
+            def bulk_write(self, requests, ordered=True):
+                updates.extend(requests)
+
+        stream_id = StreamId('vid_per_uid_counts_agg_total', meta_data=(('house', '1'),))
+        instances = [StreamInstance(t1 + timedelta(minutes=i), {'a': i}) for i in range(3)]
+        original = summary_channel.SummaryRollupModel._get_collection
+        summary_channel.SummaryRollupModel._get_collection = classmethod(lambda cls: Collection())
+        try:
+            channel._update_rollups(stream_id, instances)
+        finally:
+            summary_channel.SummaryRollupModel._get_collection = original
+        self.assertEqual(updates, [UpdateOne(
+            {'stream_key': summary_stream_key(stream_id), 'tier': 'day', 'datetime': datetime(2016, 4, 29)},
+            {
+                '$inc': {'value.a': 3, 'count': 3},
+                '$setOnInsert': {'stream_id': SON([('name', stream_id.name), ('meta_data', stream_id.meta_data)]),
+                                 'kind': 'sum'}
+            },
+            upsert=True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import random
+import unittest
+from datetime import datetime, timedelta
+
+from hyperstream import TimeInterval, UTC
+from sphere_plugins.sphere.utils.utils import sweep
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+second = timedelta(seconds=1)
+
+
+def brute_force(windows, data):
+    return [(window, [value for t, value in data if window.start <= t <= window.end]) for _, window in windows]
+
+
+class TestSweep(unittest.TestCase):
+    def test_inclusive_bounds(self):
+        windows = [(t1 + 2 * second, TimeInterval(t1, t1 + 2 * second)),
+                   (t1 + 4 * second, TimeInterval(t1 + 2 * second, t1 + 4 * second))]
+        data = [(t1 + i * second, i) for i in range(6)]
+        # The data on the boundary belongs to both windows, and the data before and after them to neither
+        self.assertEqual(list(sweep(windows, data)), [(windows[0][1], [0, 1, 2]), (windows[1][1], [2, 3, 4])])
+
+    def test_overlapping_windows(self):
+        random.seed(42)
+        data = sorted((t1 + random.randint(0, 1000) * second, i) for i in range(300))
+        starts = sorted(random.randint(-50, 1000) for _ in range(100))
+        intervals = [TimeInterval(t1 + s * second, t1 + (s + random.randint(1, 200)) * second) for s in starts]
+        # In order of their starts, as sweep requires, so long windows contain some of the later, shorter ones
+        windows = sorted(((interval.end, interval) for interval in intervals), key=lambda w: (w[1].start, w[0]))
+        self.assertEqual(list(sweep(windows, data)), brute_force(windows, data))
+
+    def test_nested_windows(self):
+        windows = [(t1 + 10 * second, TimeInterval(t1, t1 + 10 * second)),
+                   (t1 + 3 * second, TimeInterval(t1 + second, t1 + 3 * second)),
+                   (t1 + 9 * second, TimeInterval(t1 + 8 * second, t1 + 9 * second))]
+        data = [(t1 + i * second, i) for i in range(12)]
+        self.assertEqual(list(sweep(windows, data)), brute_force(windows, data))
+
+    def test_empty(self):
+        window = TimeInterval(t1, t1 + second)
+        self.assertEqual(list(sweep([(t1 + second, window)], [])), [(window, [])])
+        self.assertEqual(list(sweep([], [(t1, 0)])), [])
+
+    def test_unordered_windows(self):
+        windows = [(t1 + 3 * second, TimeInterval(t1 + second, t1 + 3 * second)),
+                   (t1 + 2 * second, TimeInterval(t1, t1 + 2 * second))]
+        with self.assertRaises(ValueError):
+            list(sweep(windows, [(t1, 0)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# The MIT License (MIT) # Copyright (c) 2014-2017 University of Bristol
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#  EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+#  MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+#  DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+#  OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE
+#  OR OTHER DEALINGS IN THE SOFTWARE.
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from hyperstream import TimeInterval, UTC
+from sphere_plugins.sphere.channels.window_cache import RawWindowCache
+
+t1 = datetime(2016, 4, 28, 20, 0, 0, 0, UTC)
+minute = timedelta(minutes=1)
+
+
+class FakeDatabase(object):
+    def __init__(self, docs):
+        self.docs = sorted(docs, key=lambda doc: doc['datetime'])
+        self.queries = 0
+
+    def fetch(self, start, end, modality, elements, filters, rename_keys):
+        self.queries += 1
+        return [dict(doc) for doc in self.docs if start < doc['datetime'] <= end]
+
+
+class TestWindowCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.database = FakeDatabase([dict(datetime=t1 + i * minute, uid='a', rss=-i) for i in range(180)] +
+                                     [dict(datetime=t1 + i * minute, uid='b') for i in range(0, 180, 7)])
+        self.cache = RawWindowCache(self.path, bucket_size=timedelta(hours=1), fetch=self.database.fetch)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_read_through(self):
+        interval = TimeInterval(t1 + 30 * minute, t1 + 150 * minute)
+        expected = self.database.fetch(interval.start, interval.end, 'wearable', None, None, False)
+
+        self.assertEqual(list(self.cache.get_data(interval, 'wearable')), expected)
+        self.assertEqual(self.cache.misses, 3)
+        queries = self.database.queries
+        self.assertEqual(list(self.cache.get_data(interval, 'wearable')), expected)
+        self.assertEqual(self.database.queries, queries)
+        self.assertEqual(self.cache.hits, 3)
+
+        # A different query is cached separately
+        list(self.cache.get_data(interval, 'wearable', elements={'rss'}))
+        self.assertEqual(self.cache.misses, 6)
+
+    def test_open_buckets_not_cached(self):
+        self.cache.settle_time = datetime.now(UTC) - t1 - 90 * minute
+        interval = TimeInterval(t1, t1 + 180 * minute)
+        expected = self.database.fetch(interval.start, interval.end, 'wearable', None, None, False)
+
+        self.assertEqual(list(self.cache.get_data(interval, 'wearable')), expected)
+        self.assertEqual(self.cache.misses, 1)
+        queries = self.database.queries
+        self.assertEqual(list(self.cache.get_data(interval, 'wearable')), expected)
+        self.assertEqual(self.database.queries, queries + 1)
+
+    def test_eviction(self):
+        for i in range(3):
+            list(self.cache.get_data(TimeInterval(t1 + i * 60 * minute, t1 + (i + 1) * 60 * minute), 'wearable'))
+        self.cache.max_bytes = self.cache.total_bytes - 1
+        self.cache.evict()
+        self.assertEqual(len(list(self.cache._files())), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()